@@ -0,0 +1,30 @@
+"""add_expiry_to_user_google_tokens
+
+Revision ID: 3f9c2a7d1e4b
+Revises: b55b2a1eb62a
+Create Date: 2026-10-17 10:02:11.418233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a7d1e4b'
+down_revision: Union[str, None] = 'b55b2a1eb62a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('user_google_tokens', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('expiry', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('user_google_tokens', schema=None) as batch_op:
+        batch_op.drop_column('expiry')
@@ -0,0 +1,41 @@
+"""order_gmail_list_indexes
+
+Revision ID: a1f6d3b8c5e2
+Revises: e7b2c4f8a1d9
+Create Date: 2026-10-18 09:12:44.530917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1f6d3b8c5e2'
+down_revision: Union[str, None] = 'e7b2c4f8a1d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Match the list queries' ORDER BY (date DESC NULLS LAST, id DESC) so a page is read off the index
+    with op.batch_alter_table('gmail_message_labels', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_message_labels_user_label_date')
+        batch_op.create_index('ix_gmail_message_labels_user_label_date', ['user_email', 'label_id', sa.text('internal_date DESC NULLS LAST'), sa.text('message_id DESC')], unique=False)
+
+    with op.batch_alter_table('gmail_threads', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_threads_user_latest_internal_date')
+        batch_op.create_index('ix_gmail_threads_user_latest_internal_date', ['user_email', sa.text('latest_internal_date DESC NULLS LAST'), sa.text('id DESC')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('gmail_threads', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_threads_user_latest_internal_date')
+        batch_op.create_index('ix_gmail_threads_user_latest_internal_date', ['user_email', 'latest_internal_date'], unique=False)
+
+    with op.batch_alter_table('gmail_message_labels', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_message_labels_user_label_date')
+        batch_op.create_index('ix_gmail_message_labels_user_label_date', ['user_email', 'label_id', 'internal_date'], unique=False)
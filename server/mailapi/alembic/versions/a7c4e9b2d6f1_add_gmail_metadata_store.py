@@ -0,0 +1,97 @@
+"""add_gmail_metadata_store
+
+Revision ID: a7c4e9b2d6f1
+Revises: 3f9c2a7d1e4b
+Create Date: 2026-10-17 11:24:37.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c4e9b2d6f1'
+down_revision: Union[str, None] = '3f9c2a7d1e4b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('gmail_messages',
+    sa.Column('user_email', sa.String(), nullable=False),
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('thread_id', sa.String(), nullable=False),
+    sa.Column('label_ids', sa.JSON(), nullable=False),
+    sa.Column('history_id', sa.BigInteger(), nullable=True),
+    sa.Column('internal_date', sa.BigInteger(), nullable=True),
+    sa.Column('snippet', sa.Text(), nullable=True),
+    sa.Column('subject', sa.Text(), nullable=True),
+    sa.Column('from_addr', sa.Text(), nullable=True),
+    sa.Column('to_addr', sa.Text(), nullable=True),
+    sa.Column('cc_addr', sa.Text(), nullable=True),
+    sa.Column('date_header', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('user_email', 'id')
+    )
+    with op.batch_alter_table('gmail_messages', schema=None) as batch_op:
+        batch_op.create_index('ix_gmail_messages_user_thread', ['user_email', 'thread_id'], unique=False)
+        batch_op.create_index('ix_gmail_messages_user_internal_date', ['user_email', 'internal_date'], unique=False)
+
+    op.create_table('gmail_message_labels',
+    sa.Column('user_email', sa.String(), nullable=False),
+    sa.Column('message_id', sa.String(), nullable=False),
+    sa.Column('label_id', sa.String(), nullable=False),
+    sa.Column('thread_id', sa.String(), nullable=False),
+    sa.Column('internal_date', sa.BigInteger(), nullable=True),
+    sa.PrimaryKeyConstraint('user_email', 'message_id', 'label_id')
+    )
+    with op.batch_alter_table('gmail_message_labels', schema=None) as batch_op:
+        batch_op.create_index('ix_gmail_message_labels_user_label_date', ['user_email', 'label_id', 'internal_date'], unique=False)
+        batch_op.create_index('ix_gmail_message_labels_user_thread_label', ['user_email', 'thread_id', 'label_id'], unique=False)
+
+    op.create_table('gmail_threads',
+    sa.Column('user_email', sa.String(), nullable=False),
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('history_id', sa.BigInteger(), nullable=True),
+    sa.Column('snippet', sa.Text(), nullable=True),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('label_ids', sa.JSON(), nullable=False),
+    sa.Column('latest_message_id', sa.String(), nullable=True),
+    sa.Column('latest_message_subject', sa.Text(), nullable=True),
+    sa.Column('latest_message_from', sa.Text(), nullable=True),
+    sa.Column('latest_message_date', sa.String(), nullable=True),
+    sa.Column('latest_internal_date', sa.BigInteger(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('user_email', 'id')
+    )
+    with op.batch_alter_table('gmail_threads', schema=None) as batch_op:
+        batch_op.create_index('ix_gmail_threads_user_latest_internal_date', ['user_email', 'latest_internal_date'], unique=False)
+
+    op.create_table('gmail_sync_state',
+    sa.Column('user_email', sa.String(), nullable=False),
+    sa.Column('history_id', sa.BigInteger(), nullable=True),
+    sa.Column('synced_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('user_email')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('gmail_sync_state')
+    with op.batch_alter_table('gmail_threads', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_threads_user_latest_internal_date')
+    op.drop_table('gmail_threads')
+    with op.batch_alter_table('gmail_message_labels', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_message_labels_user_thread_label')
+        batch_op.drop_index('ix_gmail_message_labels_user_label_date')
+    op.drop_table('gmail_message_labels')
+    with op.batch_alter_table('gmail_messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_messages_user_internal_date')
+        batch_op.drop_index('ix_gmail_messages_user_thread')
+    op.drop_table('gmail_messages')
@@ -0,0 +1,43 @@
+"""add_gmail_backfill_state
+
+Revision ID: b3e7f1c9a2d4
+Revises: f2d8c4a1b7e5
+Create Date: 2026-10-17 19:12:08.417305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e7f1c9a2d4'
+down_revision: Union[str, None] = 'f2d8c4a1b7e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('gmail_backfill_state',
+    sa.Column('user_email', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('generation', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('page_token', sa.String(), nullable=True),
+    sa.Column('history_id', sa.BigInteger(), nullable=True),
+    sa.Column('messages_total', sa.Integer(), nullable=True),
+    sa.Column('messages_listed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('messages_stored', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('user_email')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('gmail_backfill_state')
@@ -0,0 +1,34 @@
+"""order_gmail_thread_importance_index
+
+Revision ID: b4e8a2c6d9f3
+Revises: a1f6d3b8c5e2
+Create Date: 2026-10-18 10:03:17.284551
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4e8a2c6d9f3'
+down_revision: Union[str, None] = 'a1f6d3b8c5e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # In order=importance's read order, over scored threads only
+    with op.batch_alter_table('gmail_threads', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_threads_user_importance')
+        batch_op.create_index('ix_gmail_threads_user_importance', ['user_email', sa.text('importance DESC NULLS LAST'), sa.text('id DESC')],
+                              unique=False, postgresql_where=sa.text('importance IS NOT NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('gmail_threads', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_threads_user_importance')
+        batch_op.create_index('ix_gmail_threads_user_importance', ['user_email', 'importance'], unique=False)
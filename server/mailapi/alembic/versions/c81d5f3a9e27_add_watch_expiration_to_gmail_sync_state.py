@@ -0,0 +1,30 @@
+"""add_watch_expiration_to_gmail_sync_state
+
+Revision ID: c81d5f3a9e27
+Revises: a7c4e9b2d6f1
+Create Date: 2026-10-17 14:36:52.107394
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c81d5f3a9e27'
+down_revision: Union[str, None] = 'a7c4e9b2d6f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('gmail_sync_state', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('watch_expiration', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('gmail_sync_state', schema=None) as batch_op:
+        batch_op.drop_column('watch_expiration')
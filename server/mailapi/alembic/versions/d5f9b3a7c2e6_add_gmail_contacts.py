@@ -0,0 +1,70 @@
+"""add_gmail_contacts
+
+Revision ID: d5f9b3a7c2e6
+Revises: c8a4e2d6f1b3
+Create Date: 2026-10-17 22:06:31.774520
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f9b3a7c2e6'
+down_revision: Union[str, None] = 'c8a4e2d6f1b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('gmail_contacts',
+    sa.Column('user_email', sa.String(), nullable=False),
+    sa.Column('address', sa.String(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('sent_count', sa.Integer(), nullable=False),
+    sa.Column('received_count', sa.Integer(), nullable=False),
+    sa.Column('thread_count', sa.Integer(), nullable=False),
+    sa.Column('last_sent_at', sa.BigInteger(), nullable=True),
+    sa.Column('last_received_at', sa.BigInteger(), nullable=True),
+    sa.Column('my_reply_count', sa.Integer(), nullable=False),
+    sa.Column('my_reply_ms', sa.BigInteger(), nullable=False),
+    sa.Column('their_reply_count', sa.Integer(), nullable=False),
+    sa.Column('their_reply_ms', sa.BigInteger(), nullable=False),
+    sa.Column('log_score', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('user_email', 'address')
+    )
+    with op.batch_alter_table('gmail_contacts', schema=None) as batch_op:
+        batch_op.create_index('ix_gmail_contacts_user_log_score', ['user_email', 'log_score'], unique=False)
+
+    op.create_table('gmail_contact_edges',
+    sa.Column('user_email', sa.String(), nullable=False),
+    sa.Column('address_a', sa.String(), nullable=False),
+    sa.Column('address_b', sa.String(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('last_at', sa.BigInteger(), nullable=True),
+    sa.PrimaryKeyConstraint('user_email', 'address_a', 'address_b')
+    )
+    with op.batch_alter_table('gmail_contact_edges', schema=None) as batch_op:
+        batch_op.create_index('ix_gmail_contact_edges_user_address_b', ['user_email', 'address_b'], unique=False)
+
+    with op.batch_alter_table('gmail_sync_state', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('contacts_indexed_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('gmail_sync_state', schema=None) as batch_op:
+        batch_op.drop_column('contacts_indexed_at')
+
+    with op.batch_alter_table('gmail_contact_edges', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_contact_edges_user_address_b')
+
+    op.drop_table('gmail_contact_edges')
+    with op.batch_alter_table('gmail_contacts', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_contacts_user_log_score')
+
+    op.drop_table('gmail_contacts')
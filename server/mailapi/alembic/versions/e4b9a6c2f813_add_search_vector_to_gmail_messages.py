@@ -0,0 +1,44 @@
+"""add_search_vector_to_gmail_messages
+
+Revision ID: e4b9a6c2f813
+Revises: c81d5f3a9e27
+Create Date: 2026-10-17 15:48:09.552816
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b9a6c2f813'
+down_revision: Union[str, None] = 'c81d5f3a9e27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match GMAIL_MESSAGE_SEARCH_VECTOR in shared/database_models/models.py
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(subject, '')), 'A') || "
+    "setweight(to_tsvector('simple', translate(coalesce(from_addr, '') || ' ' || coalesce(to_addr, '') || ' ' || coalesce(cc_addr, ''), '@.<>', '    ')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(snippet, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(body_text, '')), 'D')"
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('gmail_messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('body_text', sa.Text(), nullable=True))
+    with op.batch_alter_table('gmail_messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(SEARCH_VECTOR, persisted=True), nullable=True))
+        batch_op.create_index('ix_gmail_messages_search_vector', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('gmail_messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_messages_search_vector', postgresql_using='gin')
+        batch_op.drop_column('search_vector')
+        batch_op.drop_column('body_text')
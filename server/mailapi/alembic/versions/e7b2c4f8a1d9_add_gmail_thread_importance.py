@@ -0,0 +1,34 @@
+"""add_gmail_thread_importance
+
+Revision ID: e7b2c4f8a1d9
+Revises: d5f9b3a7c2e6
+Create Date: 2026-10-17 23:41:52.108364
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b2c4f8a1d9'
+down_revision: Union[str, None] = 'd5f9b3a7c2e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('gmail_threads', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('importance', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('owes_reply', sa.Boolean(), nullable=True))
+        batch_op.create_index('ix_gmail_threads_user_importance', ['user_email', 'importance'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('gmail_threads', schema=None) as batch_op:
+        batch_op.drop_index('ix_gmail_threads_user_importance')
+        batch_op.drop_column('owes_reply')
+        batch_op.drop_column('importance')
@@ -0,0 +1,30 @@
+"""add_local_revision_to_gmail_sync_state
+
+Revision ID: f2d8c4a1b7e5
+Revises: e4b9a6c2f813
+Create Date: 2026-10-17 18:02:41.553120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2d8c4a1b7e5'
+down_revision: Union[str, None] = 'e4b9a6c2f813'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('gmail_sync_state', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('local_revision', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('gmail_sync_state', schema=None) as batch_op:
+        batch_op.drop_column('local_revision')
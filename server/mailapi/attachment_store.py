@@ -0,0 +1,224 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import tempfile
+import uuid
+from contextlib import AbstractAsyncContextManager
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+# On-disk, content-addressed cache for Gmail attachments.
+#
+#   <root>/blobs/ab/abcdef...   decoded bytes, named by their sha256 (shared by every message
+#                               and user that has the same attachment)
+#   <root>/refs/<key>.json      (user, message, attachmentId) -> {"sha256", "size"}; the key is
+#                               hashed so addresses never appear in file names
+#
+# Blobs are evicted least recently used (by mtime, touched on every read) once the cache
+# grows past ATTACHMENT_CACHE_MAX_BYTES. A ref whose blob was evicted is just a miss.
+
+ATTACHMENT_CACHE_DIR = os.getenv("ATTACHMENT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mailapi-attachments"))
+ATTACHMENT_CACHE_MAX_BYTES = int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", str(2 * 1024 ** 3))) # 2 GiB
+ATTACHMENT_CHUNK_BYTES = 64 * 1024
+
+_DATA_FIELD = re.compile(rb'"data"\s*:\s*"')
+
+
+class AttachmentBlob:
+    def __init__(self, sha256: str, size: int, path: str):
+        self.sha256 = sha256
+        self.size = size
+        self.path = path
+
+
+class _DataFieldDecoder:
+    """Pulls the base64url "data" string out of an attachments.get JSON body as it streams in.
+
+    Only a few bytes of undecoded base64 are held at a time, never the whole attachment.
+    """
+
+    def __init__(self):
+        self._state = 'seek' # seek -> value -> done
+        self._buffer = b''
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self._state == 'done':
+            return b''
+        self._buffer += chunk
+        if self._state == 'seek':
+            match = _DATA_FIELD.search(self._buffer)
+            if match is None:
+                self._buffer = self._buffer[-64:] # Enough to catch the key split across chunks
+                return b''
+            self._buffer = self._buffer[match.end():]
+            self._state = 'value'
+        end = self._buffer.find(b'"')
+        if end != -1:
+            self._state = 'done'
+            encoded, self._buffer = self._buffer[:end].rstrip(b'='), b''
+            return base64.urlsafe_b64decode(encoded + b'=' * (-len(encoded) % 4))
+        usable = len(self._buffer) - len(self._buffer) % 4
+        encoded, self._buffer = self._buffer[:usable], self._buffer[usable:]
+        return base64.urlsafe_b64decode(encoded)
+
+    @property
+    def complete(self) -> bool:
+        return self._state == 'done'
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parses a single `bytes=` range into inclusive (start, end).
+
+    Returns None for no (or an unsupported multi-) range, meaning "send everything".
+    Raises ValueError when the range cannot be satisfied (-> 416).
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    start_text, _, end_text = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if not start_text: # Suffix range: the last N bytes
+            length = int(end_text)
+            start, end = max(0, size - length), size - 1
+            if length <= 0:
+                start = size # Unsatisfiable below
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None # Malformed: ignore the header, as RFC 9110 allows
+    if start >= size or start > end:
+        raise ValueError(f"Range {range_header} not satisfiable for {size} bytes")
+    return start, min(end, size - 1)
+
+
+class AttachmentStore:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None # Computed by the first eviction scan
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _ref_path(self, user_email: str, message_id: str, attachment_id: str) -> str:
+        key = hashlib.sha256(f"{user_email}\0{message_id}\0{attachment_id}".encode('utf-8')).hexdigest()
+        return os.path.join(self.root, 'refs', f"{key}.json")
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256)
+
+    def _lookup(self, ref_path: str) -> Optional[AttachmentBlob]:
+        try:
+            with open(ref_path) as f:
+                ref = json.load(f)
+            path = self._blob_path(ref['sha256'])
+            os.utime(path) # Mark as recently used; raises if the blob was evicted
+            return AttachmentBlob(ref['sha256'], ref['size'], path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    async def get_or_fetch(
+        self, user_email: str, message_id: str, attachment_id: str,
+        open_stream: Callable[[], AbstractAsyncContextManager],
+    ) -> AttachmentBlob:
+        """Returns the cached blob, downloading it once (per worker) if needed.
+
+        `open_stream` opens the attachments.get response, e.g. google_http.stream_async(request).
+        """
+        ref_path = self._ref_path(user_email, message_id, attachment_id)
+        blob = await run_in_threadpool(self._lookup, ref_path)
+        if blob is not None:
+            return blob
+        task = self._inflight.get(ref_path)
+        if task is None:
+            task = asyncio.create_task(self._download(ref_path, open_stream))
+            self._inflight[ref_path] = task
+            task.add_done_callback(lambda _: self._inflight.pop(ref_path, None))
+        return await asyncio.shield(task)
+
+    async def _download(self, ref_path: str, open_stream: Callable[[], AbstractAsyncContextManager]) -> AttachmentBlob:
+        os.makedirs(os.path.join(self.root, 'tmp'), exist_ok=True)
+        temp_path = os.path.join(self.root, 'tmp', uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        decoder = _DataFieldDecoder()
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                async with open_stream() as response:
+                    async for chunk in response.aiter_bytes(ATTACHMENT_CHUNK_BYTES): # Decompressed, still streaming
+                        data = decoder.feed(chunk)
+                        if data:
+                            digest.update(data)
+                            size += len(data)
+                            await run_in_threadpool(f.write, data)
+            if not decoder.complete:
+                raise ValueError("attachments.get response had no data field")
+            sha256 = digest.hexdigest()
+            await run_in_threadpool(self._commit, temp_path, sha256, size, ref_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        await run_in_threadpool(self._evict_if_needed)
+        return AttachmentBlob(sha256, size, self._blob_path(sha256))
+
+    def _commit(self, temp_path: str, sha256: str, size: int, ref_path: str):
+        blob_path = self._blob_path(sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+        if os.path.exists(blob_path):
+            os.utime(blob_path) # Same bytes already stored for another message or user
+        else:
+            os.replace(temp_path, blob_path)
+            if self._total_bytes is not None:
+                self._total_bytes += size
+        ref_temp_path = f"{ref_path}.{uuid.uuid4().hex}.tmp"
+        with open(ref_temp_path, 'w') as f:
+            json.dump({'sha256': sha256, 'size': size}, f)
+        os.replace(ref_temp_path, ref_path)
+
+    def _evict_if_needed(self):
+        if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+            return
+        blobs = []
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, 'blobs')):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in blobs)
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9 # Leave headroom so we don't rescan on every download
+            for _, size, path in sorted(blobs):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            print(f"Attachment cache evicted down to {total} bytes")
+        self._total_bytes = total
+
+    async def iter_file(self, blob: AttachmentBlob, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Yields bytes start..end (inclusive) of a blob in ATTACHMENT_CHUNK_BYTES chunks."""
+        end = blob.size - 1 if end is None else end
+        f = await run_in_threadpool(open, blob.path, 'rb') # Open handle survives a concurrent eviction
+        try:
+            await run_in_threadpool(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await run_in_threadpool(f.read, min(ATTACHMENT_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+
+attachment_store = AttachmentStore(ATTACHMENT_CACHE_DIR, ATTACHMENT_CACHE_MAX_BYTES)
@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Optional
+
+import google.oauth2.credentials
+
+
+class TTLCache:
+    """Small in-process LRU cache with an optional per-entry TTL.
+
+    Entries are evicted least-recently-used first once `max_entries` is reached,
+    and treated as missing once they are older than `ttl_seconds` (if set; `set()` can
+    override it per entry). Safe to use from the event loop and from threadpool workers.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at is not None and time.monotonic() > expires_at:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)  # Mark as most recently used
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl_seconds if ttl_seconds is not None else None, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)  # Evict least recently used
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item is not None else default
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        """Snapshot of (key, value) pairs that have not expired, oldest first."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value) for key, (expires_at, value) in self._data.items()
+                if expires_at is None or now <= expires_at
+            ]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CachedCredentials:
+    """A Google credentials object plus what we know about when it expires."""
+
+    def __init__(self, credentials: google.oauth2.credentials.Credentials):
+        self.credentials = credentials
+
+    @property
+    def expiry(self) -> Optional[datetime]:
+        # google-auth keeps expiry as a naive UTC datetime (None if unknown)
+        return self.credentials.expiry
+
+    def expires_within(self, seconds: float) -> bool:
+        """True if the access token expires in the next `seconds` (or already has)."""
+        if self.expiry is None:
+            return False  # Unknown expiry: rely on the cache TTL instead
+        return self.expiry - timedelta(seconds=seconds) <= datetime.utcnow()
+
+
+class CredentialsCache:
+    """Per-worker cache of Google credentials keyed by user email.
+
+    Saves the `UserGoogleToken` lookup and `Credentials` construction on every
+    authenticated request. Must be invalidated whenever new tokens are written.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, refresh_margin_seconds: float):
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.refresh_margin_seconds = refresh_margin_seconds
+
+    def get(self, user_email: str) -> Optional[google.oauth2.credentials.Credentials]:
+        """Returns cached credentials, or None if missing, stale or close to expiring."""
+        entry: Optional[CachedCredentials] = self._cache.get(user_email)
+        if entry is None:
+            return None
+        if entry.expires_within(self.refresh_margin_seconds) or not entry.credentials.valid:
+            return None  # Let the caller go through the refresh path
+        return entry.credentials
+
+    def set(self, user_email: str, credentials: google.oauth2.credentials.Credentials) -> None:
+        self._cache.set(user_email, CachedCredentials(credentials))
+
+    def invalidate(self, user_email: str) -> None:
+        self._cache.pop(user_email)
+
+    def entries(self) -> Dict[str, CachedCredentials]:
+        return dict(self._cache.items())
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+credentials_cache = CredentialsCache(
+    max_entries=int(os.getenv("CREDENTIALS_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("CREDENTIALS_CACHE_TTL_SECONDS", "900")),  # 15 minutes
+    refresh_margin_seconds=float(os.getenv("CREDENTIALS_REFRESH_MARGIN_SECONDS", "300")),  # 5 minutes
+)
+
+
+# Latest-message fields shown by /gmail/threads, keyed by (user_email, thread_id, historyId).
+# A thread's historyId changes whenever anything in it changes, so an entry never goes stale;
+# the TTL only stops inactive mailboxes from holding on to memory.
+thread_enrichment_cache = TTLCache(
+    max_entries=int(os.getenv("THREAD_ENRICHMENT_CACHE_MAX_ENTRIES", "20000")),
+    ttl_seconds=float(os.getenv("THREAD_ENRICHMENT_CACHE_TTL_SECONDS", "86400")),  # 1 day
+)
+
+# Processed (decoded) bodies and attachment descriptors per (user_email, message_id).
+# Message content never changes after delivery; labels are merged in fresh on every read.
+message_body_cache = TTLCache(
+    max_entries=int(os.getenv("MESSAGE_BODY_CACHE_MAX_ENTRIES", "1000")),
+    ttl_seconds=float(os.getenv("MESSAGE_BODY_CACHE_TTL_SECONDS", "3600")),  # 1 hour
+)
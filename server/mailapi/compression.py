@@ -0,0 +1,153 @@
+import os
+import zlib
+from typing import List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError: # Optional: without it we only ever offer gzip
+    brotli = None
+
+# Response compression negotiated from Accept-Encoding (brotli preferred, then gzip).
+# Like Starlette's GZipMiddleware, but with brotli, and it leaves alone what shouldn't be
+# compressed: small bodies, binary content, range responses and event streams (those are
+# read incrementally by the client, and compressors buffer).
+
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+GZIP_COMPRESSION_LEVEL = int(os.getenv("GZIP_COMPRESSION_LEVEL", "5"))
+BROTLI_COMPRESSION_QUALITY = int(os.getenv("BROTLI_COMPRESSION_QUALITY", "4")) # 4-5 is the sweet spot for on-the-fly responses
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'application/xml', 'image/svg+xml')
+STREAMING_TYPES = ('text/event-stream', 'application/x-ndjson')
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Picks 'br' or 'gzip' from an Accept-Encoding header (honouring q=0), or None."""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    wildcard = accepted.get('*', 0.0)
+    for encoding in (['br'] if brotli is not None else []) + ['gzip']:
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=BROTLI_COMPRESSION_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_COMPRESSION_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16) # gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = RESPONSE_COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressingResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressingResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Send = None
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_with_compression)
+
+    def _should_compress(self, headers: Headers) -> bool:
+        if self.start_message['status'] < 200 or self.start_message['status'] in (204, 206, 304):
+            return False
+        if 'content-encoding' in headers or 'content-range' in headers or 'accept-ranges' in headers:
+            return False # Already encoded, or byte offsets the client relies on
+        content_type = headers.get('content-type', '').lower()
+        if content_type.startswith(STREAMING_TYPES):
+            return False
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _compressed_headers(self, content_length: Optional[int]) -> List:
+        headers = MutableHeaders(raw=self.start_message['headers'])
+        headers['Content-Encoding'] = self.encoding
+        headers.add_vary_header('Accept-Encoding')
+        if content_length is None:
+            del headers['Content-Length']
+        else:
+            headers['Content-Length'] = str(content_length)
+        etag = headers.get('etag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = f'W/{etag}' # Different bytes than the identity encoding; matching is weak anyway
+        return headers.raw
+
+    async def send_with_compression(self, message: Message):
+        if message['type'] == 'http.response.start':
+            self.start_message = message # Held back until we know the body size
+            return
+        if message['type'] != 'http.response.body':
+            await self.send(message)
+            return
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if self.compressor is None:
+            headers = Headers(raw=self.start_message['headers'])
+            if not self._should_compress(headers) or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                if self._should_compress(headers):
+                    MutableHeaders(raw=self.start_message['headers']).add_vary_header('Accept-Encoding')
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding)
+            if not more_body: # Whole body in one message: send it with a real Content-Length
+                compressed = self.compressor.compress(body) + self.compressor.finish()
+                self.start_message['headers'] = self._compressed_headers(len(compressed))
+                await self.send(self.start_message)
+                await self.send({'type': 'http.response.body', 'body': compressed})
+                return
+            self.start_message['headers'] = self._compressed_headers(None)
+            await self.send(self.start_message)
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self.send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
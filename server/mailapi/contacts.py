@@ -0,0 +1,363 @@
+import itertools
+import math
+import os
+import time
+from datetime import datetime, timezone
+from email.utils import getaddresses
+from typing import Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy import case, delete, func, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database_models.models import GmailContact, GmailContactEdge, GmailMessage, GmailThread
+
+from . import mail_store
+from .gmail_sync import MailboxDelta, gmail_sync_engine
+
+# "People you talk to": per-contact totals kept current from sync deltas (the backfill's too),
+# so the dashboard reads an indexed top-N instead of scanning every From/To/Cc header.
+#
+# The ranking is a recency-weighted count: each message adds weight * exp(t / decay). Stored
+# as a log, a new message is folded in with a log-add-exp, and because every score decays by
+# the same factor over time, ordering by the stored log is ordering by the current score.
+#
+# Reply latency pairs each message with the one before it in its thread. Deletions aren't
+# subtracted: the index records correspondence that happened. A full resync rebuilds it.
+
+CONTACT_SCORE_HALF_LIFE_DAYS = float(os.getenv("CONTACT_SCORE_HALF_LIFE_DAYS", "30"))
+CONTACT_SENT_WEIGHT = float(os.getenv("CONTACT_SENT_WEIGHT", "1.0")) # Writing to someone says more than being written to
+CONTACT_RECEIVED_WEIGHT = float(os.getenv("CONTACT_RECEIVED_WEIGHT", "0.25"))
+CONTACT_REPLY_WINDOW_DAYS = float(os.getenv("CONTACT_REPLY_WINDOW_DAYS", "14")) # Later answers don't count as replies
+CONTACT_EDGE_MAX_PARTICIPANTS = int(os.getenv("CONTACT_EDGE_MAX_PARTICIPANTS", "10")) # Bigger messages are lists and announcements
+CONTACT_REBUILD_THREAD_CHUNK = 1000
+
+SKIPPED_LABELS = ('SPAM', 'TRASH', 'DRAFT')
+SCORE_EPOCH_MS = 1577836800000 # 2020-01-01; keeps the stored logs small
+DECAY_MS = CONTACT_SCORE_HALF_LIFE_DAYS * 86400000 / math.log(2)
+REPLY_WINDOW_MS = CONTACT_REPLY_WINDOW_DAYS * 86400000
+
+_MESSAGE_COLUMNS = (GmailMessage.id, GmailMessage.thread_id, GmailMessage.internal_date, GmailMessage.label_ids,
+                    GmailMessage.from_addr, GmailMessage.to_addr, GmailMessage.cc_addr)
+_COUNTERS = ('sent_count', 'received_count', 'thread_count', 'my_reply_count', 'my_reply_ms', 'their_reply_count', 'their_reply_ms')
+
+
+def _logaddexp(a: float, b: float) -> float:
+    high, low = max(a, b), min(a, b)
+    if low == -math.inf:
+        return high
+    return high + math.log1p(math.exp(low - high))
+
+
+def _sql_logaddexp(a, b):
+    # Postgres raises on exp() underflow instead of returning 0, so negligible terms are dropped first
+    high, low = func.greatest(a, b), func.least(a, b)
+    return case((or_(low == -math.inf, low - high < -30), high), else_=high + func.ln(1 + func.exp(low - high)))
+
+
+def decayed_score(log_score: float, now_ms: Optional[int] = None) -> float:
+    """The recency-weighted score as of now: sum of weight * 2^(-age / half-life) over messages."""
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    return math.exp(min(log_score - (now_ms - SCORE_EPOCH_MS) / DECAY_MS, 700))
+
+
+def _addresses(*headers: Optional[str]) -> Dict[str, Optional[str]]:
+    """Lowercased address -> display name, for every address in the headers."""
+    addresses: Dict[str, Optional[str]] = {}
+    for name, address in getaddresses([header for header in headers if header]):
+        address = address.strip().lower()
+        if '@' in address:
+            addresses[address] = name.strip() or addresses.get(address)
+    return addresses
+
+
+class _Message:
+    __slots__ = ('id', 'at', 'sent', 'sender', 'recipients', 'names')
+
+    def __init__(self, user_email: str, row: dict):
+        user_email = user_email.lower()
+        self.id = row['id']
+        self.at = row['internal_date']
+        senders = _addresses(row.get('from_addr'))
+        recipients = _addresses(row.get('to_addr'), row.get('cc_addr'))
+        self.sent = 'SENT' in (row.get('label_ids') or []) or user_email in senders
+        self.names = {**recipients, **senders}
+        self.sender = next((address for address in senders if address != user_email), None)
+        self.recipients = [address for address in recipients if address != user_email]
+
+    @property
+    def participants(self) -> List[str]:
+        """Everyone on the message except the user."""
+        return list(dict.fromkeys(([self.sender] if self.sender else []) + self.recipients))
+
+
+class _ContactTotals:
+    __slots__ = ('name', 'log_score', 'last_sent_at', 'last_received_at') + _COUNTERS
+
+    def __init__(self):
+        self.name = None
+        self.log_score = -math.inf
+        self.last_sent_at = None
+        self.last_received_at = None
+        for counter in _COUNTERS:
+            setattr(self, counter, 0)
+
+
+class _Aggregate:
+    """Totals for a set of new messages, to be added to what the tables already hold."""
+
+    def __init__(self, user_email: str):
+        self.user_email = user_email
+        self.contacts: Dict[str, _ContactTotals] = {}
+        self.edges: Dict[Tuple[str, str], List[int]] = {} # (a, b) -> [message_count, last_at]
+
+    def _contact(self, address: str, message: _Message) -> _ContactTotals:
+        totals = self.contacts.get(address)
+        if totals is None:
+            totals = self.contacts[address] = _ContactTotals()
+        totals.name = message.names.get(address) or totals.name
+        return totals
+
+    def add_thread(self, rows: List[dict], new_ids: Optional[Set[str]] = None):
+        """Counts the thread's messages in `new_ids` (all of them if None) against the rest of the thread."""
+        messages = sorted(
+            (_Message(self.user_email, row) for row in rows
+             if row['internal_date'] is not None and not any(label in (row['label_ids'] or []) for label in SKIPPED_LABELS)),
+            key=lambda message: (message.at, message.id),
+        )
+        is_new = (lambda message: True) if new_ids is None else (lambda message: message.id in new_ids)
+        in_thread = {address for message in messages if not is_new(message) for address in message.participants}
+        indexed_before = False # Whether an already-counted message precedes this one
+        previous: Optional[_Message] = None
+        for message in messages:
+            if is_new(message):
+                self._add_message(message, in_thread)
+            # Pairs of counted messages were counted before; one new message next to them makes a new pair
+            if previous is not None and (is_new(message) or not indexed_before):
+                self._add_reply(previous, message)
+            indexed_before = indexed_before or not is_new(message)
+            previous = message
+
+    def _add_message(self, message: _Message, in_thread: Set[str]):
+        if message.sent:
+            for address in message.recipients:
+                totals = self._contact(address, message)
+                totals.sent_count += 1
+                totals.last_sent_at = max(totals.last_sent_at or 0, message.at)
+                totals.log_score = _logaddexp(totals.log_score, (message.at - SCORE_EPOCH_MS) / DECAY_MS + math.log(CONTACT_SENT_WEIGHT))
+        elif message.sender:
+            totals = self._contact(message.sender, message)
+            totals.received_count += 1
+            totals.last_received_at = max(totals.last_received_at or 0, message.at)
+            totals.log_score = _logaddexp(totals.log_score, (message.at - SCORE_EPOCH_MS) / DECAY_MS + math.log(CONTACT_RECEIVED_WEIGHT))
+        participants = message.participants
+        for address in participants:
+            if address not in in_thread:
+                self._contact(address, message).thread_count += 1
+                in_thread.add(address)
+        if len(participants) <= CONTACT_EDGE_MAX_PARTICIPANTS:
+            for pair in itertools.combinations(sorted(participants), 2):
+                edge = self.edges.setdefault(pair, [0, message.at])
+                edge[0] += 1
+                edge[1] = max(edge[1], message.at)
+
+    def _add_reply(self, previous: _Message, message: _Message):
+        delay = message.at - previous.at
+        if not 0 <= delay <= REPLY_WINDOW_MS:
+            return
+        if message.sent and not previous.sent and previous.sender:
+            totals = self._contact(previous.sender, previous)
+            totals.my_reply_count += 1
+            totals.my_reply_ms += delay
+        elif previous.sent and not message.sent and message.sender:
+            totals = self._contact(message.sender, message)
+            totals.their_reply_count += 1
+            totals.their_reply_ms += delay
+
+
+def _contact_rows(user_email: str, aggregate: _Aggregate) -> List[dict]:
+    return [
+        {'user_email': user_email, 'address': address, 'name': totals.name, 'log_score': totals.log_score,
+         'last_sent_at': totals.last_sent_at, 'last_received_at': totals.last_received_at,
+         **{counter: getattr(totals, counter) for counter in _COUNTERS}}
+        for address, totals in aggregate.contacts.items()
+    ]
+
+
+def _edge_rows(user_email: str, aggregate: _Aggregate) -> List[dict]:
+    return [
+        {'user_email': user_email, 'address_a': a, 'address_b': b, 'message_count': count, 'last_at': last_at}
+        for (a, b), (count, last_at) in aggregate.edges.items()
+    ]
+
+
+async def _merge(db: AsyncSession, user_email: str, aggregate: _Aggregate):
+    """Adds an aggregate's totals to the stored ones."""
+    rows = _contact_rows(user_email, aggregate)
+    for start in range(0, len(rows), mail_store.UPSERT_CHUNK_SIZE):
+        statement = pg_insert(GmailContact).values(rows[start:start + mail_store.UPSERT_CHUNK_SIZE])
+        excluded, table = statement.excluded, GmailContact.__table__.c
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[GmailContact.user_email, GmailContact.address],
+            set_={
+                **{counter: table[counter] + excluded[counter] for counter in _COUNTERS},
+                'name': func.coalesce(excluded.name, table.name),
+                'last_sent_at': func.greatest(table.last_sent_at, excluded.last_sent_at), # greatest() skips NULLs
+                'last_received_at': func.greatest(table.last_received_at, excluded.last_received_at),
+                'log_score': _sql_logaddexp(table.log_score, excluded.log_score),
+                'updated_at': func.now(),
+            },
+        ))
+    rows = _edge_rows(user_email, aggregate)
+    for start in range(0, len(rows), mail_store.UPSERT_CHUNK_SIZE):
+        statement = pg_insert(GmailContactEdge).values(rows[start:start + mail_store.UPSERT_CHUNK_SIZE])
+        table = GmailContactEdge.__table__.c
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[GmailContactEdge.user_email, GmailContactEdge.address_a, GmailContactEdge.address_b],
+            set_={
+                'message_count': table.message_count + statement.excluded.message_count,
+                'last_at': func.greatest(table.last_at, statement.excluded.last_at),
+            },
+        ))
+
+
+async def _thread_rows(db: AsyncSession, user_email: str, thread_ids: List[str]) -> Dict[str, List[dict]]:
+    result = await db.execute(
+        select(*_MESSAGE_COLUMNS).where(GmailMessage.user_email == user_email, GmailMessage.thread_id.in_(thread_ids))
+    )
+    threads: Dict[str, List[dict]] = {}
+    for row in result.all():
+        threads.setdefault(row.thread_id, []).append(dict(row._mapping))
+    return threads
+
+
+class CoContact(BaseModel):
+    address: str
+    message_count: int # Messages both were on
+
+
+class Contact(BaseModel):
+    address: str
+    name: Optional[str] = None
+    score: float # Recency-weighted message count as of now
+    sent_count: int
+    received_count: int
+    thread_count: int
+    last_sent_at: Optional[int] = None # Milliseconds since epoch, like internalDate
+    last_received_at: Optional[int] = None
+    last_contact_at: Optional[int] = None
+    my_average_reply_seconds: Optional[float] = None
+    their_average_reply_seconds: Optional[float] = None
+    co_contacts: List[CoContact] = []
+
+
+class ContactsResponse(BaseModel):
+    contacts: List[Contact]
+
+
+class ContactIndex:
+    def __init__(self):
+        self.stats = {"rebuilds": 0, "messages_added": 0}
+
+    async def add_messages(self, db: AsyncSession, user_email: str, message_ids: List[str]):
+        """Counts messages that were just written to the store (in this transaction)."""
+        result = await db.execute(
+            select(GmailMessage.thread_id).distinct().where(GmailMessage.user_email == user_email, GmailMessage.id.in_(message_ids))
+        )
+        thread_ids = list(result.scalars().all())
+        aggregate = _Aggregate(user_email)
+        new_ids = set(message_ids)
+        for rows in (await _thread_rows(db, user_email, thread_ids)).values():
+            aggregate.add_thread(rows, new_ids)
+        await _merge(db, user_email, aggregate)
+        self.stats["messages_added"] += len(message_ids)
+
+    async def rebuild(self, db: AsyncSession, user_email: str):
+        """Recomputes the user's contacts from the whole store and marks them as indexed (caller commits)."""
+        aggregate = _Aggregate(user_email)
+        last_thread_id = ''
+        while True:
+            result = await db.execute(
+                select(GmailThread.id)
+                .where(GmailThread.user_email == user_email, GmailThread.id > last_thread_id)
+                .order_by(GmailThread.id)
+                .limit(CONTACT_REBUILD_THREAD_CHUNK)
+            )
+            thread_ids = list(result.scalars().all())
+            if not thread_ids:
+                break
+            last_thread_id = thread_ids[-1]
+            for rows in (await _thread_rows(db, user_email, thread_ids)).values():
+                aggregate.add_thread(rows)
+        await db.execute(delete(GmailContactEdge).where(GmailContactEdge.user_email == user_email))
+        await db.execute(delete(GmailContact).where(GmailContact.user_email == user_email))
+        await _merge(db, user_email, aggregate)
+        state = await mail_store.get_sync_state(db, user_email)
+        if state is not None:
+            state.contacts_indexed_at = datetime.now(timezone.utc)
+        self.stats["rebuilds"] += 1
+
+    async def ensure(self, db: AsyncSession, user_email: str):
+        """Builds the user's contacts from the store on first use."""
+        state = await mail_store.get_sync_state(db, user_email)
+        if state is None or state.contacts_indexed_at is not None:
+            return
+        # Wait out a running sync (and hold off the next) so no delta lands between the scan and the marker
+        await db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"gmail_sync:{user_email}"})
+        await db.refresh(state)
+        if state.contacts_indexed_at is None:
+            await self.rebuild(db, user_email)
+        await db.commit()
+
+    async def top_contacts(self, db: AsyncSession, user_email: str, limit: int, two_way: bool = False,
+                           co_contacts: int = 0) -> List[Contact]:
+        query = select(GmailContact).where(GmailContact.user_email == user_email, GmailContact.log_score > -math.inf)
+        if two_way:
+            query = query.where(GmailContact.sent_count > 0, GmailContact.received_count > 0)
+        result = await db.execute(query.order_by(GmailContact.log_score.desc(), GmailContact.address).limit(limit))
+        rows = list(result.scalars().all())
+
+        related: Dict[str, List[CoContact]] = {}
+        if co_contacts and rows:
+            addresses = [row.address for row in rows]
+            result = await db.execute(select(GmailContactEdge).where(
+                GmailContactEdge.user_email == user_email,
+                or_(GmailContactEdge.address_a.in_(addresses), GmailContactEdge.address_b.in_(addresses)),
+            ))
+            for edge in result.scalars().all():
+                for address, other in ((edge.address_a, edge.address_b), (edge.address_b, edge.address_a)):
+                    related.setdefault(address, []).append(CoContact(address=other, message_count=edge.message_count))
+            for address in related:
+                related[address] = sorted(related[address], key=lambda item: (-item.message_count, item.address))[:co_contacts]
+
+        now_ms = int(time.time() * 1000)
+        return [
+            Contact(
+                address=row.address, name=row.name, score=round(decayed_score(row.log_score, now_ms), 4),
+                sent_count=row.sent_count, received_count=row.received_count, thread_count=row.thread_count,
+                last_sent_at=row.last_sent_at, last_received_at=row.last_received_at,
+                last_contact_at=max(row.last_sent_at or 0, row.last_received_at or 0) or None,
+                my_average_reply_seconds=round(row.my_reply_ms / row.my_reply_count / 1000, 1) if row.my_reply_count else None,
+                their_average_reply_seconds=round(row.their_reply_ms / row.their_reply_count / 1000, 1) if row.their_reply_count else None,
+                co_contacts=related.get(row.address, []),
+            )
+            for row in rows
+        ]
+
+    async def on_sync(self, db: AsyncSession, gmail_service, delta: MailboxDelta):
+        state = await mail_store.get_sync_state(db, delta.user_email)
+        if state is None or state.contacts_indexed_at is None:
+            return # Built from the store on first read
+        async with db.begin_nested(): # A failed write mustn't abort the sync's own transaction
+            if delta.full:
+                await self.rebuild(db, delta.user_email)
+            else:
+                # Only messages new to the store: one the backfill stored may come back through history
+                new_ids = [message['id'] for message in delta.added_messages if delta.is_inserted(message['id'])]
+                if new_ids:
+                    await self.add_messages(db, delta.user_email, new_ids)
+
+
+contact_index = ContactIndex()
+gmail_sync_engine.add_listener(contact_index.on_sync)
@@ -0,0 +1,437 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+import uuid
+from typing import Awaitable, Dict, Iterable, List, Optional, Protocol, Set, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database_config.database import AsyncSessionLocal
+from shared.database_models.models import GmailMessage
+
+from .gmail_sync import MailboxDelta, after_commit, gmail_sync_engine
+from .thread_summaries import content_hash, normalize_text
+
+try:
+    from openai import AsyncOpenAI
+except ImportError: # Optional: only needed for EMBEDDING_MODEL=openai:...
+    AsyncOpenAI = None
+
+# Local embedding index over synced mail, for semantic search and "related threads" without
+# calling Gmail. Per user, on disk:
+#
+#   <root>/<sha256 of user>/vectors.f32   float32 rows (unit length), memory-mapped; a row is
+#                                          a message or a thread
+#   <root>/<sha256 of user>/meta.json      row -> [kind, id, thread_id, content_hash], plus the model
+#
+# A message is embedded from its normalized text and skipped while that text's hash is
+# unchanged; a thread's vector is the (renormalized) mean of its messages', so threads cost no
+# embedding calls. Search is a blockwise matrix-vector product over the memmap with an
+# argpartition top-k, which stays in the tens of milliseconds up to a few hundred thousand rows.
+#
+# Indexes are built on first use and then kept current by sync deltas (the backfill's too).
+# The files aren't part of the sync's transaction, so a delta is applied once it has committed,
+# and always from the stored rows: a message hashes the same whichever path embeds it.
+
+EMBEDDING_INDEX_DIR = os.getenv("EMBEDDING_INDEX_DIR", os.path.join(tempfile.gettempdir(), "mailapi-embeddings"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "hashing") # "hashing" (local, deterministic) or "openai:<model>"
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256")) # Texts per embed() call
+EMBEDDING_TEXT_MAX_CHARS = int(os.getenv("EMBEDDING_TEXT_MAX_CHARS", "2000"))
+EMBEDDING_REBUILD_CHUNK = 5000 # Store messages read (and embedded) per step of a rebuild
+SEARCH_BLOCK_ROWS = 65536 # Rows scored per matrix-vector product; bounds memory on big indexes
+
+_EMBEDDED_COLUMNS = (GmailMessage.id, GmailMessage.thread_id, GmailMessage.subject, GmailMessage.from_addr,
+                     GmailMessage.snippet, GmailMessage.body_text)
+
+KIND_FREE, KIND_MESSAGE, KIND_THREAD = 0, 1, 2
+_KIND_CODES = {None: KIND_FREE, 'message': KIND_MESSAGE, 'thread': KIND_THREAD}
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class Embedder(Protocol):
+    name: str # Stored with the index; a different name means a rebuild
+    dim: int
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Unit-length float32 vectors, one row per text."""
+        ...
+
+
+class HashingEmbedder:
+    """Feature-hashed bag of words and bigrams: local, deterministic, no model to download.
+
+    Matches on shared vocabulary rather than meaning; fine for tests and small setups.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN.findall(text.lower())
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                vectors[row, value % self.dim] += 1.0 if value >> 63 else -1.0 # Signed, so collisions cancel out on average
+        return _normalized(vectors)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return await run_in_threadpool(self._embed, texts)
+
+
+class OpenAIEmbedder:
+    def __init__(self, model: str, dim: int):
+        if AsyncOpenAI is None:
+            raise RuntimeError("EMBEDDING_MODEL=openai:... needs the openai package")
+        self.model = model
+        self.dim = dim
+        self.name = f"openai-{model}-{dim}"
+        self._client = AsyncOpenAI() # Reads OPENAI_API_KEY
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        response = await self._client.embeddings.create(model=self.model, input=texts, dimensions=self.dim)
+        return _normalized(np.array([item.embedding for item in response.data], dtype=np.float32))
+
+
+def make_embedder(spec: str, dim: int) -> Embedder:
+    if spec == "hashing":
+        return HashingEmbedder(dim)
+    if spec.startswith("openai:"):
+        return OpenAIEmbedder(spec[len("openai:"):], dim)
+    raise ValueError(f"Unknown EMBEDDING_MODEL {spec!r}")
+
+
+def embedding_text(message: dict) -> str:
+    """What a message is embedded from: subject, sender and normalized body (or snippet)."""
+    body = normalize_text(message.get('body_text') or message.get('snippet') or '', EMBEDDING_TEXT_MAX_CHARS)
+    return f"{message.get('subject') or ''}\n{message.get('from_addr') or ''}\n{body}"
+
+
+class _UserIndex:
+    """One user's index as loaded from disk; replaced wholesale (never mutated) after a write."""
+
+    def __init__(self, directory: str, model: str, dim: int, items: List[list], meta_mtime: Optional[float]):
+        self.directory = directory
+        self.model = model
+        self.dim = dim
+        self.items = items
+        self.meta_mtime = meta_mtime
+        self.rows: Dict[Tuple[str, str], int] = {(item[0], item[1]): row for row, item in enumerate(items) if item[0] is not None}
+        self.kinds = np.array([_KIND_CODES[item[0]] for item in items], dtype=np.int8)
+        self.vectors: Optional[np.memmap] = None
+        if items:
+            self.vectors = np.memmap(os.path.join(directory, 'vectors.f32'), dtype=np.float32, mode='r', shape=(len(items), dim))
+
+    def content_hash(self, kind: str, item_id: str) -> Optional[str]:
+        row = self.rows.get((kind, item_id))
+        return self.items[row][3] if row is not None else None
+
+    def vector(self, kind: str, item_id: str) -> Optional[np.ndarray]:
+        row = self.rows.get((kind, item_id))
+        return np.array(self.vectors[row]) if row is not None else None
+
+    def top_k(self, query: np.ndarray, kind: str, k: int, exclude: Set[str] = frozenset()) -> List[Tuple[str, float]]:
+        """The k rows of `kind` most similar to `query` (cosine), best first."""
+        if self.vectors is None or k <= 0:
+            return []
+        wanted = k + len(exclude)
+        best_rows, best_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        for start in range(0, len(self.items), SEARCH_BLOCK_ROWS):
+            scores = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS]) @ query
+            scores[self.kinds[start:start + SEARCH_BLOCK_ROWS] != _KIND_CODES[kind]] = -np.inf
+            rows = np.arange(start, start + len(scores))
+            if len(scores) > wanted:
+                keep = np.argpartition(-scores, wanted)[:wanted]
+                rows, scores = rows[keep], scores[keep]
+            best_rows, best_scores = np.concatenate([best_rows, rows]), np.concatenate([best_scores, scores])
+            if len(best_scores) > wanted:
+                keep = np.argpartition(-best_scores, wanted)[:wanted]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        results = []
+        for position in np.argsort(-best_scores, kind='stable'):
+            if not np.isfinite(best_scores[position]):
+                break
+            item_id = self.items[best_rows[position]][1]
+            if item_id not in exclude:
+                results.append((item_id, float(best_scores[position])))
+        return results[:k]
+
+
+def _read_meta(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        meta['mtime'] = os.stat(os.path.join(directory, 'meta.json')).st_mtime
+        return meta
+    except (OSError, ValueError):
+        return None
+
+
+class EmbeddingIndex:
+    def __init__(self, root: str, embedder: Embedder):
+        self.root = root
+        self.embedder = embedder
+        self._indexes: Dict[str, _UserIndex] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"embedded": 0, "unchanged": 0, "removed": 0, "searches": 0}
+
+    def _directory(self, user_email: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(user_email.encode('utf-8')).hexdigest())
+
+    def _lock(self, user_email: str) -> asyncio.Lock:
+        return self._locks.setdefault(user_email, asyncio.Lock())
+
+    def _load(self, user_email: str) -> Optional[_UserIndex]:
+        """The user's index, reloaded if another worker rewrote it; None if there is none (for this model)."""
+        directory = self._directory(user_email)
+        index = self._indexes.get(user_email)
+        try:
+            mtime = os.stat(os.path.join(directory, 'meta.json')).st_mtime
+        except OSError:
+            self._indexes.pop(user_email, None)
+            return None
+        if index is not None and index.meta_mtime == mtime and index.model == self.embedder.name:
+            return index
+        meta = _read_meta(directory)
+        if meta is None or meta.get('model') != self.embedder.name or meta.get('dim') != self.embedder.dim:
+            self._indexes.pop(user_email, None)
+            return None
+        try:
+            index = _UserIndex(directory, meta['model'], meta['dim'], meta['items'], meta['mtime'])
+        except ValueError: # vectors.f32 was just replaced by a rebuild whose meta isn't written yet
+            return None
+        self._indexes[user_email] = index
+        return index
+
+    def has_index(self, user_email: str) -> bool:
+        return self._load(user_email) is not None
+
+    def _write(self, user_email: str, embedded: Dict[str, Tuple[str, str, np.ndarray]], removed_ids: Set[str]) -> Optional[_UserIndex]:
+        """Applies message rows ({id: (thread_id, content_hash, vector)}) and removals, then recomputes touched threads.
+
+        Runs in a thread under an exclusive file lock, rereading the index first, so writers in
+        other workers are serialized and nothing they wrote is lost.
+        """
+        directory = self._directory(user_email)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            meta = _read_meta(directory)
+            fresh = meta is None or meta.get('model') != self.embedder.name or meta.get('dim') != self.embedder.dim
+            items: List[list] = [] if fresh else meta['items'] # New, or built with another model: start over
+            rows = {(item[0], item[1]): row for row, item in enumerate(items) if item[0] is not None}
+            free_rows = [row for row, item in enumerate(items) if item[0] is None]
+
+            touched_threads = set()
+            for message_id in removed_ids:
+                row = rows.pop(('message', message_id), None)
+                if row is not None:
+                    touched_threads.add(items[row][2])
+                    items[row] = [None, None, None, None]
+                    free_rows.append(row)
+            assignments: List[Tuple[int, np.ndarray]] = []
+            for message_id, (thread_id, message_hash, vector) in embedded.items():
+                row = rows.get(('message', message_id))
+                if row is not None and items[row][3] == message_hash:
+                    continue # Another worker got here first
+                if row is None:
+                    row = free_rows.pop() if free_rows else len(items)
+                    if row == len(items):
+                        items.append(None)
+                    rows[('message', message_id)] = row
+                items[row] = ['message', message_id, thread_id, message_hash]
+                touched_threads.add(thread_id)
+                assignments.append((row, vector))
+
+            # Threads get rows too; rows are only allocated here, vectors filled in below
+            messages_by_thread: Dict[str, List[int]] = {}
+            for (kind, item_id), row in rows.items():
+                if kind == 'message' and items[row][2] in touched_threads:
+                    messages_by_thread.setdefault(items[row][2], []).append(row)
+            for thread_id in touched_threads:
+                row = rows.get(('thread', thread_id))
+                if thread_id not in messages_by_thread:
+                    if row is not None: # Its last message is gone
+                        items[row] = [None, None, None, None]
+                        free_rows.append(row)
+                        del rows[('thread', thread_id)]
+                    continue
+                if row is None:
+                    row = free_rows.pop() if free_rows else len(items)
+                    if row == len(items):
+                        items.append(None)
+                    rows[('thread', thread_id)] = row
+                message_rows = sorted(messages_by_thread[thread_id])
+                items[row] = ['thread', thread_id, thread_id, content_hash(*sorted(items[r][3] for r in message_rows))]
+
+            vectors_path = os.path.join(directory, 'vectors.f32')
+            needed_bytes = len(items) * self.embedder.dim * 4
+            if fresh or not os.path.exists(vectors_path):
+                # A new file rather than truncating: other workers may still have the old one mapped
+                temp_path = f"{vectors_path}.{uuid.uuid4().hex}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.truncate(needed_bytes)
+                os.replace(temp_path, vectors_path)
+            elif os.path.getsize(vectors_path) < needed_bytes:
+                with open(vectors_path, 'r+b') as f:
+                    f.truncate(needed_bytes) # Only ever grows (freed rows are reused), so mapped readers stay valid
+            if items:
+                vectors = np.memmap(vectors_path, dtype=np.float32, mode='r+', shape=(len(items), self.embedder.dim))
+                for row, vector in assignments:
+                    vectors[row] = vector
+                for thread_id in touched_threads:
+                    row = rows.get(('thread', thread_id))
+                    if row is not None:
+                        mean = vectors[sorted(messages_by_thread[thread_id])].mean(axis=0, keepdims=True)
+                        vectors[row] = _normalized(mean)[0]
+                vectors.flush()
+                del vectors
+
+            meta_path = os.path.join(directory, 'meta.json')
+            temp_path = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'model': self.embedder.name, 'dim': self.embedder.dim, 'items': items}, f, separators=(',', ':'))
+            os.replace(temp_path, meta_path) # Readers see the old index or the new one, never half of it
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self._indexes.pop(user_email, None)
+        return self._load(user_email)
+
+    async def _embed_changed(self, user_email: str, messages: Iterable[dict]) -> Dict[str, Tuple[str, str, np.ndarray]]:
+        """Vectors for the messages whose text changed since they were indexed ({id: (thread_id, hash, vector)})."""
+        index = self._load(user_email)
+        pending = []
+        for message in messages:
+            text = embedding_text(message)
+            message_hash = content_hash(self.embedder.name, text)
+            if index is not None and index.content_hash('message', message['id']) == message_hash:
+                self.stats["unchanged"] += 1
+                continue
+            pending.append((message['id'], message['thread_id'], message_hash, text))
+        embedded = {}
+        for start in range(0, len(pending), EMBEDDING_BATCH_SIZE):
+            batch = pending[start:start + EMBEDDING_BATCH_SIZE]
+            vectors = await self.embedder.embed([text for _, _, _, text in batch])
+            for (message_id, thread_id, message_hash, _), vector in zip(batch, vectors):
+                embedded[message_id] = (thread_id, message_hash, vector)
+        self.stats["embedded"] += len(embedded)
+        return embedded
+
+    async def update(self, user_email: str, messages: List[dict], deleted_ids: Iterable[str] = ()):
+        """Indexes new or changed messages (store records) and drops deleted ones; unchanged text is skipped."""
+        async with self._lock(user_email):
+            embedded = await self._embed_changed(user_email, messages)
+            deleted_ids = set(deleted_ids)
+            index = self._load(user_email)
+            if index is not None:
+                deleted_ids = {message_id for message_id in deleted_ids if ('message', message_id) in index.rows}
+            if embedded or deleted_ids:
+                await run_in_threadpool(self._write, user_email, embedded, deleted_ids)
+                self.stats["removed"] += len(deleted_ids)
+
+    async def rebuild(self, db: AsyncSession, user_email: str):
+        """Brings the index in line with the whole store, re-embedding only changed text."""
+        async with self._lock(user_email):
+            seen: Set[str] = set()
+            last_id = ''
+            while True:
+                result = await db.execute(
+                    select(*_EMBEDDED_COLUMNS)
+                    .where(GmailMessage.user_email == user_email, GmailMessage.id > last_id)
+                    .order_by(GmailMessage.id)
+                    .limit(EMBEDDING_REBUILD_CHUNK)
+                )
+                messages = [dict(row._mapping) for row in result.all()]
+                if not messages:
+                    break
+                last_id = messages[-1]['id']
+                embedded = await self._embed_changed(user_email, messages)
+                if embedded:
+                    await run_in_threadpool(self._write, user_email, embedded, set()) # Checkpoint per chunk
+                seen.update(message['id'] for message in messages)
+            # Drop what the store no longer has (and write an empty index for an empty mailbox)
+            index = self._load(user_email)
+            stale = {item[1] for item in (index.items if index is not None else []) if item[0] == 'message' and item[1] not in seen}
+            if stale or index is None:
+                await run_in_threadpool(self._write, user_email, {}, stale)
+                self.stats["removed"] += len(stale)
+
+    async def ensure(self, db: AsyncSession, user_email: str):
+        """Builds the user's index on first use."""
+        if not self.has_index(user_email):
+            await self.rebuild(db, user_email)
+
+    async def search(self, user_email: str, query_text: str, kind: str, limit: int) -> List[Tuple[str, float]]:
+        """[(message or thread id, cosine score)], best first."""
+        index = self._load(user_email)
+        if index is None:
+            return []
+        query = (await self.embedder.embed([query_text]))[0]
+        self.stats["searches"] += 1
+        return await run_in_threadpool(index.top_k, query, kind, limit)
+
+    async def related_threads(self, user_email: str, thread_id: str, limit: int) -> Optional[List[Tuple[str, float]]]:
+        """Threads most similar to `thread_id`, best first; None if it isn't indexed."""
+        index = self._load(user_email)
+        vector = index.vector('thread', thread_id) if index is not None else None
+        if vector is None:
+            return None
+        self.stats["searches"] += 1
+        return await run_in_threadpool(index.top_k, vector, 'thread', limit, {thread_id})
+
+    async def _apply_delta(self, user_email: str, full: bool, message_ids: List[str], deleted_ids: List[str]):
+        async with AsyncSessionLocal() as db:
+            if full:
+                await self.rebuild(db, user_email)
+                return
+            result = await db.execute(
+                select(*_EMBEDDED_COLUMNS).where(GmailMessage.user_email == user_email, GmailMessage.id.in_(message_ids))
+            )
+            messages = [dict(row._mapping) for row in result.all()] # Deleted again since: nothing to embed
+        await self.update(user_email, messages, deleted_ids)
+
+    def _spawn(self, job: Awaitable, description: str):
+        async def run():
+            try:
+                await job
+            except Exception as e:
+                print(f"Embedding index update failed ({description}): {e}")
+
+        task = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def on_sync(self, db: AsyncSession, gmail_service, delta: MailboxDelta):
+        if not self.has_index(delta.user_email):
+            return # Built lazily on the first semantic search; nothing to keep current yet
+        message_ids = [message['id'] for message in delta.added_messages]
+        if not (delta.full or message_ids or delta.deleted_ids):
+            return
+        user_email, full, deleted_ids = delta.user_email, delta.full, list(delta.deleted_ids)
+        after_commit(db, lambda: self._spawn(
+            self._apply_delta(user_email, full, message_ids, deleted_ids), f"sync delta for {user_email}"
+        ))
+
+
+embedding_index = EmbeddingIndex(EMBEDDING_INDEX_DIR, make_embedder(EMBEDDING_MODEL, EMBEDDING_DIM))
+gmail_sync_engine.add_listener(embedding_index.on_sync)
@@ -0,0 +1,46 @@
+import hashlib
+import json
+from typing import Any, Optional
+
+from fastapi import Request, Response, status
+
+# Validators for conditional GETs. Polling clients send back the ETag they got; when it still
+# matches we answer 304 with no body. ETags are built from whatever cheaply identifies the
+# response (Gmail historyIds, Calendar `updated` stamps, store state) so a match can be
+# detected before the response is built, and only fall back to hashing the content itself.
+
+# Clients must revalidate every time, but may keep the body around to do so
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+
+def make_etag(*parts: Any) -> str:
+    """Strong ETag for a response identified by `parts` (anything JSON-serializable)."""
+    raw = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+    return f'"{hashlib.sha256(raw).hexdigest()[:32]}"'
+
+
+def content_etag(content: Any) -> str:
+    """ETag from the response data itself, for endpoints with no cheaper validator."""
+    return make_etag('content', content)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check. Uses weak comparison, as RFC 9110 requires for this header."""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    return any(candidate.removeprefix('W/') == etag for candidate in candidates)
+
+
+def not_modified(etag: str, cache_control: str = REVALIDATE_CACHE_CONTROL) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag, 'Cache-Control': cache_control})
+
+
+def set_etag(response: Response, etag: Optional[str], cache_control: str = REVALIDATE_CACHE_CONTROL):
+    """Adds the validator headers to the (injected) response of a regular 200."""
+    if etag:
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = cache_control
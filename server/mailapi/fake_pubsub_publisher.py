@@ -0,0 +1,93 @@
+"""Local stand-in for a Pub/Sub push subscription, for load-testing POST /gmail/push offline.
+
+Sends Gmail-style notifications ({emailAddress, historyId}) in bursts, wrapped in the same
+envelope Pub/Sub push uses, then prints latency and the server's coalescing stats.
+
+    python fake_pubsub_publisher.py --users a@example.com b@example.com --bursts 20 --burst-size 50
+
+Users without stored Google tokens show up as failed syncs in the stats; that's expected
+when you only want to exercise the webhook and queue.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+
+def push_envelope(email_address: str, history_id: int) -> dict:
+    data = json.dumps({'emailAddress': email_address, 'historyId': history_id}).encode('utf-8')
+    return {
+        'message': {
+            'data': base64.b64encode(data).decode('ascii'),
+            'messageId': uuid.uuid4().hex,
+            'publishTime': datetime.now(timezone.utc).isoformat(),
+        },
+        'subscription': 'projects/local/subscriptions/gmail-push-fake',
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=os.getenv('BACKEND_BASE_URL', 'http://localhost:8000'))
+    parser.add_argument('--token', default=os.getenv('GMAIL_PUSH_VERIFICATION_TOKEN'))
+    parser.add_argument('--users', nargs='+', default=['test@example.com'])
+    parser.add_argument('--bursts', type=int, default=10)
+    parser.add_argument('--burst-size', type=int, default=20, help='Notifications per user per burst')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between bursts')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--start-history-id', type=int, default=1)
+    args = parser.parse_args()
+    if not args.token:
+        parser.error('--token or GMAIL_PUSH_VERIFICATION_TOKEN is required')
+
+    push_url = f"{args.url.rstrip('/')}/gmail/push"
+    history_ids = {user: args.start_history_id for user in args.users}
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def send(user: str, history_id: int):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(push_url, params={'token': args.token}, json=push_envelope(user, history_id))
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        for burst in range(args.bursts):
+            sends = []
+            for user in args.users:
+                for _ in range(args.burst_size):
+                    history_ids[user] += 1
+                    sends.append(send(user, history_ids[user]))
+            await asyncio.gather(*sends)
+            if burst < args.bursts - 1:
+                await asyncio.sleep(args.interval)
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        print(f"Sent {len(latencies)} notifications in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), statuses {statuses}")
+        print(f"Latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms")
+
+        # Let the debounce timers fire and the workers drain, then report what the server did
+        for _ in range(30):
+            stats = (await client.get(f"{args.url.rstrip('/')}/gmail/push/stats", params={'token': args.token})).json()
+            if stats.get('pending') == 0:
+                break
+            await asyncio.sleep(1)
+        print(f"Server stats: {stats}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,363 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import List, Optional, Set
+
+from pydantic import BaseModel
+from sqlalchemy import select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database_config.database import AsyncSessionLocal, engine
+from shared.database_models.models import GmailBackfillState, GmailSyncState
+
+from . import mail_store
+from .cache import TTLCache
+from .gmail_sync import GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, MailboxDelta, fetch_message_metadata, gmail_sync_engine
+from .google_http import execute_async
+from .google_services import build_service
+from .rate_limit import QUOTA_BURST_SECONDS, QUOTA_RATES, QUOTA_USER_BUCKETS_MAX, TokenBucket, quota_cost, quota_limiter, quota_user
+from .token_refresh import token_refresher
+
+# Full-mailbox backfill into the local metadata store, as a background job rather than
+# something page requests drive. A walk lists messages.list pages newest first and fetches
+# each page's metadata in parallel slices; after every page the new rows and the checkpoint
+# (next pageToken) are committed together, so a crash or redeploy resumes at that page.
+#
+# Gmail allows 250 quota units per user per second and messages.get costs 5, so a mailbox
+# tops out around 50 messages/s (100k messages in ~35 minutes). The walk is capped below that
+# and only spends quota while interactive requests leave the user's bucket untouched.
+
+GMAIL_BACKFILL_ENABLED = os.getenv("GMAIL_BACKFILL_ENABLED", "true").lower() == "true"
+GMAIL_BACKFILL_ON_LOGIN = os.getenv("GMAIL_BACKFILL_ON_LOGIN", "true").lower() == "true" # Queue one when a user connects Gmail
+GMAIL_BACKFILL_WORKERS = int(os.getenv("GMAIL_BACKFILL_WORKERS", "2")) # Mailboxes walked at once, per process
+GMAIL_BACKFILL_UNITS_PER_SECOND = float(os.getenv("GMAIL_BACKFILL_UNITS_PER_SECOND", "200")) # Per mailbox
+GMAIL_BACKFILL_QUOTA_RESERVE = float(os.getenv("GMAIL_BACKFILL_QUOTA_RESERVE", "0.2")) # Fraction of the user's quota bucket kept for interactive requests
+GMAIL_BACKFILL_PARALLELISM = int(os.getenv("GMAIL_BACKFILL_PARALLELISM", "4")) # Metadata slices in flight per mailbox
+GMAIL_BACKFILL_INDEX_BODIES = os.getenv("GMAIL_BACKFILL_INDEX_BODIES", "false").lower() == "true" # Same quota as metadata, many more bytes
+GMAIL_BACKFILL_POLL_SECONDS = float(os.getenv("GMAIL_BACKFILL_POLL_SECONDS", "60")) # Pick up pending and interrupted walks
+GMAIL_BACKFILL_MAX_ATTEMPTS = int(os.getenv("GMAIL_BACKFILL_MAX_ATTEMPTS", "3"))
+BACKFILL_PAGE_SIZE = 500 # messages.list maximum
+BUCKET_IDLE_SECONDS = 60 # A mailbox's pacing bucket is dropped once full and unused this long
+
+MESSAGE_GET_COST = quota_cost('gmail.users.messages.get')[1]
+MESSAGE_LIST_COST = quota_cost('gmail.users.messages.list')[1]
+
+
+class BackfillProgress(BaseModel):
+    user_email: str
+    status: str # "pending", "running", "done" or "failed"
+    messages_total: Optional[int] = None
+    messages_listed: int = 0
+    messages_stored: int = 0
+    percent: Optional[float] = None
+    messages_per_second: Optional[float] = None
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+def backfill_progress(state: GmailBackfillState) -> BackfillProgress:
+    percent = None
+    if state.status == 'done':
+        percent = 100.0
+    elif state.messages_total:
+        percent = round(min(100.0, 100.0 * state.messages_listed / state.messages_total), 1)
+    messages_per_second = None
+    until = state.finished_at or state.updated_at
+    if state.started_at and until and until > state.started_at:
+        messages_per_second = round(state.messages_listed / (until - state.started_at).total_seconds(), 1)
+    return BackfillProgress(
+        user_email=state.user_email, status=state.status, messages_total=state.messages_total,
+        messages_listed=state.messages_listed or 0, messages_stored=state.messages_stored or 0,
+        percent=percent, messages_per_second=messages_per_second, started_at=state.started_at,
+        updated_at=state.updated_at, finished_at=state.finished_at, error=state.error,
+    )
+
+
+async def get_backfill_state(db: AsyncSession, user_email: str) -> Optional[GmailBackfillState]:
+    return await db.get(GmailBackfillState, user_email)
+
+
+def _reset(state: GmailBackfillState):
+    state.generation = (state.generation or 0) + 1
+    state.status = 'pending'
+    state.page_token = None
+    state.history_id = None
+    state.messages_total = None
+    state.messages_listed = 0
+    state.messages_stored = 0
+    state.error = None
+    state.started_at = None
+    state.finished_at = None
+
+
+class GmailBackfiller:
+    """Queue and workers for backfill walks. Progress lives in gmail_backfill_state, not in memory."""
+
+    def __init__(self, units_per_second: float, quota_reserve: float, parallelism: int, workers: int,
+                 poll_seconds: float, max_attempts: int, index_bodies: bool):
+        self.units_per_second = units_per_second
+        self.quota_reserve = quota_reserve
+        self.parallelism = parallelism
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.index_bodies = index_bodies
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._queued: Set[str] = set() # Queued or being walked in this process
+        # Pacing per mailbox, kept (like the limiter's) until a bucket has refilled and sat idle
+        self._buckets = TTLCache(max_entries=QUOTA_USER_BUCKETS_MAX, ttl_seconds=BUCKET_IDLE_SECONDS)
+        self.stats = {"pages": 0, "messages_fetched": 0, "throttled_seconds": 0.0, "failed": 0}
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._poll())) # Also resumes walks a restart interrupted
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._queued.clear()
+
+    def enqueue(self, user_email: str):
+        if self._queue is None or user_email in self._queued:
+            return
+        self._queued.add(user_email)
+        self._queue.put_nowait(user_email)
+
+    async def request(self, db: AsyncSession, user_email: str, restart: bool = False) -> GmailBackfillState:
+        """Creates the user's backfill and queues it. A failed one resumes from its checkpoint; `restart` starts over. Commits."""
+        state = await get_backfill_state(db, user_email)
+        if state is None:
+            state = GmailBackfillState(user_email=user_email, status='pending', generation=0, messages_listed=0, messages_stored=0)
+            db.add(state)
+        elif restart:
+            _reset(state)
+        elif state.status == 'failed':
+            state.status = 'pending'
+            state.error = None
+        await db.commit()
+        await db.refresh(state) # Server-side timestamps
+        if state.status in ('pending', 'running'):
+            self.enqueue(user_email)
+        return state
+
+    async def _poll(self):
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(
+                        select(GmailBackfillState.user_email).where(GmailBackfillState.status.in_(['pending', 'running']))
+                    )
+                    user_emails = result.scalars().all()
+                for user_email in user_emails:
+                    self.enqueue(user_email)
+            except Exception as e:
+                print(f"Looking for pending Gmail backfills failed: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def _worker(self):
+        while True:
+            user_email = await self._queue.get()
+            try:
+                await self._backfill_with_retries(user_email)
+            finally:
+                self._queued.discard(user_email)
+
+    async def _backfill_with_retries(self, user_email: str):
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.backfill(user_email)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(getattr(e, 'detail', e))
+                print(f"Gmail backfill for {user_email} failed (attempt {attempt}/{self.max_attempts}): {error}")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(10 * attempt) # The checkpoint keeps everything done so far
+        self.stats["failed"] += 1
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(GmailBackfillState)
+                .where(GmailBackfillState.user_email == user_email, GmailBackfillState.status.in_(['pending', 'running']))
+                .values(status='failed', error=error)
+            )
+            await db.commit()
+
+    async def backfill(self, user_email: str):
+        """Walks the user's mailbox from its checkpoint to the end. No-op if another process is walking it."""
+        quota_user.set(user_email) # Background task: no request set it
+        lock_key = {"key": f"gmail_backfill:{user_email}"}
+        async with engine.connect() as lock_connection:
+            # Session-level, unlike the sync lock: held across the many transactions of a walk
+            locked = await lock_connection.execute(text("SELECT pg_try_advisory_lock(hashtext(:key))"), lock_key)
+            if not locked.scalar():
+                return
+            try:
+                await self._walk(user_email)
+            finally:
+                await lock_connection.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), lock_key)
+
+    async def _walk(self, user_email: str):
+        async with AsyncSessionLocal() as db:
+            state = await get_backfill_state(db, user_email)
+            if state is None or state.status not in ('pending', 'running'):
+                return
+            generation = state.generation
+            credentials = await token_refresher.get_credentials(user_email)
+            gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+            if state.history_id is None:
+                # Take the historyId *before* listing: the sync engine replays whatever changes during the walk
+                profile = await execute_async(gmail_service.users().getProfile(userId='me'))
+                state.history_id = int(profile['historyId'])
+                state.messages_total = profile.get('messagesTotal')
+                state.started_at = datetime.now(timezone.utc)
+                sync_state = await mail_store.get_sync_state(db, user_email)
+                if sync_state is None:
+                    db.add(GmailSyncState(user_email=user_email, history_id=state.history_id))
+                elif sync_state.history_id is None:
+                    sync_state.history_id = state.history_id
+            state.status = 'running'
+            await db.commit()
+            print(f"Gmail backfill for {user_email} {'resuming' if state.page_token else 'starting'} ({state.messages_listed} listed so far)")
+
+            next_page = asyncio.create_task(self._list_page(gmail_service, user_email, state.page_token))
+            try:
+                while True:
+                    page = await next_page
+                    message_ids = [message['id'] for message in page.get('messages', [])]
+                    next_page_token = page.get('nextPageToken')
+                    if next_page_token: # Listed while this page's metadata is fetched
+                        next_page = asyncio.create_task(self._list_page(gmail_service, user_email, next_page_token))
+
+                    # On a resume, or over the window a full sync already stored, most of a page may be there
+                    stored = await mail_store.message_labels(db, user_email, message_ids)
+                    messages = await self._fetch(gmail_service, user_email, [message_id for message_id in message_ids if message_id not in stored])
+                    inserted_ids = await mail_store.insert_messages(db, user_email, messages)
+
+                    finished = next_page_token is None
+                    checkpoint = await db.execute(
+                        update(GmailBackfillState)
+                        .where(GmailBackfillState.user_email == user_email, GmailBackfillState.generation == generation)
+                        .values(
+                            page_token=next_page_token,
+                            messages_listed=GmailBackfillState.messages_listed + len(message_ids),
+                            messages_stored=GmailBackfillState.messages_stored + len(inserted_ids),
+                            status='done' if finished else 'running',
+                            finished_at=datetime.now(timezone.utc) if finished else None,
+                        )
+                    )
+                    if checkpoint.rowcount == 0:
+                        await db.rollback()
+                        print(f"Gmail backfill for {user_email} was restarted elsewhere; stopping this walk")
+                        return
+                    if inserted_ids:
+                        await gmail_sync_engine.notify(db, gmail_service, MailboxDelta(
+                            user_email, False, [message for message in messages if message['id'] in inserted_ids], [], {}
+                        ))
+                    if finished:
+                        sync_state = await mail_store.get_sync_state(db, user_email)
+                        if sync_state is not None and sync_state.synced_at is None:
+                            sync_state.synced_at = datetime.now(timezone.utc) # The store is complete: serve from it
+                    await db.commit() # Rows and checkpoint together
+                    self.stats["pages"] += 1
+                    self.stats["messages_fetched"] += len(messages)
+                    if finished:
+                        print(f"Gmail backfill for {user_email} done")
+                        return
+            finally:
+                if not next_page.done():
+                    next_page.cancel()
+
+    async def _list_page(self, gmail_service, user_email: str, page_token: Optional[str]) -> dict:
+        await self._throttle(user_email, MESSAGE_LIST_COST)
+        return await execute_async(gmail_service.users().messages().list(
+            userId='me', maxResults=BACKFILL_PAGE_SIZE, pageToken=page_token
+        ))
+
+    def _slice_size(self) -> int:
+        # Largest slice whose cost still fits in the user's bucket next to the interactive reserve
+        user_capacity = QUOTA_RATES['gmail'][0] * QUOTA_BURST_SECONDS
+        return max(1, min(50, int(user_capacity * (1 - self.quota_reserve) // MESSAGE_GET_COST)))
+
+    async def _fetch(self, gmail_service, user_email: str, message_ids: List[str]) -> List[dict]:
+        """Metadata for `message_ids`, in paced slices with up to `parallelism` in flight."""
+        semaphore = asyncio.Semaphore(self.parallelism)
+        slice_size = self._slice_size()
+
+        async def fetch_slice(slice_ids: List[str]) -> List[dict]:
+            try:
+                return await fetch_message_metadata(gmail_service, slice_ids, with_body_text=self.index_bodies)
+            finally:
+                semaphore.release()
+
+        tasks = []
+        try:
+            for start in range(0, len(message_ids), slice_size):
+                slice_ids = message_ids[start:start + slice_size]
+                await semaphore.acquire()
+                await self._throttle(user_email, len(slice_ids) * MESSAGE_GET_COST)
+                tasks.append(asyncio.create_task(fetch_slice(slice_ids)))
+                await asyncio.sleep(0) # Let it take its quota before the bucket is looked at again
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return [message for result in results for message in result]
+
+    async def _throttle(self, user_email: str, units: int):
+        bucket = self._buckets.get(user_email)
+        if bucket is None:
+            bucket = TokenBucket(self.units_per_second, max(self.units_per_second, self._slice_size() * MESSAGE_GET_COST))
+        waited = bucket.reserve(units)
+        self._buckets.set(user_email, bucket, ttl_seconds=bucket.seconds_until_full() + BUCKET_IDLE_SECONDS)
+        if waited:
+            await asyncio.sleep(waited)
+        # Interactive requests come first: only go ahead while they leave the user's quota alone
+        while not quota_limiter.has_headroom('gmail', units, user_email, self.quota_reserve):
+            await asyncio.sleep(0.25)
+            waited += 0.25
+        self.stats["throttled_seconds"] += waited
+
+    async def on_sync(self, db: AsyncSession, gmail_service, delta: MailboxDelta):
+        if not delta.full:
+            return
+        state = await get_backfill_state(db, delta.user_email)
+        sync_state = await mail_store.get_sync_state(db, delta.user_email)
+        if sync_state is not None and sync_state.synced_at is not None:
+            # The whole mailbox fit in the full sync's window: nothing left to walk
+            if state is not None and state.status in ('pending', 'running'):
+                _reset(state) # A running walk stops at its next checkpoint
+                state.status = 'done'
+                state.finished_at = datetime.now(timezone.utc)
+            return
+        # A full resync keeps only the newest messages, so whatever a walk stored is gone; and
+        # until a walk stores the rest, reads keep going to Gmail
+        if state is None:
+            if GMAIL_BACKFILL_ENABLED:
+                db.add(GmailBackfillState(user_email=delta.user_email, status='pending', generation=0, messages_listed=0, messages_stored=0))
+                print(f"Gmail backfill for {delta.user_email} queued after a partial full sync")
+        elif state.history_id is not None or state.status != 'pending':
+            _reset(state) # Committed with the sync; the poll picks it up, and a running walk stops at its next checkpoint
+            print(f"Gmail backfill for {delta.user_email} will start over after a full resync")
+
+
+gmail_backfiller = GmailBackfiller(
+    units_per_second=GMAIL_BACKFILL_UNITS_PER_SECOND,
+    quota_reserve=GMAIL_BACKFILL_QUOTA_RESERVE,
+    parallelism=GMAIL_BACKFILL_PARALLELISM,
+    workers=GMAIL_BACKFILL_WORKERS,
+    poll_seconds=GMAIL_BACKFILL_POLL_SECONDS,
+    max_attempts=GMAIL_BACKFILL_MAX_ATTEMPTS,
+    index_bodies=GMAIL_BACKFILL_INDEX_BODIES,
+)
+gmail_sync_engine.add_listener(gmail_backfiller.on_sync)
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import random
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from .cache import TTLCache
+from .google_http import GOOGLE_BATCH_MAX_REQUESTS
+from .google_services import new_batch_request
+from .rate_limit import QUOTA_USER_BUCKETS_MAX, quota_user
+
+# Chunked, concurrent execution of many Google API requests over the batch endpoint.
+# Each chunk is one multipart batch; up to GMAIL_BATCH_PARALLELISM chunks are in flight.
+# Throttled sub-requests (429 / rateLimitExceeded) are retried on their own with jittered
+# backoff, and the chunk size backs off while Google keeps throttling us (AIMD). Gmail
+# throttles each mailbox on its own, so every user (quota_user) has their own chunk size.
+
+GMAIL_BATCH_CHUNK_SIZE = int(os.getenv("GMAIL_BATCH_CHUNK_SIZE", "50")) # Google suggests <= 50 for Gmail
+GMAIL_BATCH_MIN_CHUNK_SIZE = int(os.getenv("GMAIL_BATCH_MIN_CHUNK_SIZE", "5"))
+GMAIL_BATCH_PARALLELISM = int(os.getenv("GMAIL_BATCH_PARALLELISM", "4"))
+GMAIL_BATCH_MAX_RETRIES = int(os.getenv("GMAIL_BATCH_MAX_RETRIES", "4"))
+GMAIL_BATCH_BACKOFF_BASE_SECONDS = float(os.getenv("GMAIL_BATCH_BACKOFF_BASE_SECONDS", "0.5"))
+GMAIL_BATCH_BACKOFF_MAX_SECONDS = float(os.getenv("GMAIL_BATCH_BACKOFF_MAX_SECONDS", "16"))
+GMAIL_BATCH_CHUNK_SIZE_IDLE_SECONDS = 600 # A user's chunk size starts over after this long without batches
+
+RATE_LIMIT_REASONS = (b'ratelimitexceeded', b'userratelimitexceeded') # Gmail also throttles with 403 + these
+
+BatchItem = Tuple[str, HttpRequest] # (request_id, request)
+BatchResult = Tuple[str, Any, Optional[Exception]] # (request_id, response, exception)
+
+
+def is_rate_limited(exception: Optional[Exception]) -> bool:
+    if not isinstance(exception, HttpError):
+        return False
+    if exception.resp.status == 429:
+        return True
+    content = (exception.content or b'').lower()
+    return exception.resp.status == 403 and any(reason in content for reason in RATE_LIMIT_REASONS)
+
+
+def _retry_after_seconds(exception: Exception) -> float:
+    try:
+        return float(exception.resp.get('retry-after', 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0 # HTTP-date form or missing; fall back to our own backoff
+
+
+def backoff_seconds(attempt: int, exception: Optional[Exception] = None) -> float:
+    """Full-jitter exponential backoff, but never sooner than a Retry-After the server sent."""
+    ceiling = min(GMAIL_BATCH_BACKOFF_MAX_SECONDS, GMAIL_BATCH_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    delay = random.uniform(0, ceiling)
+    if exception is not None:
+        delay = max(delay, _retry_after_seconds(exception))
+    return delay
+
+
+class AdaptiveChunkSize:
+    """Batch chunk size that halves when a chunk gets throttled and grows by one per clean chunk."""
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = max(1, minimum)
+        self.maximum = min(maximum, GOOGLE_BATCH_MAX_REQUESTS)
+        self._value = max(self.minimum, min(initial, self.maximum))
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def record(self, requests: int, throttled: int):
+        with self._lock:
+            if throttled:
+                self._value = max(self.minimum, self._value // 2)
+            elif requests >= self._value: # Only full chunks say anything about the current size
+                self._value = min(self.maximum, self._value + 1)
+
+
+class UserChunkSizes:
+    """An AdaptiveChunkSize per user, so one mailbox's 429s don't shrink everyone else's batches."""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, max_users: int, idle_seconds: float):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.idle_seconds = idle_seconds
+        self._sizes = TTLCache(max_entries=max_users, ttl_seconds=idle_seconds)
+
+    def for_user(self, user_email: Optional[str]) -> AdaptiveChunkSize:
+        """The user's chunk size (one shared size for work done on nobody's behalf)."""
+        size = self._sizes.get(user_email)
+        if size is None:
+            size = AdaptiveChunkSize(self.initial, self.minimum, self.maximum)
+        self._sizes.set(user_email, size) # Each run keeps it around for another idle_seconds
+        return size
+
+
+class BatchExecutor:
+    def __init__(self, service_name: str, version: str, chunk_sizes: UserChunkSizes,
+                 parallelism: int, max_retries: int):
+        self.service_name = service_name
+        self.version = version
+        self.chunk_sizes = chunk_sizes
+        self.parallelism = parallelism
+        self.max_retries = max_retries
+
+    async def _execute_once(self, chunk: List[BatchItem]) -> Dict[str, Tuple[Any, Optional[Exception]]]:
+        batch = new_batch_request(self.service_name, self.version)
+        for request_id, request in chunk:
+            batch.add(request, request_id=request_id)
+        try:
+            return await batch.execute()
+        except HttpError as e:
+            # The whole batch failed (e.g. 429 on the batch itself): every part gets that error
+            return {request_id: (None, e) for request_id, _ in chunk}
+
+    async def _run_chunk(self, chunk: List[BatchItem], chunk_size: AdaptiveChunkSize) -> List[BatchResult]:
+        finished: List[BatchResult] = []
+        attempt = 0
+        while True:
+            results = await self._execute_once(chunk)
+            throttled = [(request_id, request) for request_id, request in chunk if is_rate_limited(results[request_id][1])]
+            if attempt == 0: # Retries only carry the throttled leftovers, which say nothing about chunk size
+                chunk_size.record(len(chunk), len(throttled))
+            throttled_ids = {request_id for request_id, _ in throttled}
+            finished.extend(
+                (request_id, response, exception) for request_id, (response, exception) in results.items()
+                if request_id not in throttled_ids
+            )
+            if not throttled:
+                return finished
+            if attempt >= self.max_retries:
+                print(f"Giving up on {len(throttled)} throttled {self.service_name} requests after {attempt} retries")
+                finished.extend((request_id, None, results[request_id][1]) for request_id in throttled_ids)
+                return finished
+            await asyncio.sleep(backoff_seconds(attempt, results[throttled[0][0]][1]))
+            attempt += 1
+            chunk = throttled
+
+    async def iter_results(self, requests: Sequence[BatchItem]) -> AsyncIterator[BatchResult]:
+        """Yields (request_id, response, exception) as each chunk completes (not in request order).
+
+        Chunks are cut lazily, so a chunk size reduced by throttling applies to the rest of the run.
+        """
+        chunk_size = self.chunk_sizes.for_user(quota_user.get())
+        remaining = deque(requests)
+        running = set()
+        try:
+            while remaining or running:
+                while remaining and len(running) < self.parallelism:
+                    size = min(chunk_size.value, len(remaining))
+                    chunk = [remaining.popleft() for _ in range(size)]
+                    running.add(asyncio.create_task(self._run_chunk(chunk, chunk_size)))
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for result in task.result():
+                        yield result
+        finally:
+            for task in running: # Caller stopped early (or we failed): don't leave chunks running
+                task.cancel()
+
+    async def execute(self, requests: Sequence[BatchItem]) -> Dict[str, Tuple[Any, Optional[Exception]]]:
+        """Runs all requests; returns {request_id: (response, exception)}."""
+        return {request_id: (response, exception) async for request_id, response, exception in self.iter_results(requests)}
+
+
+# Per worker and per user: all of a user's Gmail callers back off together when their mailbox quota is hit
+gmail_chunk_sizes = UserChunkSizes(
+    initial=GMAIL_BATCH_CHUNK_SIZE,
+    minimum=GMAIL_BATCH_MIN_CHUNK_SIZE,
+    maximum=GOOGLE_BATCH_MAX_REQUESTS,
+    max_users=QUOTA_USER_BUCKETS_MAX,
+    idle_seconds=GMAIL_BATCH_CHUNK_SIZE_IDLE_SECONDS,
+)
+gmail_batch_executor = BatchExecutor(
+    'gmail', 'v1',
+    chunk_sizes=gmail_chunk_sizes,
+    parallelism=GMAIL_BATCH_PARALLELISM,
+    max_retries=GMAIL_BATCH_MAX_RETRIES,
+)
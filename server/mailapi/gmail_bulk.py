@@ -0,0 +1,217 @@
+import os
+from typing import Dict, List, Literal, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import mail_store
+from .cache import message_body_cache
+from .gmail_batch import gmail_batch_executor
+from .label_catalog import label_catalog
+from .prefetch import gmail_prefetcher
+
+# Bulk triage: one request changes many messages or threads. Messages go through
+# users.messages.batchModify / batchDelete (up to 1000 ids per call, 50 quota units each);
+# threads have no batch method, so their threads.modify / threads.delete calls share HTTP
+# batches instead. The local store is changed first and put back for whatever Gmail rejects.
+
+GMAIL_BULK_MAX_IDS = int(os.getenv("GMAIL_BULK_MAX_IDS", "5000"))
+BATCH_MODIFY_MAX_IDS = 1000 # Gmail's limit for batchModify and batchDelete
+
+BulkAction = Literal[
+    'archive', 'move_to_inbox', 'mark_read', 'mark_unread', 'star', 'unstar',
+    'trash', 'untrash', 'spam', 'not_spam', 'modify', 'delete',
+]
+
+# action -> (addLabelIds, removeLabelIds)
+ACTION_LABELS: Dict[str, Tuple[List[str], List[str]]] = {
+    'archive': ([], ['INBOX']),
+    'move_to_inbox': (['INBOX'], []),
+    'mark_read': ([], ['UNREAD']),
+    'mark_unread': (['UNREAD'], []),
+    'star': (['STARRED'], []),
+    'unstar': ([], ['STARRED']),
+    'trash': (['TRASH'], []),
+    'untrash': ([], ['TRASH']),
+    'spam': (['SPAM'], ['INBOX']),
+    'not_spam': (['INBOX'], ['SPAM']),
+}
+
+
+class BulkItemResult(BaseModel):
+    id: str
+    ok: bool
+    error: Optional[str] = None
+
+
+class BulkMutationResult(BaseModel):
+    action: str
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
+
+
+def resolve_labels(action: str, add_label_ids: List[str], remove_label_ids: List[str]) -> Tuple[List[str], List[str]]:
+    """(addLabelIds, removeLabelIds) for an action. Raises ValueError for a 'modify' that changes nothing."""
+    if action == 'delete':
+        return [], []
+    if action == 'modify':
+        if not add_label_ids and not remove_label_ids:
+            raise ValueError("'modify' needs add_label_ids or remove_label_ids")
+        if set(add_label_ids) & set(remove_label_ids):
+            raise ValueError("A label can't be both added and removed")
+        return list(add_label_ids), list(remove_label_ids)
+    return ACTION_LABELS[action]
+
+
+def _error_text(exception: Exception) -> str:
+    if isinstance(exception, HttpError):
+        return f"{exception.resp.status} {exception.reason}"
+    return str(exception)
+
+
+def _result(action: str, ids: List[str], errors: Dict[str, str]) -> BulkMutationResult:
+    results = [BulkItemResult(id=item_id, ok=item_id not in errors, error=errors.get(item_id)) for item_id in ids]
+    return BulkMutationResult(action=action, succeeded=len(ids) - len(errors), failed=len(errors), results=results)
+
+
+class _OptimisticUpdate:
+    """Applies a bulk change to the local store up front and undoes it for the ids Gmail rejected."""
+
+    def __init__(self, db: AsyncSession, user_email: str, action: str, add_label_ids: List[str], remove_label_ids: List[str]):
+        self.db = db
+        self.user_email = user_email
+        self.action = action
+        self.add_label_ids = add_label_ids
+        self.remove_label_ids = remove_label_ids
+        self.enabled = False
+        self._previous_labels: Dict[str, List[str]] = {}
+        self._removed: List[dict] = []
+
+    async def apply(self, message_ids: List[str]):
+        self.enabled = await mail_store.is_mailbox_synced(self.db, self.user_email)
+        if not self.enabled:
+            return # Nothing stored yet; the first sync will pick up the result
+        if self.action == 'delete':
+            self._removed = await mail_store.remove_messages(self.db, self.user_email, message_ids)
+        else:
+            self._previous_labels = await mail_store.modify_message_labels(
+                self.db, self.user_email, message_ids, self.add_label_ids, self.remove_label_ids
+            )
+        await self.db.commit() # Visible to other requests right away
+        await label_catalog.apply_label_changes(self.user_email, self._label_changes(message_ids, undo=False))
+
+    def _label_changes(self, message_ids: List[str], undo: bool) -> List[Tuple[List[str], List[str]]]:
+        wanted = set(message_ids)
+        if self.action == 'delete':
+            changes = [(record['label_ids'] or [], []) for record in self._removed if record['id'] in wanted]
+        else:
+            changes = [
+                (labels, mail_store.modified_labels(labels, self.add_label_ids, self.remove_label_ids))
+                for message_id, labels in self._previous_labels.items() if message_id in wanted
+            ]
+        return [(after, before) for before, after in changes] if undo else changes
+
+    async def undo(self, message_ids: List[str]):
+        """Called once Gmail has answered, with the ids it rejected (possibly none)."""
+        if not self.enabled:
+            label_catalog.mark_stale(self.user_email) # Don't know these messages' labels; recount on the next read
+            return
+        if not message_ids:
+            return
+        await label_catalog.apply_label_changes(self.user_email, self._label_changes(message_ids, undo=True))
+        failed = set(message_ids)
+        if self.action == 'delete':
+            await mail_store.restore_messages(self.db, self.user_email, [record for record in self._removed if record['id'] in failed])
+        else:
+            await mail_store.restore_message_labels(
+                self.db, self.user_email, {message_id: labels for message_id, labels in self._previous_labels.items() if message_id in failed}
+            )
+        await self.db.commit()
+
+
+def _forget_cached(user_email: str, action: str, message_ids: List[str]):
+    gmail_prefetcher.forget_user(user_email) # Prefetched pages and threads show the old labels
+    if action == 'delete':
+        for message_id in message_ids:
+            message_body_cache.pop((user_email, message_id))
+
+
+async def _execute_or_undo(optimistic: _OptimisticUpdate, requests: List[Tuple[str, object]], message_ids: List[str]):
+    try:
+        return await gmail_batch_executor.execute(requests)
+    except BaseException: # Also a cancelled request: the store was committed before Gmail was asked
+        # A timeout or dropped connection has no per-part results, so we can't tell what Gmail
+        # applied. Put everything back: history reports whatever it did apply, but it would never
+        # correct a change that only the store has.
+        await optimistic.undo(message_ids)
+        raise
+
+
+async def mutate_messages(
+    gmail_service, db: AsyncSession, user_email: str, message_ids: List[str], action: str,
+    add_label_ids: List[str], remove_label_ids: List[str],
+) -> BulkMutationResult:
+    message_ids = list(dict.fromkeys(message_ids)) # Dedupe, keep order
+    add_label_ids, remove_label_ids = resolve_labels(action, add_label_ids, remove_label_ids)
+    optimistic = _OptimisticUpdate(db, user_email, action, add_label_ids, remove_label_ids)
+    await optimistic.apply(message_ids)
+
+    chunks = [message_ids[start:start + BATCH_MODIFY_MAX_IDS] for start in range(0, len(message_ids), BATCH_MODIFY_MAX_IDS)]
+    messages = gmail_service.users().messages()
+    requests = []
+    for index, chunk in enumerate(chunks):
+        if action == 'delete':
+            request = messages.batchDelete(userId='me', body={'ids': chunk})
+        else:
+            request = messages.batchModify(
+                userId='me', body={'ids': chunk, 'addLabelIds': add_label_ids, 'removeLabelIds': remove_label_ids}
+            )
+        requests.append((str(index), request))
+    responses = await _execute_or_undo(optimistic, requests, message_ids)
+
+    # batchModify succeeds or fails as a whole, so every id of a chunk shares its outcome
+    errors: Dict[str, str] = {}
+    for index, chunk in enumerate(chunks):
+        _, exception = responses[str(index)]
+        if exception is not None:
+            print(f"Bulk {action} of {len(chunk)} messages failed for {user_email}: {exception}")
+            errors.update({message_id: _error_text(exception) for message_id in chunk})
+    await optimistic.undo(list(errors))
+    _forget_cached(user_email, action, message_ids)
+    return _result(action, message_ids, errors)
+
+
+async def mutate_threads(
+    gmail_service, db: AsyncSession, user_email: str, thread_ids: List[str], action: str,
+    add_label_ids: List[str], remove_label_ids: List[str],
+) -> BulkMutationResult:
+    thread_ids = list(dict.fromkeys(thread_ids))
+    add_label_ids, remove_label_ids = resolve_labels(action, add_label_ids, remove_label_ids)
+    # A thread-level change applies to every message of the thread, which is how the store sees it
+    message_ids_by_thread = await mail_store.thread_message_ids(db, user_email, thread_ids)
+    all_message_ids = [message_id for message_ids in message_ids_by_thread.values() for message_id in message_ids]
+    optimistic = _OptimisticUpdate(db, user_email, action, add_label_ids, remove_label_ids)
+    await optimistic.apply(all_message_ids)
+
+    threads = gmail_service.users().threads()
+    requests = []
+    for thread_id in thread_ids:
+        if action == 'delete':
+            requests.append((thread_id, threads.delete(userId='me', id=thread_id)))
+        else:
+            requests.append((thread_id, threads.modify(
+                userId='me', id=thread_id, body={'addLabelIds': add_label_ids, 'removeLabelIds': remove_label_ids}
+            )))
+    responses = await _execute_or_undo(optimistic, requests, all_message_ids)
+
+    errors: Dict[str, str] = {}
+    for thread_id in thread_ids:
+        _, exception = responses[thread_id]
+        if exception is not None:
+            print(f"Bulk {action} of thread {thread_id} failed for {user_email}: {exception}")
+            errors[thread_id] = _error_text(exception)
+    await optimistic.undo([message_id for thread_id in errors for message_id in message_ids_by_thread.get(thread_id, [])])
+    _forget_cached(user_email, action, all_message_ids)
+    return _result(action, thread_ids, errors)
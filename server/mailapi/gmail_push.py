@@ -0,0 +1,193 @@
+import asyncio
+import base64
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+import google.oauth2.credentials
+from sqlalchemy import or_, select
+
+from shared.database_config.database import AsyncSessionLocal
+from shared.database_models.models import GmailSyncState
+
+from . import mail_store
+from .gmail_sync import GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, GmailSyncEngine, gmail_sync_engine
+from .google_http import execute_async
+from .google_services import build_service
+from .rate_limit import quota_user
+from .token_refresh import token_refresher
+
+# Gmail push notifications: Gmail publishes {emailAddress, historyId} to a Pub/Sub topic after
+# users.watch, and a push subscription POSTs it to /gmail/push?token=... . Notifications come in
+# bursts (one per change), so they are coalesced per mailbox into a single incremental sync.
+
+GMAIL_PUSH_TOPIC = os.getenv("GMAIL_PUSH_TOPIC") # e.g. projects/my-project/topics/gmail-push
+GMAIL_PUSH_VERIFICATION_TOKEN = os.getenv("GMAIL_PUSH_VERIFICATION_TOKEN") # Shared secret in the push endpoint URL
+GMAIL_PUSH_DEBOUNCE_SECONDS = float(os.getenv("GMAIL_PUSH_DEBOUNCE_SECONDS", "2"))
+GMAIL_PUSH_WORKERS = int(os.getenv("GMAIL_PUSH_WORKERS", "4"))
+GMAIL_WATCH_LABEL_IDS = os.getenv("GMAIL_WATCH_LABEL_IDS", "") # Comma separated; empty watches the whole mailbox
+GMAIL_WATCH_RENEWAL_INTERVAL_SECONDS = float(os.getenv("GMAIL_WATCH_RENEWAL_INTERVAL_SECONDS", "3600"))
+GMAIL_WATCH_RENEW_AHEAD_SECONDS = float(os.getenv("GMAIL_WATCH_RENEW_AHEAD_SECONDS", str(24 * 3600))) # Watches last 7 days
+
+
+def decode_push_envelope(envelope: dict) -> Tuple[str, int]:
+    """Returns (emailAddress, historyId) from a Pub/Sub push body. Raises ValueError if malformed."""
+    try:
+        data = json.loads(base64.b64decode(envelope['message']['data']))
+        return data['emailAddress'], int(data['historyId'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed Pub/Sub push message: {e}")
+
+
+class PushSyncQueue:
+    """Debounces push notifications per mailbox and runs at most one queued sync per user.
+
+    A notification for a mailbox that already has a sync waiting only raises the
+    historyId we need to reach; a sync is skipped when the store is already past it.
+    """
+
+    def __init__(self, engine: GmailSyncEngine, debounce_seconds: float, workers: int):
+        self.engine = engine
+        self.debounce_seconds = debounce_seconds
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._target_history_ids: Dict[str, int] = {} # Highest notified historyId per waiting mailbox
+        self._scheduled: Set[str] = set() # Mailboxes with a debounce timer running or sitting in the queue
+        self.stats = {"received": 0, "coalesced": 0, "synced": 0, "skipped": 0, "failed": 0}
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker_tasks = []
+        self._queue = None
+        self._scheduled.clear()
+
+    def notify(self, user_email: str, history_id: int):
+        self.stats["received"] += 1
+        self._target_history_ids[user_email] = max(history_id, self._target_history_ids.get(user_email, 0))
+        if user_email in self._scheduled:
+            self.stats["coalesced"] += 1
+            return
+        self._scheduled.add(user_email)
+        asyncio.get_running_loop().call_later(self.debounce_seconds, self._enqueue, user_email)
+
+    def _enqueue(self, user_email: str):
+        if self._queue is None: # Stopped while the timer was pending
+            return
+        self._queue.put_nowait(user_email)
+
+    def pending(self) -> int:
+        return len(self._scheduled)
+
+    async def _worker(self):
+        while True:
+            user_email = await self._queue.get()
+            # Notifications arriving from here on schedule another round (the sync below may miss them)
+            self._scheduled.discard(user_email)
+            target_history_id = self._target_history_ids.pop(user_email, 0)
+            try:
+                if await self._already_synced(user_email, target_history_id):
+                    self.stats["skipped"] += 1
+                    continue
+                credentials = await token_refresher.get_credentials(user_email)
+                await self.engine.sync(user_email, credentials)
+                self.stats["synced"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"Push-triggered Gmail sync failed for {user_email}: {getattr(e, 'detail', e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _already_synced(self, user_email: str, target_history_id: int) -> bool:
+        async with AsyncSessionLocal() as db:
+            state = await mail_store.get_sync_state(db, user_email)
+        return state is not None and state.history_id is not None and state.history_id >= target_history_id
+
+
+async def renew_watch(user_email: str, credentials: google.oauth2.credentials.Credentials) -> dict:
+    """(Re)starts users.watch for the mailbox and records when it expires. Returns Gmail's response."""
+    if not GMAIL_PUSH_TOPIC:
+        raise RuntimeError("GMAIL_PUSH_TOPIC is not configured")
+    quota_user.set(user_email)
+    body = {'topicName': GMAIL_PUSH_TOPIC}
+    label_ids = [label_id.strip() for label_id in GMAIL_WATCH_LABEL_IDS.split(',') if label_id.strip()]
+    if label_ids:
+        body['labelIds'] = label_ids
+        body['labelFilterBehavior'] = 'include'
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    response = await execute_async(gmail_service.users().watch(userId='me', body=body))
+
+    async with AsyncSessionLocal() as db:
+        state = await mail_store.get_sync_state(db, user_email)
+        if state is None:
+            state = GmailSyncState(user_email=user_email)
+            db.add(state)
+        state.watch_expiration = datetime.fromtimestamp(int(response['expiration']) / 1000, tz=timezone.utc)
+        await db.commit()
+    return response
+
+
+class WatchRenewalScheduler:
+    """Renews users.watch for mailboxes whose push subscription is about to lapse."""
+
+    def __init__(self, interval_seconds: float, renew_ahead_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.renew_ahead_seconds = renew_ahead_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.renew_expiring()
+            except Exception as e:
+                print(f"Gmail watch renewal round failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def renew_expiring(self):
+        cutoff = datetime.now(timezone.utc) + timedelta(seconds=self.renew_ahead_seconds)
+        async with AsyncSessionLocal() as db:
+            # Mailboxes the sync keeps current that are not watched yet, or whose watch lapses soon
+            result = await db.execute(select(GmailSyncState.user_email).where(
+                or_(GmailSyncState.watch_expiration < cutoff, GmailSyncState.watch_expiration.is_(None)),
+                GmailSyncState.history_id.is_not(None),
+            ))
+            user_emails = result.scalars().all()
+        for user_email in user_emails:
+            try:
+                credentials = await token_refresher.get_credentials(user_email)
+                await renew_watch(user_email, credentials)
+                print(f"Renewed Gmail watch for {user_email}")
+            except Exception as e:
+                print(f"Gmail watch renewal failed for {user_email}: {e}")
+
+
+push_sync_queue = PushSyncQueue(gmail_sync_engine, debounce_seconds=GMAIL_PUSH_DEBOUNCE_SECONDS, workers=GMAIL_PUSH_WORKERS)
+watch_renewal_scheduler = WatchRenewalScheduler(
+    interval_seconds=GMAIL_WATCH_RENEWAL_INTERVAL_SECONDS,
+    renew_ahead_seconds=GMAIL_WATCH_RENEW_AHEAD_SECONDS,
+)
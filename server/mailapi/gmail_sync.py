@@ -0,0 +1,370 @@
+import asyncio
+import os
+from contextlib import aclosing
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import google.oauth2.credentials
+import googleapiclient.errors
+from pydantic import BaseModel
+from sqlalchemy import delete, event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database_config.database import AsyncSessionLocal
+from shared.database_models.models import GmailMessage, GmailMessageLabel, GmailThread, GmailSyncState
+
+from . import mail_store, mime
+from .gmail_batch import gmail_batch_executor
+from .google_http import execute_async
+from .google_services import build_service
+from .rate_limit import quota_user
+from .token_refresh import token_refresher
+
+GMAIL_API_SERVICE_NAME = 'gmail'
+GMAIL_API_VERSION = 'v1'
+
+# A full resync (first sync, or Google expired our historyId) only pulls the most recent messages;
+# a bigger mailbox is only served from the store once the backfill has stored the rest
+FULL_SYNC_MAX_MESSAGES = int(os.getenv("GMAIL_FULL_SYNC_MAX_MESSAGES", "2000"))
+GMAIL_SYNC_INTERVAL_SECONDS = float(os.getenv("GMAIL_SYNC_INTERVAL_SECONDS", "300"))
+GMAIL_SYNC_CONCURRENCY = int(os.getenv("GMAIL_SYNC_CONCURRENCY", "4"))
+GMAIL_SYNC_SCHEDULE_ENABLED = os.getenv("GMAIL_SYNC_SCHEDULE_ENABLED", "true").lower() == "true"
+GMAIL_SYNC_INDEX_BODIES = os.getenv("GMAIL_SYNC_INDEX_BODIES", "true").lower() == "true" # Body text for /gmail/search
+HISTORY_PAGE_SIZE = 500
+
+
+class SyncResult(BaseModel):
+    user_email: str
+    mode: str # "full", "incremental" or "skipped" (another worker is syncing this mailbox)
+    history_id: Optional[str] = None
+    messages_added: int = 0
+    messages_deleted: int = 0
+    labels_changed: int = 0
+    threads_touched: int = 0
+
+
+class MailboxDelta:
+    """What one sync changed in a mailbox; handed to sync listeners.
+
+    `label_changes` maps message id -> (labels before, labels after). A message that is new to
+    us has no labels before, a deleted one none after; before is None when we can't know it
+    (a change to a message outside the store that history doesn't describe fully).
+    A full resync replaces the mailbox wholesale: `full` is set and only `added_messages` is filled.
+    The backfill job reports the older messages it adds the same way, with `full` unset.
+
+    `inserted_ids` are the added messages the store did not have before (None: all of them).
+    History can report a message as added that the backfill already stored, and counted.
+    """
+
+    def __init__(self, user_email: str, full: bool, added_messages: List[dict],
+                 deleted_ids: List[str], label_changes: Dict[str, Tuple[Optional[List[str]], List[str]]],
+                 inserted_ids: Optional[Set[str]] = None):
+        self.user_email = user_email
+        self.full = full
+        self.added_messages = added_messages
+        self.deleted_ids = deleted_ids
+        self.label_changes = label_changes
+        self.inserted_ids = inserted_ids
+
+    def is_inserted(self, message_id: str) -> bool:
+        return self.inserted_ids is None or message_id in self.inserted_ids
+
+
+# Called with (db, gmail_service, delta) after a sync wrote to the store, before it commits
+SyncListener = Callable[[AsyncSession, object, MailboxDelta], Awaitable[None]]
+
+_AFTER_COMMIT = 'gmail_after_commit' # Session.info key: callbacks waiting for the transaction to commit
+
+
+def after_commit(db: AsyncSession, callback: Callable[[], None]):
+    """Runs `callback` once the session's current transaction commits; dropped if it rolls back.
+
+    For listeners with effects outside the database (files on disk), which must not see a sync
+    that ends up rolled back. Runs inside the commit, so it should only schedule work.
+    """
+    if _AFTER_COMMIT not in db.info:
+        db.info[_AFTER_COMMIT] = []
+
+        def on_commit(session):
+            if session.in_nested_transaction():
+                return # A listener's savepoint, not the sync's transaction
+            callbacks, session.info[_AFTER_COMMIT] = session.info[_AFTER_COMMIT], []
+            for pending in callbacks:
+                pending()
+
+        def on_rollback(session):
+            if not session.in_nested_transaction():
+                session.info[_AFTER_COMMIT] = []
+
+        event.listen(db.sync_session, 'after_commit', on_commit)
+        event.listen(db.sync_session, 'after_rollback', on_rollback)
+    db.info[_AFTER_COMMIT].append(callback)
+
+
+def _slim_full_message(message: dict) -> dict:
+    # Keep what the store needs; drop the (possibly large) body parts as soon as they are indexed
+    payload = message.get('payload', {})
+    slim = {key: value for key, value in message.items() if key != 'payload'}
+    slim['payload'] = {'headers': payload.get('headers', [])}
+    slim['body_text'] = mime.body_text(mime.extract_parts(payload))
+    return slim
+
+
+async def fetch_message_metadata(gmail_service, message_ids: List[str], with_body_text: bool = False) -> List[dict]:
+    """Fetches messages for the store (in id order); messages gone since are skipped.
+
+    Any other failure (throttled past the executor's retries, 5xx, timeout) is raised: the
+    caller's transaction must not move the history baseline past messages it never stored.
+
+    With `with_body_text`, messages are fetched with format='full' (same quota cost) and carry
+    a `body_text` field for search instead of their payload parts.
+    """
+    def _request(message_id: str):
+        if with_body_text:
+            return gmail_service.users().messages().get(userId='me', id=message_id, format='full')
+        return gmail_service.users().messages().get(
+            userId='me', id=message_id, format='metadata', metadataHeaders=mail_store.METADATA_HEADERS
+        )
+
+    fetched: Dict[str, dict] = {}
+    results = gmail_batch_executor.iter_results([(message_id, _request(message_id)) for message_id in message_ids])
+    async with aclosing(results): # Stops the remaining chunks if we raise
+        async for message_id, response, exception in results:
+            if exception is not None:
+                if isinstance(exception, googleapiclient.errors.HttpError) and exception.resp.status == 404:
+                    continue # Deleted since it was listed
+                print(f"Error fetching message {message_id} for sync: {exception}")
+                raise exception
+            fetched[message_id] = _slim_full_message(response) if with_body_text else response
+    return [fetched[message_id] for message_id in message_ids if message_id in fetched]
+
+
+class GmailSyncEngine:
+    """Keeps the local metadata store in step with Gmail using users.history.list.
+
+    The first sync (and any sync whose startHistoryId Google no longer has) falls back to a
+    bounded full resync of the most recent FULL_SYNC_MAX_MESSAGES messages. That sets the
+    history baseline; synced_at (reads served from the store) is only set if the window held
+    the whole mailbox, otherwise when the backfill finishes storing the rest.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._listeners: List[SyncListener] = []
+
+    def add_listener(self, listener: SyncListener):
+        """Registers a coroutine to run after every sync that changed something (caches, derived tables)."""
+        self._listeners.append(listener)
+
+    async def notify(self, db: AsyncSession, gmail_service, delta: MailboxDelta):
+        for listener in self._listeners:
+            try:
+                await listener(db, gmail_service, delta)
+            except Exception as e:
+                # Derived data can catch up later; never lose the sync itself over it
+                print(f"Gmail sync listener {getattr(listener, '__qualname__', listener)} failed for {delta.user_email}: {e}")
+
+    async def sync(self, user_email: str, credentials: google.oauth2.credentials.Credentials) -> SyncResult:
+        quota_user.set(user_email) # Also called from background tasks, which have no request context
+        lock = self._locks.setdefault(user_email, asyncio.Lock())
+        async with lock:
+            async with AsyncSessionLocal() as db:
+                # Only one worker syncs a mailbox at a time; the lock is released when the transaction ends
+                locked = await db.execute(
+                    text("SELECT pg_try_advisory_xact_lock(hashtext(:key))"), {"key": f"gmail_sync:{user_email}"}
+                )
+                if not locked.scalar():
+                    return SyncResult(user_email=user_email, mode="skipped")
+
+                gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+                state = await mail_store.get_sync_state(db, user_email)
+                if state is None or state.history_id is None:
+                    result = await self._full_sync(db, gmail_service, user_email)
+                else:
+                    try:
+                        result = await self._incremental_sync(db, gmail_service, user_email, state)
+                    except googleapiclient.errors.HttpError as e:
+                        if e.resp.status != 404:
+                            raise
+                        # startHistoryId is too old (Google keeps roughly a week of history)
+                        print(f"History expired for {user_email}, falling back to full resync")
+                        result = await self._full_sync(db, gmail_service, user_email)
+                await db.commit()
+                return result
+
+    async def _full_sync(self, db: AsyncSession, gmail_service, user_email: str) -> SyncResult:
+        # Take the mailbox historyId *before* listing so changes made while we list are replayed next time
+        profile = await execute_async(gmail_service.users().getProfile(userId='me'))
+        history_id = profile['historyId']
+
+        message_ids: List[str] = []
+        page_token = None
+        while len(message_ids) < FULL_SYNC_MAX_MESSAGES:
+            response = await execute_async(gmail_service.users().messages().list(
+                userId='me', maxResults=min(500, FULL_SYNC_MAX_MESSAGES - len(message_ids)), pageToken=page_token
+            ))
+            message_ids.extend(message['id'] for message in response.get('messages', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        complete = page_token is None # Listed to the end, not cut off by the window
+
+        messages = await fetch_message_metadata(gmail_service, message_ids, with_body_text=GMAIL_SYNC_INDEX_BODIES)
+
+        # Replace whatever we had: anything outside the window may have been deleted meanwhile
+        for model in (GmailMessageLabel, GmailMessage, GmailThread):
+            await db.execute(delete(model).where(model.user_email == user_email))
+        thread_ids = await mail_store.upsert_messages(db, user_email, messages)
+        await self._save_state(db, user_email, history_id, complete=complete)
+        await self.notify(db, gmail_service, MailboxDelta(user_email, True, messages, [], {}))
+        print(f"Full Gmail sync for {user_email}: {len(messages)} messages{'' if complete else ' (newest only)'}, historyId {history_id}")
+        return SyncResult(
+            user_email=user_email, mode="full", history_id=str(history_id),
+            messages_added=len(messages), threads_touched=len(thread_ids),
+        )
+
+    async def _incremental_sync(self, db: AsyncSession, gmail_service, user_email: str, state: GmailSyncState) -> SyncResult:
+        added_ids: Dict[str, None] = {} # Ordered set
+        deleted_ids = set()
+        labels_by_message: Dict[str, List[str]] = {} # Last known labelIds per message, from label change records
+        history_labels_before: Dict[str, List[str]] = {} # Labels before the first change record, for messages not in the store
+        history_id = str(state.history_id)
+
+        page_token = None
+        while True:
+            response = await execute_async(gmail_service.users().history().list(
+                userId='me', startHistoryId=str(state.history_id), maxResults=HISTORY_PAGE_SIZE, pageToken=page_token,
+                historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+            ))
+            for record in response.get('history', []):
+                for item in record.get('messagesAdded', []):
+                    added_ids[item['message']['id']] = None
+                for item in record.get('messagesDeleted', []):
+                    deleted_ids.add(item['message']['id'])
+                for kind in ('labelsAdded', 'labelsRemoved'):
+                    for item in record.get(kind, []):
+                        message = item['message']
+                        label_ids = message.get('labelIds', [])
+                        if message['id'] not in history_labels_before:
+                            changed = item.get('labelIds', [])
+                            if kind == 'labelsAdded':
+                                history_labels_before[message['id']] = [label_id for label_id in label_ids if label_id not in changed]
+                            else:
+                                history_labels_before[message['id']] = label_ids + [label_id for label_id in changed if label_id not in label_ids]
+                        labels_by_message[message['id']] = label_ids
+            history_id = response.get('historyId', history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        new_ids = [message_id for message_id in added_ids if message_id not in deleted_ids]
+        label_updates = {
+            message_id: label_ids for message_id, label_ids in labels_by_message.items()
+            if message_id not in deleted_ids and message_id not in added_ids
+        }
+        # Labels as the store had them, so listeners see what actually changed
+        stored_labels = await mail_store.message_labels(db, user_email, list(deleted_ids) + new_ids + list(label_updates))
+
+        thread_ids = set()
+        thread_ids |= await mail_store.delete_messages(db, user_email, deleted_ids)
+        new_messages = []
+        if new_ids:
+            # Fetched fresh, so their labels are already current
+            new_messages = await fetch_message_metadata(gmail_service, new_ids, with_body_text=GMAIL_SYNC_INDEX_BODIES)
+            thread_ids |= await mail_store.upsert_messages(db, user_email, new_messages)
+        thread_ids |= await mail_store.set_message_labels(db, user_email, label_updates)
+        await self._save_state(db, user_email, history_id)
+
+        label_changes: Dict[str, Tuple[Optional[List[str]], List[str]]] = {}
+        for message_id in deleted_ids:
+            if message_id not in added_ids: # Added and deleted within this window: never counted anywhere
+                label_changes[message_id] = (stored_labels.get(message_id), [])
+        for message in new_messages:
+            label_changes[message['id']] = (stored_labels.get(message['id'], []), message.get('labelIds', []))
+        for message_id, label_ids in label_updates.items():
+            label_changes[message_id] = (stored_labels.get(message_id, history_labels_before.get(message_id)), label_ids)
+        label_changes = {
+            message_id: (before, after) for message_id, (before, after) in label_changes.items()
+            if before is None or set(before) != set(after)
+        }
+        if new_messages or deleted_ids or label_changes:
+            inserted_ids = {message['id'] for message in new_messages if message['id'] not in stored_labels}
+            await self.notify(db, gmail_service, MailboxDelta(
+                user_email, False, new_messages, sorted(deleted_ids), label_changes, inserted_ids=inserted_ids
+            ))
+        return SyncResult(
+            user_email=user_email, mode="incremental", history_id=str(history_id),
+            messages_added=len(new_ids), messages_deleted=len(deleted_ids),
+            labels_changed=len(label_updates), threads_touched=len(thread_ids),
+        )
+
+    async def _save_state(self, db: AsyncSession, user_email: str, history_id, complete: Optional[bool] = None):
+        """Moves the history baseline. `complete` (full syncs only) says whether the store now holds the whole mailbox."""
+        state = await mail_store.get_sync_state(db, user_email)
+        if state is None:
+            state = GmailSyncState(user_email=user_email)
+            db.add(state)
+        state.history_id = int(history_id)
+        if complete is not None:
+            # A cut-off window must not be served as the mailbox: older mail would just be missing
+            state.synced_at = datetime.now(timezone.utc) if complete else None
+
+
+class GmailSyncScheduler:
+    """Periodically syncs mailboxes that already have a history baseline.
+
+    First syncs are left to POST /gmail/sync (and the backfill): a user who only uses Calendar
+    or Drive must not get a full mailbox fetch they never asked for.
+    """
+
+    def __init__(self, engine: GmailSyncEngine, interval_seconds: float, concurrency: int):
+        self.engine = engine
+        self.interval_seconds = interval_seconds
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.sync_all()
+            except Exception as e:
+                print(f"Scheduled Gmail sync round failed: {e}")
+
+    async def sync_all(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(GmailSyncState.user_email).where(GmailSyncState.history_id.is_not(None)))
+            user_emails = set(result.scalars().all())
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _sync_one(user_email: str):
+            async with semaphore:
+                try:
+                    credentials = await token_refresher.get_credentials(user_email)
+                    await self.engine.sync(user_email, credentials)
+                except Exception as e:
+                    print(f"Scheduled Gmail sync failed for {user_email}: {e}")
+
+        await asyncio.gather(*(_sync_one(user_email) for user_email in user_emails))
+
+
+gmail_sync_engine = GmailSyncEngine()
+gmail_sync_scheduler = GmailSyncScheduler(
+    gmail_sync_engine,
+    interval_seconds=GMAIL_SYNC_INTERVAL_SECONDS,
+    concurrency=GMAIL_SYNC_CONCURRENCY,
+)
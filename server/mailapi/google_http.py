@@ -0,0 +1,277 @@
+import importlib.util
+import os
+from contextlib import asynccontextmanager
+import urllib.parse
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MAX_URI_LENGTH, HttpRequest
+
+from .rate_limit import quota_limiter, quota_user
+from .token_refresh import token_refresher
+
+# Async transport for requests built with googleapiclient. The discovery-built service is
+# still used to construct requests (URL, query, body, postproc); only the network I/O runs
+# here, on one pooled keep-alive httpx client per worker instead of a blocking httplib2.Http.
+
+GOOGLE_HTTP_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_HTTP_TIMEOUT_SECONDS", "30"))
+GOOGLE_HTTP_MAX_CONNECTIONS = int(os.getenv("GOOGLE_HTTP_MAX_CONNECTIONS", "100"))
+GOOGLE_HTTP_MAX_KEEPALIVE = int(os.getenv("GOOGLE_HTTP_MAX_KEEPALIVE", "20"))
+GOOGLE_BATCH_MAX_REQUESTS = 100  # Google rejects batches with more than 100 parts
+
+# HTTP/2 needs the optional `h2` package (httpx[http2]); fall back to HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_client: Optional[httpx.AsyncClient] = None
+
+BatchCallback = Callable[[str, Any, Optional[Exception]], None]
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=GOOGLE_HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=GOOGLE_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=GOOGLE_HTTP_MAX_KEEPALIVE,
+            ),
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _authorized_headers(request: HttpRequest) -> Dict[str, str]:
+    headers = dict(request.headers)
+    # request.http is the google_auth_httplib2.AuthorizedHttp the service was built with
+    credentials = getattr(request.http, "credentials", None)
+    if credentials is not None:
+        credentials.apply(headers)
+    return headers
+
+
+def _wire_request(request: HttpRequest) -> Tuple[str, str, Any, Dict[str, str]]:
+    """(method, uri, body, headers) to send, with HttpRequest.execute()'s long-URI override.
+
+    A GET whose URI is longer than Google accepts (long metadataHeaders or q=) goes out as a
+    POST with the query as a form body and x-http-method-override: GET.
+    """
+    headers = _authorized_headers(request)
+    if request.method != "GET" or len(request.uri) <= MAX_URI_LENGTH:
+        return request.method, request.uri, request.body, headers
+    parsed = urllib.parse.urlparse(request.uri)
+    headers["x-http-method-override"] = "GET"
+    headers["content-type"] = "application/x-www-form-urlencoded"
+    uri = urllib.parse.urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, None, None))
+    return "POST", uri, parsed.query, headers
+
+
+async def _renew_credentials(request: HttpRequest, force: bool = False) -> bool:
+    """Swaps the credentials `request` is sent with for fresh ones if they have expired (or `force`).
+
+    AuthorizedHttp refreshed expired tokens by itself; this transport only applies the token it
+    is given, and the backfill walk and scheduled syncs hold one service for longer than a token
+    lives. The new token goes onto the service's http, so its later requests use it too.
+    Returns whether the credentials changed.
+    """
+    http = request.http
+    credentials = getattr(http, "credentials", None)
+    user_email = quota_user.get()
+    if credentials is None or not credentials.refresh_token or not user_email:
+        return False
+    if not force and not credentials.expired:
+        return False
+    try:
+        if force: # Google turned the token down before its expiry (revoked, clock skew)
+            fresh = await token_refresher.refresh(user_email, force=True)
+        else:
+            fresh = await token_refresher.get_credentials(user_email)
+    except Exception as e:
+        print(f"Could not renew Google credentials for {user_email}: {e}")
+        return False # Let Google's 401 through as usual
+    if fresh is credentials or fresh.refresh_token != credentials.refresh_token:
+        return False # Not the account this service was built for
+    http.credentials = fresh
+    return True
+
+
+def _to_httplib2_response(status_code: int, reason: str, headers) -> httplib2.Response:
+    # postproc / HttpError expect an httplib2-style response (dict of lowercase headers + .status)
+    info = {key.lower(): value for key, value in headers.items()}
+    info["status"] = str(status_code)
+    resp = httplib2.Response(info)
+    resp.reason = reason
+    return resp
+
+
+async def execute_async(request: HttpRequest):
+    """Async equivalent of `request.execute()`.
+
+    Returns the deserialized response, or raises googleapiclient.errors.HttpError
+    exactly like execute() does, so existing error handling keeps working.
+    """
+    await quota_limiter.acquire_for([getattr(request, "methodId", None)])
+    await _renew_credentials(request)
+    method, uri, body, headers = _wire_request(request)
+    response = await get_http_client().request(method, uri, content=body, headers=headers)
+    if response.status_code == 401 and await _renew_credentials(request, force=True):
+        method, uri, body, headers = _wire_request(request)
+        response = await get_http_client().request(method, uri, content=body, headers=headers)
+    resp = _to_httplib2_response(response.status_code, response.reason_phrase, response.headers)
+    return request.postproc(resp, response.content)
+
+
+@asynccontextmanager
+async def stream_async(request: HttpRequest) -> AsyncIterator[httpx.Response]:
+    """Like execute_async, but yields the raw streaming httpx response instead of parsing it.
+
+    For large responses (attachments) that should not be held in memory. Error statuses
+    still raise HttpError.
+    """
+    await quota_limiter.acquire_for([getattr(request, "methodId", None)])
+    await _renew_credentials(request)
+    for attempt in range(2):
+        method, uri, body, headers = _wire_request(request)
+        async with get_http_client().stream(method, uri, content=body, headers=headers) as response:
+            if response.status_code >= 300:
+                content = await response.aread()
+                if response.status_code == 401 and attempt == 0 and await _renew_credentials(request, force=True):
+                    continue
+                resp = _to_httplib2_response(response.status_code, response.reason_phrase, response.headers)
+                raise HttpError(resp, content, uri=request.uri)
+            yield response
+            return
+
+
+class AsyncBatchHttpRequest:
+    """Async equivalent of googleapiclient's BatchHttpRequest (multipart/mixed batch).
+
+    Usage mirrors `service.new_batch_http_request()`: add requests with optional
+    per-request callbacks `callback(request_id, response, exception)`, then
+    `await batch.execute()`. Results are also returned as {request_id: (response, exception)}.
+    """
+
+    def __init__(self, batch_uri: str, callback: Optional[BatchCallback] = None):
+        self.batch_uri = batch_uri
+        self._callback = callback
+        self._order: List[str] = []
+        self._requests: Dict[str, HttpRequest] = {}
+        self._callbacks: Dict[str, Optional[BatchCallback]] = {}
+
+    def add(self, request: HttpRequest, callback: Optional[BatchCallback] = None, request_id: Optional[str] = None):
+        if len(self._order) >= GOOGLE_BATCH_MAX_REQUESTS:
+            raise ValueError(f"A batch can hold at most {GOOGLE_BATCH_MAX_REQUESTS} requests")
+        if request_id is None:
+            request_id = str(len(self._order) + 1)
+        if request_id in self._requests:
+            raise KeyError(f"Duplicate batch request id: {request_id}")
+        self._order.append(request_id)
+        self._requests[request_id] = request
+        self._callbacks[request_id] = callback
+
+    def __len__(self):
+        return len(self._order)
+
+    def _serialize_part(self, request_id: str, request: HttpRequest) -> str:
+        parsed = urllib.parse.urlparse(request.uri)
+        path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        lines = [
+            "Content-Type: application/http",
+            "Content-Transfer-Encoding: binary",
+            f"Content-ID: <{request_id}>",
+            "",
+            f"{request.method} {path} HTTP/1.1",
+            f"Host: {parsed.netloc}",
+        ]
+        headers = _authorized_headers(request)
+        headers.pop("accept-encoding", None)  # Parts are never compressed; the outer response is
+        for key, value in headers.items():
+            lines.append(f"{key}: {value}")
+        body = request.body or ""
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        if body:
+            lines.append(f"Content-Length: {len(body.encode('utf-8'))}")
+        lines.append("")
+        lines.append(body)
+        return "\r\n".join(lines)
+
+    def _parse_response(self, content_type: str, content: bytes) -> Dict[str, Tuple[httplib2.Response, bytes]]:
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode("utf-8") + b"\r\n\r\n" + content
+        )
+        parts: Dict[str, Tuple[httplib2.Response, bytes]] = {}
+        for part in message.iter_parts():
+            # Google answers Content-ID <response-N> for request Content-ID <N>
+            content_id = part.get("Content-ID", "").strip("<> ")
+            request_id = content_id[len("response-"):] if content_id.startswith("response-") else content_id
+            payload = part.get_payload(decode=True) or b""
+            status_line, _, rest = payload.partition(b"\n")
+            status_parts = status_line.decode("utf-8").strip().split(" ", 2)  # e.g. "HTTP/1.1 200 OK"
+            status_code = int(status_parts[1])
+            reason = status_parts[2] if len(status_parts) > 2 else ""
+            head, _, body = rest.partition(b"\r\n\r\n")
+            headers = BytesParser(policy=HTTP).parsebytes(head + b"\r\n\r\n")
+            parts[request_id] = (_to_httplib2_response(status_code, reason, headers), body)
+        return parts
+
+    async def _post(self) -> httpx.Response:
+        boundary = f"===============batch_{uuid.uuid4().hex}=="
+        body = "".join(
+            f"--{boundary}\r\n{self._serialize_part(request_id, self._requests[request_id])}\r\n"
+            for request_id in self._order
+        ) + f"--{boundary}--\r\n"
+
+        # The outer request carries the same credentials as the parts
+        headers = {"Content-Type": f"multipart/mixed; boundary=\"{boundary}\""}
+        credentials = getattr(self._requests[self._order[0]].http, "credentials", None)
+        if credentials is not None:
+            credentials.apply(headers)
+        return await get_http_client().post(self.batch_uri, content=body.encode("utf-8"), headers=headers)
+
+    async def execute(self) -> Dict[str, Tuple[Any, Optional[Exception]]]:
+        if not self._order:
+            return {}
+        # Every part is charged against quota, as Google does
+        await quota_limiter.acquire_for(getattr(self._requests[request_id], "methodId", None) for request_id in self._order)
+        first_request = self._requests[self._order[0]]
+        await _renew_credentials(first_request) # Parts come from one service, so they share its http
+        response = await self._post()
+        if response.status_code == 401 and await _renew_credentials(first_request, force=True):
+            response = await self._post()
+        if response.status_code >= 300:
+            resp = _to_httplib2_response(response.status_code, response.reason_phrase, response.headers)
+            raise HttpError(resp, response.content, uri=self.batch_uri)
+
+        parts = self._parse_response(response.headers.get("content-type", ""), response.content)
+        results: Dict[str, Tuple[Any, Optional[Exception]]] = {}
+        for request_id in self._order:
+            request = self._requests[request_id]
+            result, exception = None, None
+            if request_id not in parts:
+                exception = HttpError(
+                    _to_httplib2_response(500, "Missing batch response", {}), b"", uri=request.uri
+                )
+            else:
+                resp, content = parts[request_id]
+                try:
+                    result = request.postproc(resp, content)
+                except HttpError as e:
+                    exception = e
+            results[request_id] = (result, exception)
+            callback = self._callbacks[request_id] or self._callback
+            if callback is not None:
+                callback(request_id, result, exception)
+        return results
@@ -0,0 +1,56 @@
+import json
+from typing import Dict, Optional, Tuple
+
+import google.oauth2.credentials
+import googleapiclient.discovery
+from googleapiclient import discovery_cache
+
+from .google_http import AsyncBatchHttpRequest, BatchCallback
+
+# (service name, version) pairs used by the app. Their discovery documents ship with
+# google-api-python-client, so they are pinned to the installed library version.
+DISCOVERY_DOCUMENTS = [
+    ('gmail', 'v1'),
+    ('calendar', 'v3'),
+    ('drive', 'v2'),
+    ('oauth2', 'v2'),
+]
+
+_discovery_documents: Dict[Tuple[str, str], dict] = {}
+
+
+def load_discovery_documents():
+    """Parses the bundled discovery documents once (called at startup)."""
+    for service_name, version in DISCOVERY_DOCUMENTS:
+        get_discovery_document(service_name, version)
+    print(f"Loaded {len(_discovery_documents)} Google API discovery documents")
+
+
+def get_discovery_document(service_name: str, version: str) -> dict:
+    key = (service_name, version)
+    document = _discovery_documents.get(key)
+    if document is None:
+        raw_document = discovery_cache.get_static_doc(service_name, version)
+        if raw_document is None:
+            raise ValueError(f"No bundled discovery document for {service_name} {version}")
+        document = json.loads(raw_document)
+        _discovery_documents[key] = document
+    return document
+
+
+def build_service(service_name: str, version: str, credentials: google.oauth2.credentials.Credentials):
+    """Drop-in replacement for googleapiclient.discovery.build(...).
+
+    Builds from the already parsed discovery document, so no file read or JSON
+    parsing happens per request. The returned service is bound to `credentials`
+    and should not be shared between requests.
+    """
+    document = get_discovery_document(service_name, version)
+    return googleapiclient.discovery.build_from_document(document, credentials=credentials)
+
+
+def new_batch_request(service_name: str, version: str, callback: Optional[BatchCallback] = None) -> AsyncBatchHttpRequest:
+    """Async replacement for `service.new_batch_http_request()`."""
+    document = get_discovery_document(service_name, version)
+    batch_uri = document['rootUrl'] + document.get('batchPath', 'batch')
+    return AsyncBatchHttpRequest(batch_uri, callback=callback)
@@ -0,0 +1,140 @@
+import asyncio
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from googleapiclient.errors import HttpError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import TTLCache
+from .gmail_batch import gmail_batch_executor
+from .gmail_sync import MailboxDelta, gmail_sync_engine
+from .google_http import execute_async
+
+# Per-user label catalog for the sidebar. labels.list carries no counts, and labels.get (which
+# does) is one call per label, so counts are fetched in one HTTP batch and then kept current:
+# sync deltas patch message counts exactly and mark the touched labels for a recount, which
+# happens in the background sync itself. Reads are served from memory.
+# Label creation, renames and deletions made outside this API don't show up in history;
+# the TTL bounds how long those take to appear.
+
+LABEL_CATALOG_TTL_SECONDS = float(os.getenv("LABEL_CATALOG_TTL_SECONDS", "900")) # 15 minutes
+LABEL_CATALOG_MAX_ENTRIES = int(os.getenv("LABEL_CATALOG_MAX_ENTRIES", "1024"))
+
+COUNT_FIELDS = ('messagesTotal', 'messagesUnread', 'threadsTotal', 'threadsUnread')
+
+LabelChange = Tuple[Optional[List[str]], List[str]] # (labels before or None if unknown, labels after)
+
+
+class _UserLabels:
+    def __init__(self, labels: List[dict]):
+        self.labels: Dict[str, dict] = {label['id']: dict(label) for label in labels} # labels.list order
+        self.stale: Set[str] = set(self.labels) # Labels whose counts need a labels.get
+
+    def snapshot(self, with_counts: bool) -> List[dict]:
+        if with_counts:
+            return [dict(label) for label in self.labels.values()]
+        return [{key: value for key, value in label.items() if key not in COUNT_FIELDS} for label in self.labels.values()]
+
+
+class LabelCatalog:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._entries = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.stats = {"lists": 0, "label_gets": 0, "patched": 0, "hits": 0}
+
+    def _lock(self, user_email: str) -> asyncio.Lock:
+        return self._locks.setdefault(user_email, asyncio.Lock())
+
+    async def labels(self, gmail_service, user_email: str, with_counts: bool = False) -> List[dict]:
+        """The user's labels, from memory when possible. With counts, stale ones are refetched first."""
+        async with self._lock(user_email):
+            entry: Optional[_UserLabels] = self._entries.get(user_email)
+            if entry is None:
+                results = await execute_async(gmail_service.users().labels().list(userId='me'))
+                entry = _UserLabels(results.get('labels', []))
+                self._entries.set(user_email, entry)
+                self.stats["lists"] += 1
+            elif not with_counts or not entry.stale:
+                self.stats["hits"] += 1
+            if with_counts and entry.stale:
+                await self._refresh_counts(gmail_service, user_email, entry)
+            return entry.snapshot(with_counts)
+
+    async def _refresh_counts(self, gmail_service, user_email: str, entry: _UserLabels):
+        label_ids = [label_id for label_id in entry.labels if label_id in entry.stale]
+        responses = await gmail_batch_executor.execute(
+            [(label_id, gmail_service.users().labels().get(userId='me', id=label_id)) for label_id in label_ids]
+        )
+        self.stats["label_gets"] += len(label_ids)
+        for label_id in label_ids:
+            label, exception = responses[label_id]
+            if exception is None:
+                entry.labels[label_id] = label
+                entry.stale.discard(label_id)
+            elif isinstance(exception, HttpError) and exception.resp.status == 404:
+                entry.labels.pop(label_id, None) # Deleted since we listed it
+                entry.stale.discard(label_id)
+            else:
+                # Stays stale; the old (or patched) counts are served until a refetch works
+                print(f"Error fetching Gmail label {label_id} for {user_email}: {exception}")
+
+    async def apply_label_changes(self, user_email: str, changes: Iterable[LabelChange]) -> bool:
+        """Patches cached counts for messages whose labels changed. Returns whether a recount is due.
+
+        Message counts follow exactly from the change; thread counts don't (they depend on the
+        thread's other messages), so touched labels are also marked for a recount.
+        """
+        if self._entries.get(user_email) is None:
+            return False
+        async with self._lock(user_email):
+            entry: Optional[_UserLabels] = self._entries.get(user_email)
+            if entry is None:
+                return False
+            for before, after in changes:
+                if before is None: # Don't know what it lost, so anything may have changed
+                    entry.stale.update(entry.labels)
+                    continue
+                before, after = set(before), set(after)
+                for label_id in before | after:
+                    label = entry.labels.get(label_id)
+                    if label is None:
+                        # A label we haven't listed (just created); relist on the next read
+                        self._entries.pop(user_email)
+                        return False
+                    was, now = label_id in before, label_id in after
+                    was_unread, now_unread = was and 'UNREAD' in before, now and 'UNREAD' in after
+                    if was == now and was_unread == now_unread:
+                        continue
+                    if 'messagesTotal' in label:
+                        label['messagesTotal'] = max(0, label['messagesTotal'] + now - was)
+                        label['messagesUnread'] = max(0, label.get('messagesUnread', 0) + now_unread - was_unread)
+                        self.stats["patched"] += 1
+                    entry.stale.add(label_id)
+            return bool(entry.stale)
+
+    async def refresh(self, gmail_service, user_email: str):
+        """Refetches the counts of labels marked stale, if the user has a catalog at all."""
+        async with self._lock(user_email):
+            entry: Optional[_UserLabels] = self._entries.get(user_email)
+            if entry is not None and entry.stale:
+                await self._refresh_counts(gmail_service, user_email, entry)
+
+    def invalidate(self, user_email: str):
+        self._entries.pop(user_email)
+
+    def mark_stale(self, user_email: str):
+        """Recount everything on the next read, e.g. after changes we couldn't describe label by label."""
+        entry: Optional[_UserLabels] = self._entries.get(user_email)
+        if entry is not None:
+            entry.stale.update(entry.labels)
+
+    async def on_sync(self, db: AsyncSession, gmail_service, delta: MailboxDelta):
+        if delta.full:
+            self.invalidate(delta.user_email) # Replaced wholesale; deltas say nothing about what changed
+            return
+        if await self.apply_label_changes(delta.user_email, delta.label_changes.values()):
+            await self.refresh(gmail_service, delta.user_email) # Already in the background, so recount now
+
+
+label_catalog = LabelCatalog(max_entries=LABEL_CATALOG_MAX_ENTRIES, ttl_seconds=LABEL_CATALOG_TTL_SECONDS)
+gmail_sync_engine.add_listener(label_catalog.on_sync)
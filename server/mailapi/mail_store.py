@@ -0,0 +1,527 @@
+import base64
+import json
+import re
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, distinct, exists, func, literal_column, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from shared.database_models.models import GmailMessage, GmailMessageLabel, GmailThread, GmailSyncState
+
+# Local Gmail metadata store (tables in shared/database_models/models.py).
+# Writers (the sync engine) pass Gmail API message resources fetched with format='metadata';
+# readers get label-filtered, date-ordered pages with an opaque keyset cursor.
+
+# Headers requested with format='metadata' when fetching messages for the store
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Cc', 'Date']
+
+UPSERT_CHUNK_SIZE = 500 # Keeps each INSERT well under Postgres' bind parameter limit
+
+
+def _header(headers: List[dict], name: str) -> Optional[str]:
+    return next((h['value'] for h in headers if h['name'].lower() == name.lower()), None)
+
+
+def _to_int(value) -> Optional[int]:
+    return int(value) if value not in (None, '') else None
+
+
+def message_record(user_email: str, message: dict) -> dict:
+    """Flattens a Gmail message resource (format='metadata' or 'full') into a gmail_messages row."""
+    headers = message.get('payload', {}).get('headers', [])
+    return {
+        'user_email': user_email,
+        'id': message['id'],
+        'thread_id': message['threadId'],
+        'label_ids': message.get('labelIds', []),
+        'history_id': _to_int(message.get('historyId')),
+        'internal_date': _to_int(message.get('internalDate')),
+        'snippet': message.get('snippet', ''),
+        'subject': _header(headers, 'Subject'),
+        'from_addr': _header(headers, 'From'),
+        'to_addr': _header(headers, 'To'),
+        'cc_addr': _header(headers, 'Cc'),
+        'date_header': _header(headers, 'Date'),
+        'body_text': message.get('body_text'), # Set by the sync engine when it fetched the body
+    }
+
+
+def encode_cursor(internal_date: Optional[int], item_id: str) -> str:
+    raw = json.dumps({'d': internal_date, 'id': item_id}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[Optional[int], str]]:
+    """Returns (internal_date, id), or None if this is not one of our cursors (e.g. a Gmail pageToken)."""
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return data['d'], data['id']
+    except Exception:
+        return None
+
+
+# --- Sync state ---
+
+async def get_sync_state(db: AsyncSession, user_email: str) -> Optional[GmailSyncState]:
+    return await db.get(GmailSyncState, user_email)
+
+
+async def is_mailbox_synced(db: AsyncSession, user_email: str) -> bool:
+    state = await get_sync_state(db, user_email)
+    return state is not None and state.synced_at is not None
+
+
+def store_version(state: GmailSyncState) -> str:
+    """Changes whenever stored data does: with every sync (history_id) and optimistic write (local_revision)."""
+    return f"{state.history_id}.{state.local_revision or 0}"
+
+
+async def push_current_version(db: AsyncSession, user_email: str) -> Optional[str]:
+    """store_version(), if a live push watch keeps the store current with Gmail.
+
+    Without a watch the store can lag Gmail by a whole sync interval, so callers get None
+    and have to ask Gmail.
+    """
+    state = await get_sync_state(db, user_email)
+    if state is None or state.synced_at is None or state.history_id is None or state.watch_expiration is None:
+        return None
+    if state.watch_expiration <= datetime.now(timezone.utc):
+        return None
+    return store_version(state)
+
+
+async def bump_local_revision(db: AsyncSession, user_email: str):
+    await db.execute(
+        update(GmailSyncState)
+        .where(GmailSyncState.user_email == user_email)
+        .values(local_revision=GmailSyncState.local_revision + 1)
+        .execution_options(synchronize_session='fetch')
+    )
+
+
+# --- Writes ---
+
+async def upsert_messages(db: AsyncSession, user_email: str, messages: List[dict]) -> set:
+    """Inserts or updates messages (and their label rows), then refreshes the affected threads.
+
+    Returns the set of touched thread ids. Does not commit.
+    """
+    records = [message_record(user_email, message) for message in messages if message.get('id')]
+    if not records:
+        return set()
+    for start in range(0, len(records), UPSERT_CHUNK_SIZE):
+        chunk = records[start:start + UPSERT_CHUNK_SIZE]
+        stmt = pg_insert(GmailMessage).values(chunk)
+        set_ = {column: stmt.excluded[column] for column in chunk[0] if column not in ('user_email', 'id')}
+        set_['body_text'] = func.coalesce(stmt.excluded.body_text, GmailMessage.body_text) # Metadata-only updates keep the body
+        stmt = stmt.on_conflict_do_update(index_elements=['user_email', 'id'], set_=set_)
+        await db.execute(stmt)
+    await _replace_label_rows(db, user_email, records)
+    thread_ids = {record['thread_id'] for record in records}
+    await refresh_threads(db, user_email, thread_ids)
+    return thread_ids
+
+
+async def insert_messages(db: AsyncSession, user_email: str, messages: List[dict]) -> set:
+    """Inserts messages the store doesn't have yet, then refreshes their threads.
+
+    Rows already stored are left alone: the sync engine keeps those current, and they may
+    be fresher than a bulk fetch that started earlier. Returns the ids that were inserted.
+    Does not commit.
+    """
+    records = [message_record(user_email, message) for message in messages if message.get('id')]
+    inserted_ids = set()
+    for start in range(0, len(records), UPSERT_CHUNK_SIZE):
+        stmt = pg_insert(GmailMessage).values(records[start:start + UPSERT_CHUNK_SIZE]).on_conflict_do_nothing()
+        inserted_ids.update((await db.execute(stmt.returning(GmailMessage.id))).scalars().all())
+    inserted = [record for record in records if record['id'] in inserted_ids]
+    if inserted:
+        await _replace_label_rows(db, user_email, inserted)
+        await refresh_threads(db, user_email, {record['thread_id'] for record in inserted})
+    return inserted_ids
+
+
+async def set_message_labels(db: AsyncSession, user_email: str, labels_by_message: Dict[str, List[str]]) -> set:
+    """Replaces the label set of stored messages. Unknown message ids are ignored. Returns touched thread ids."""
+    if not labels_by_message:
+        return set()
+    result = await db.execute(
+        select(GmailMessage.id, GmailMessage.thread_id, GmailMessage.internal_date).where(
+            GmailMessage.user_email == user_email, GmailMessage.id.in_(list(labels_by_message))
+        )
+    )
+    records = []
+    for message_id, thread_id, internal_date in result.all():
+        label_ids = list(labels_by_message[message_id])
+        await db.execute(
+            update(GmailMessage)
+            .where(GmailMessage.user_email == user_email, GmailMessage.id == message_id)
+            .values(label_ids=label_ids)
+        )
+        records.append({'id': message_id, 'thread_id': thread_id, 'internal_date': internal_date, 'label_ids': label_ids})
+    await _replace_label_rows(db, user_email, records)
+    thread_ids = {record['thread_id'] for record in records}
+    await refresh_threads(db, user_email, thread_ids)
+    return thread_ids
+
+
+async def set_body_texts(db: AsyncSession, user_email: str, body_texts: Dict[str, str]):
+    """Fills in search body text for stored messages that don't have it yet (e.g. after a detail view)."""
+    for message_id, text in body_texts.items():
+        await db.execute(
+            update(GmailMessage)
+            .where(GmailMessage.user_email == user_email, GmailMessage.id == message_id, GmailMessage.body_text.is_(None))
+            .values(body_text=text)
+        )
+
+
+async def delete_messages(db: AsyncSession, user_email: str, message_ids: Iterable[str]) -> set:
+    """Removes messages from the store. Returns touched thread ids."""
+    message_ids = list(message_ids)
+    if not message_ids:
+        return set()
+    result = await db.execute(
+        select(GmailMessage.thread_id).where(GmailMessage.user_email == user_email, GmailMessage.id.in_(message_ids))
+    )
+    thread_ids = set(result.scalars().all())
+    await db.execute(delete(GmailMessageLabel).where(
+        GmailMessageLabel.user_email == user_email, GmailMessageLabel.message_id.in_(message_ids)
+    ))
+    await db.execute(delete(GmailMessage).where(GmailMessage.user_email == user_email, GmailMessage.id.in_(message_ids)))
+    await refresh_threads(db, user_email, thread_ids)
+    return thread_ids
+
+
+# --- Optimistic writes (applied before Gmail confirms them; callers undo on failure) ---
+
+_SNAPSHOT_COLUMNS = [
+    column.name for column in GmailMessage.__table__.columns
+    if column.name not in ('search_vector', 'created_at', 'updated_at') # Generated or server-managed
+]
+
+
+async def message_labels(db: AsyncSession, user_email: str, message_ids: Iterable[str]) -> Dict[str, List[str]]:
+    """Stored label_ids per message id; messages not in the store are left out."""
+    message_ids = list(message_ids)
+    if not message_ids:
+        return {}
+    result = await db.execute(
+        select(GmailMessage.id, GmailMessage.label_ids).where(
+            GmailMessage.user_email == user_email, GmailMessage.id.in_(message_ids)
+        )
+    )
+    return {message_id: list(label_ids or []) for message_id, label_ids in result.all()}
+
+
+async def thread_message_ids(db: AsyncSession, user_email: str, thread_ids: Iterable[str]) -> Dict[str, List[str]]:
+    result = await db.execute(
+        select(GmailMessage.thread_id, GmailMessage.id).where(
+            GmailMessage.user_email == user_email, GmailMessage.thread_id.in_(list(thread_ids))
+        )
+    )
+    message_ids: Dict[str, List[str]] = {}
+    for thread_id, message_id in result.all():
+        message_ids.setdefault(thread_id, []).append(message_id)
+    return message_ids
+
+
+def modified_labels(label_ids: List[str], add_label_ids: List[str], remove_label_ids: List[str]) -> List[str]:
+    """A message's labels after a messages.modify with these add/remove lists."""
+    new_label_ids = [label_id for label_id in label_ids if label_id not in remove_label_ids]
+    return new_label_ids + [label_id for label_id in add_label_ids if label_id not in new_label_ids]
+
+
+async def modify_message_labels(
+    db: AsyncSession, user_email: str, message_ids: Iterable[str], add_label_ids: List[str], remove_label_ids: List[str]
+) -> Dict[str, List[str]]:
+    """Adds/removes labels on stored messages, like messages.modify does.
+
+    Returns the previous label_ids of every message that changed; pass them back to
+    restore_message_labels() to undo. Does not commit.
+    """
+    previous, updated = {}, {}
+    for message_id, label_ids in (await message_labels(db, user_email, message_ids)).items():
+        new_label_ids = modified_labels(label_ids, add_label_ids, remove_label_ids)
+        if new_label_ids != label_ids:
+            previous[message_id] = label_ids
+            updated[message_id] = new_label_ids
+    if updated:
+        await set_message_labels(db, user_email, updated)
+        await bump_local_revision(db, user_email)
+    return previous
+
+
+async def restore_message_labels(db: AsyncSession, user_email: str, previous_labels: Dict[str, List[str]]):
+    """Undoes modify_message_labels() for the given messages. Does not commit."""
+    if previous_labels:
+        await set_message_labels(db, user_email, previous_labels)
+        await bump_local_revision(db, user_email)
+
+
+async def remove_messages(db: AsyncSession, user_email: str, message_ids: Iterable[str]) -> List[dict]:
+    """Deletes stored messages, returning their rows so restore_messages() can undo it. Does not commit."""
+    message_ids = list(message_ids)
+    result = await db.execute(
+        select(*[GmailMessage.__table__.c[name] for name in _SNAPSHOT_COLUMNS]).where(
+            GmailMessage.user_email == user_email, GmailMessage.id.in_(message_ids)
+        )
+    )
+    records = [dict(row._mapping) for row in result.all()]
+    if records:
+        await delete_messages(db, user_email, [record['id'] for record in records])
+        await bump_local_revision(db, user_email)
+    return records
+
+
+async def restore_messages(db: AsyncSession, user_email: str, records: List[dict]):
+    """Puts back rows removed by remove_messages(). Rows a sync has written since win. Does not commit."""
+    if not records:
+        return
+    restored_ids = set()
+    for start in range(0, len(records), UPSERT_CHUNK_SIZE):
+        stmt = pg_insert(GmailMessage).values(records[start:start + UPSERT_CHUNK_SIZE]).on_conflict_do_nothing()
+        restored_ids.update((await db.execute(stmt.returning(GmailMessage.id))).scalars().all())
+    restored = [record for record in records if record['id'] in restored_ids]
+    if restored:
+        await _replace_label_rows(db, user_email, restored)
+        await refresh_threads(db, user_email, {record['thread_id'] for record in restored})
+        await bump_local_revision(db, user_email)
+
+
+async def _replace_label_rows(db: AsyncSession, user_email: str, records: List[dict]):
+    message_ids = [record['id'] for record in records]
+    await db.execute(delete(GmailMessageLabel).where(
+        GmailMessageLabel.user_email == user_email, GmailMessageLabel.message_id.in_(message_ids)
+    ))
+    label_rows = [
+        {
+            'user_email': user_email,
+            'message_id': record['id'],
+            'label_id': label_id,
+            'thread_id': record['thread_id'],
+            'internal_date': record['internal_date'],
+        }
+        for record in records for label_id in set(record['label_ids'] or [])
+    ]
+    for start in range(0, len(label_rows), UPSERT_CHUNK_SIZE):
+        await db.execute(pg_insert(GmailMessageLabel).values(label_rows[start:start + UPSERT_CHUNK_SIZE]).on_conflict_do_nothing())
+
+
+async def refresh_threads(db: AsyncSession, user_email: str, thread_ids: Iterable[str]):
+    """Recomputes gmail_threads rows from their messages; drops threads with no messages left."""
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return
+    result = await db.execute(
+        select(GmailMessage)
+        .where(GmailMessage.user_email == user_email, GmailMessage.thread_id.in_(thread_ids))
+        .order_by(GmailMessage.thread_id, GmailMessage.internal_date)
+        .execution_options(populate_existing=True) # Rows may have been changed by core UPDATE/INSERT above
+    )
+    messages_by_thread: Dict[str, List[GmailMessage]] = {}
+    for message in result.scalars().all():
+        messages_by_thread.setdefault(message.thread_id, []).append(message)
+
+    empty_thread_ids = [thread_id for thread_id in thread_ids if thread_id not in messages_by_thread]
+    if empty_thread_ids:
+        await db.execute(delete(GmailThread).where(GmailThread.user_email == user_email, GmailThread.id.in_(empty_thread_ids)))
+
+    rows = []
+    for thread_id, messages in messages_by_thread.items():
+        latest = messages[-1] # Ordered by internal_date
+        label_ids = sorted({label_id for message in messages for label_id in (message.label_ids or [])})
+        history_ids = [message.history_id for message in messages if message.history_id is not None]
+        rows.append({
+            'user_email': user_email,
+            'id': thread_id,
+            'history_id': max(history_ids) if history_ids else None,
+            'snippet': latest.snippet,
+            'message_count': len(messages),
+            'label_ids': label_ids,
+            'latest_message_id': latest.id,
+            'latest_message_subject': latest.subject,
+            'latest_message_from': latest.from_addr,
+            'latest_message_date': latest.date_header or (str(latest.internal_date) if latest.internal_date else None),
+            'latest_internal_date': latest.internal_date,
+            'importance': None, # Stale now; thread_ranking rescores it
+            'owes_reply': None,
+        })
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk = rows[start:start + UPSERT_CHUNK_SIZE]
+        stmt = pg_insert(GmailThread).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_email', 'id'],
+            set_={column: stmt.excluded[column] for column in chunk[0] if column not in ('user_email', 'id')},
+        )
+        await db.execute(stmt)
+
+
+# --- Reads ---
+
+async def _keyset_page(db: AsyncSession, query, sort_column, id_column, cursor: Optional[Tuple[Optional[int], str]], limit: int,
+                       with_nulls: bool = True) -> list:
+    """Up to `limit` rows of `query` after `cursor`, in (sort DESC NULLS LAST, id DESC) order.
+
+    Run as two range scans of an index in that order: a row-value bound over the rows that
+    have a sort key, then the NULL tail (unless `with_nulls` is off). A single OR of the two
+    would make Postgres filter the index from its start instead.
+    """
+    rows = []
+    if cursor is None or cursor[0] is not None:
+        keyed = query.where(sort_column.is_not(None))
+        if cursor is not None:
+            keyed = keyed.where(tuple_(sort_column, id_column) < tuple_(cursor[0], cursor[1]))
+        keyed = keyed.order_by(sort_column.desc().nulls_last(), id_column.desc()).limit(limit)
+        rows = list((await db.execute(keyed)).scalars().all())
+    if len(rows) < limit and with_nulls:
+        tail = query.where(sort_column.is_(None))
+        if cursor is not None and cursor[0] is None:
+            tail = tail.where(id_column < cursor[1])
+        tail = tail.order_by(sort_column.desc().nulls_last(), id_column.desc()).limit(limit - len(rows))
+        rows.extend((await db.execute(tail)).scalars().all())
+    return rows
+
+
+async def get_messages(db: AsyncSession, user_email: str, message_ids: Iterable[str]) -> Dict[str, GmailMessage]:
+    """Stored messages by id; ids not in the store are left out."""
+    result = await db.execute(select(GmailMessage).where(GmailMessage.user_email == user_email, GmailMessage.id.in_(list(message_ids))))
+    return {message.id: message for message in result.scalars().all()}
+
+
+async def get_threads(db: AsyncSession, user_email: str, thread_ids: Iterable[str]) -> Dict[str, GmailThread]:
+    """Stored threads by id; ids not in the store are left out."""
+    result = await db.execute(select(GmailThread).where(GmailThread.user_email == user_email, GmailThread.id.in_(list(thread_ids))))
+    return {thread.id: thread for thread in result.scalars().all()}
+
+
+async def list_messages(
+    db: AsyncSession, user_email: str, label_ids: List[str], limit: int, cursor: Optional[str] = None
+) -> Tuple[List[GmailMessage], Optional[str]]:
+    """Messages carrying all of `label_ids`, newest first. Returns (messages, next_cursor)."""
+    first_label, other_labels = label_ids[0], label_ids[1:]
+    label_row = aliased(GmailMessageLabel) # Aliased so the EXISTS subqueries below are not correlated to it
+    query = (
+        select(GmailMessage)
+        .join(label_row, and_(label_row.user_email == GmailMessage.user_email, label_row.message_id == GmailMessage.id))
+        .where(label_row.user_email == user_email, label_row.label_id == first_label)
+    )
+    for label_id in other_labels:
+        query = query.where(exists().where(
+            GmailMessageLabel.user_email == user_email,
+            GmailMessageLabel.message_id == GmailMessage.id,
+            GmailMessageLabel.label_id == label_id,
+        ))
+    messages = await _keyset_page(db, query, label_row.internal_date, label_row.message_id, decode_cursor(cursor), limit + 1)
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1].internal_date, messages[-1].id)
+    return messages, next_cursor
+
+
+async def list_threads(
+    db: AsyncSession, user_email: str, label_ids: List[str], limit: int, cursor: Optional[str] = None, order: str = 'date'
+) -> Tuple[List[GmailThread], Optional[str]]:
+    """Threads with at least one message for each of `label_ids`, ordered by their latest message.
+
+    order='importance' orders by the stored ranking instead, leaving out threads not scored
+    yet: callers run thread_ranker.ensure() first.
+    """
+    sort_column = GmailThread.importance if order == 'importance' else GmailThread.latest_internal_date
+    query = select(GmailThread).where(GmailThread.user_email == user_email)
+    for label_id in label_ids:
+        query = query.where(exists().where(
+            GmailMessageLabel.user_email == user_email,
+            GmailMessageLabel.thread_id == GmailThread.id,
+            GmailMessageLabel.label_id == label_id,
+        ))
+    threads = await _keyset_page(db, query, sort_column, GmailThread.id, decode_cursor(cursor), limit + 1, with_nulls=order != 'importance')
+    next_cursor = None
+    if len(threads) > limit:
+        threads = threads[:limit]
+        last = threads[-1]
+        next_cursor = encode_cursor(last.importance if order == 'importance' else last.latest_internal_date, last.id)
+    return threads, next_cursor
+
+
+async def estimate_result_size(db: AsyncSession, user_email: str, label_ids: List[str], threads: bool = False) -> int:
+    """Rough equivalent of Gmail's resultSizeEstimate: size of the first label (index-only count)."""
+    counted = func.count(distinct(GmailMessageLabel.thread_id)) if threads else func.count()
+    result = await db.execute(
+        select(counted).where(GmailMessageLabel.user_email == user_email, GmailMessageLabel.label_id == label_ids[0])
+    )
+    return result.scalar_one()
+
+
+# --- Search ---
+
+SEARCH_CANDIDATE_LIMIT = 1000 # Only the newest matches are ranked, which keeps short typeahead prefixes fast
+
+_SEARCH_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def search_tsquery(query_text: str, prefix: bool):
+    """tsquery for user input, or None if it has no searchable terms.
+
+    prefix=True (typeahead) matches every term as a prefix; otherwise the input is parsed
+    like a web search box ("quoted phrases", OR, -excluded).
+    """
+    if not prefix:
+        return func.websearch_to_tsquery('simple', query_text) if _SEARCH_TERM.search(query_text) else None
+    # \w+ terms contain no tsquery operators, so joining them is safe to hand to to_tsquery
+    terms = _SEARCH_TERM.findall(query_text.lower())
+    if not terms:
+        return None
+    return func.to_tsquery('simple', ' & '.join(f"{term}:*" for term in terms))
+
+
+async def search_messages(
+    db: AsyncSession, user_email: str, query_text: str, label_ids: Optional[List[str]] = None,
+    limit: int = 25, offset: int = 0, prefix: bool = True,
+) -> Tuple[List[Tuple[GmailMessage, float]], bool]:
+    """Ranked full-text search over stored messages. Returns ([(message, rank)], has_more)."""
+    tsquery = search_tsquery(query_text, prefix)
+    if tsquery is None:
+        return [], False
+    candidates = (
+        select(GmailMessage.id.label('id'))
+        .where(GmailMessage.user_email == user_email, GmailMessage.search_vector.op('@@')(tsquery))
+    )
+    for label_id in label_ids or []:
+        candidates = candidates.where(exists().where(
+            GmailMessageLabel.user_email == user_email,
+            GmailMessageLabel.message_id == GmailMessage.id,
+            GmailMessageLabel.label_id == label_id,
+        ))
+    candidates = candidates.order_by(GmailMessage.internal_date.desc().nulls_last()).limit(SEARCH_CANDIDATE_LIMIT).subquery()
+
+    # Weights for D, C, B, A (body, snippet, addresses, subject)
+    rank = func.ts_rank_cd(literal_column("'{0.1, 0.2, 0.6, 1.0}'::float4[]"), GmailMessage.search_vector, tsquery).label('rank')
+    query = (
+        select(GmailMessage, rank)
+        .join(candidates, and_(GmailMessage.user_email == user_email, GmailMessage.id == candidates.c.id))
+        .order_by(rank.desc(), GmailMessage.internal_date.desc().nulls_last(), GmailMessage.id)
+        .offset(offset)
+        .limit(limit + 1)
+    )
+    rows = [(message, float(message_rank)) for message, message_rank in (await db.execute(query)).all()]
+    return rows[:limit], len(rows) > limit
+
+
+def encode_offset_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({'o': offset}).encode('utf-8')).decode('ascii')
+
+
+def decode_offset_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Offset for a search cursor (0 for no cursor), or None if it is not one of ours (a Gmail pageToken)."""
+    if not cursor:
+        return 0
+    try:
+        return max(0, int(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))['o']))
+    except Exception:
+        return None
@@ -7,17 +7,17 @@ from datetime import datetime, timedelta # For JWT expiry
 from typing import Dict, Optional, List
 
 from fastapi import FastAPI, Request, Depends, HTTPException, status, Response as FastAPIResponse, Query
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer, HTTPAuthorizationCredentials, HTTPBearer # For JWT validation
 from pydantic import BaseModel
 import requests
 import uvicorn
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 
 import google.oauth2.credentials
 import google_auth_oauthlib.flow
-import googleapiclient.discovery
 import google.auth.transport.requests # Added for token refresh consistency
 
 # --- Database Imports --- 
@@ -27,6 +27,18 @@ from shared.database_config.database import engine, Base, get_db, create_db_and_
 from shared.database_models.models import UserGoogleToken, Profile, Todo # Added Todo
 # --- End Database Imports ---
 
+from .cache import credentials_cache # Per-worker credentials cache
+from .token_refresh import credentials_to_dict, token_refresher, token_renewal_scheduler
+from .google_services import build_service, load_discovery_documents
+from .google_http import execute_async, close_http_client
+from .gmail_sync import GMAIL_SYNC_SCHEDULE_ENABLED, gmail_sync_scheduler
+from .gmail_push import GMAIL_PUSH_TOPIC, push_sync_queue, watch_renewal_scheduler
+from .rate_limit import quota_limiter, quota_user
+from .compression import CompressionMiddleware
+from .prefetch import gmail_prefetcher
+from .gmail_backfill import GMAIL_BACKFILL_ENABLED, GMAIL_BACKFILL_ON_LOGIN, gmail_backfiller
+from .embedding_index import embedding_index
+
 # OAuth2 configuration
 # CLIENT_SECRETS_FILE = "server/mailapi/client_secret.json" # Removed: Will load from env vars
 # Instead of CLIENT_SECRETS_FILE, ensure these environment variables are set in production:
@@ -67,7 +79,10 @@ origins = [
     "http://localhost:8000",  # For the FastAPI app itself if it makes requests to itself
 ]
 
-app = FastAPI(title="Mail API with Google OAuth and JWT - Refactored")
+app = FastAPI(
+    title="Mail API with Google OAuth and JWT - Refactored",
+    default_response_class=ORJSONResponse, # Same JSON, serialized several times faster
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -75,6 +90,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"], # Lets the frontend read validators for conditional polling
 )
 
 app.add_middleware(
@@ -82,6 +98,8 @@ app.add_middleware(
     secret_key=os.getenv("SESSION_SECRET_KEY", "your-session-secret-key-please-change")
 )
 
+app.add_middleware(CompressionMiddleware) # Outermost, so it sees the final response bytes
+
 class CredentialsModel(BaseModel):
     token: str
     refresh_token: Optional[str] = None
@@ -161,68 +179,11 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 
 # --- Dependency to get valid Google Credentials (handles refresh) ---
 async def get_refreshed_google_credentials(
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db) # Inject DB session
+    current_user: User = Depends(get_current_user)
 ) -> google.oauth2.credentials.Credentials:
-    user_email = current_user.email
-    db_token_entry = await db.get(UserGoogleToken, user_email)
-
-    if not db_token_entry:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, 
-            detail="User Google tokens not found in DB. Please re-authenticate."
-        )
-    
-    print(f"DB token entry: {db_token_entry}")
-
-    # Construct dict specifically for Google Credentials, excluding user_email
-    token_data_for_google_creds = {
-        'token': db_token_entry.token,
-        'refresh_token': db_token_entry.refresh_token,
-        'token_uri': db_token_entry.token_uri,
-        'client_id': db_token_entry.client_id,
-        'client_secret': db_token_entry.client_secret,
-        'scopes': db_token_entry.scopes
-    }
-    credentials = google.oauth2.credentials.Credentials(**token_data_for_google_creds)
-    
-    if credentials.expired and credentials.refresh_token:
-        print(f"Google token expired for {user_email}, attempting refresh...")
-        try:
-            request_object = google.auth.transport.requests.Request()
-            credentials.refresh(request_object)
-            # Update the stored tokens in DB with the refreshed ones
-            refreshed_token_data = credentials_to_dict(credentials) # This helper is fine
-            for key, value in refreshed_token_data.items():
-                setattr(db_token_entry, key, value)
-            await db.commit()
-            await db.refresh(db_token_entry)
-            print(f"Successfully refreshed Google token for {user_email} in DB")
-        except google.auth.exceptions.RefreshError as e:
-            print(f"Failed to refresh Google token for {user_email}: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, 
-                detail=f"Failed to refresh Google token ({e}). Please re-authenticate."
-            )
-        except Exception as e:
-            print(f"Unexpected error refreshing Google token for {user_email}: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"An unexpected error occurred during token refresh: {e}"
-            )
-    elif credentials.expired and not credentials.refresh_token:
-        print(f"Google token expired for {user_email}, but no refresh token found.")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Authentication session expired, and no refresh token available. Please re-authenticate."
-        )
-        
-    if not credentials.valid:
-         print(f"Google token is invalid for {user_email} even after refresh check.")
-         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid Google credentials. Please re-authenticate."
-         )
+    # Cached per worker; refreshes are single-flight per user and run off the event loop
+    credentials = await token_refresher.get_credentials(current_user.email)
+    quota_user.set(current_user.email) # Google API calls in this request spend this user's quota
     return credentials
 
 def get_google_flow(state: Optional[str] = None) -> google_auth_oauthlib.flow.Flow:
@@ -280,15 +241,15 @@ async def auth_google_callback(request: Request, code: str, state: str, db: Asyn
 
     flow = get_google_flow(state=state)
     try:
-        flow.fetch_token(code=code)
+        await run_in_threadpool(flow.fetch_token, code=code) # Token exchange is a blocking HTTP call
     except Exception as e:
         print(f"Error fetching Google token: {e}")
         return JSONResponse({"error": "Failed to fetch Google token"}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     credentials = flow.credentials
     
-    userinfo_service = googleapiclient.discovery.build("oauth2", "v2", credentials=credentials)
-    user_info = userinfo_service.userinfo().get().execute()
+    userinfo_service = build_service("oauth2", "v2", credentials=credentials)
+    user_info = await execute_async(userinfo_service.userinfo().get())
     user_email = user_info.get("email")
     user_name = user_info.get("name") # Get user's name from Google profile
     # user_picture = user_info.get("picture") # Optional: get user's picture
@@ -347,9 +308,15 @@ async def auth_google_callback(request: Request, code: str, state: str, db: Asyn
         print(f"Storing new Google tokens for {user_email} in DB, linked to profile ID {db_profile.id}.")
     
     await db.commit() # Commit changes for Profile (if new/updated) and UserGoogleToken
+    credentials_cache.invalidate(user_email) # New tokens written, drop any cached credentials
     await db.refresh(db_profile) # Refresh profile to get all fields like created_at, updated_at
     if db_token_entry: # Refresh token entry if it was created/updated
         await db.refresh(db_token_entry)
+    if GMAIL_BACKFILL_ENABLED and GMAIL_BACKFILL_ON_LOGIN:
+        try:
+            await gmail_backfiller.request(db, user_email) # Fill the local store in the background, not page by page
+        except Exception as e:
+            print(f"Could not queue Gmail backfill for {user_email}: {e}") # Never block the login on it
 
     # Create JWT for our frontend
     # The JWT subject ("sub") should ideally be the Profile's unique user_email or ID.
@@ -372,26 +339,9 @@ async def auth_refresh_google_token(current_user: User = Depends(get_current_use
     if not db_token_entry.refresh_token: # Check refresh_token directly from model
          raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No refresh token available for this user. Re-authentication required.")
 
-    # Construct dict specifically for Google Credentials
-    token_data_for_google_creds = {
-        'token': db_token_entry.token,
-        'refresh_token': db_token_entry.refresh_token,
-        'token_uri': db_token_entry.token_uri,
-        'client_id': db_token_entry.client_id,
-        'client_secret': db_token_entry.client_secret,
-        'scopes': db_token_entry.scopes
-    }
-    credentials = google.oauth2.credentials.Credentials(**token_data_for_google_creds)
-    
     try:
-        request_object = google.auth.transport.requests.Request()
-        credentials.refresh(request_object)
-        # Update the stored tokens in DB
-        refreshed_token_data = credentials_to_dict(credentials) # This helper is fine
-        for key, value in refreshed_token_data.items():
-            setattr(db_token_entry, key, value)
-        await db.commit()
-        await db.refresh(db_token_entry)
+        # Coalesced with any refresh already in flight for this user; writes the new tokens to DB
+        credentials = await token_refresher.refresh(user_email, force=True)
         print(f"Successfully refreshed Google token for {user_email} in DB via manual refresh endpoint")
         return {"message": f"Google token refreshed successfully for {user_email}", "new_expiry": credentials.expiry.isoformat() }
     except Exception as e:
@@ -402,11 +352,11 @@ async def auth_refresh_google_token(current_user: User = Depends(get_current_use
 
 @app.get("/drive")
 async def drive_api_request(credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)):
-    drive = googleapiclient.discovery.build(
+    drive = build_service(
         DRIVE_API_SERVICE_NAME, DRIVE_API_VERSION, credentials=credentials
     )
     try:
-        files = drive.files().list().execute()
+        files = await execute_async(drive.files().list())
         return files
     except Exception as e:
         print(f"Google Drive API error: {e}")
@@ -416,11 +366,11 @@ async def drive_api_request(credentials: google.oauth2.credentials.Credentials =
 
 @app.get("/calendar")
 async def calendar_api_request(credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)):
-    calendar = googleapiclient.discovery.build(
+    calendar = build_service(
         CALENDAR_API_SERVICE_NAME, CALENDAR_API_VERSION, credentials=credentials
     )
     try:
-        calendar_list = calendar.calendarList().list().execute()
+        calendar_list = await execute_async(calendar.calendarList().list())
         return calendar_list
     except Exception as e:
         print(f"Google Calendar API error: {e}")
@@ -428,15 +378,10 @@ async def calendar_api_request(credentials: google.oauth2.credentials.Credential
              raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Google token invalid or revoked. Please re-authenticate.")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error accessing Google Calendar: {str(e)}")
 
-def credentials_to_dict(credentials):
-    return {
-        'token': credentials.token,
-        'refresh_token': credentials.refresh_token,
-        'token_uri': credentials.token_uri,
-        'client_id': credentials.client_id,
-        'client_secret': credentials.client_secret,
-        'scopes': credentials.scopes
-    }
+@app.get("/metrics/quota")
+async def quota_metrics():
+    """Google API quota bucket levels for this worker (per-user buckets are aggregated)."""
+    return quota_limiter.snapshot()
 
 @app.get("/", response_class=HTMLResponse)
 async def root_info():
@@ -478,6 +423,26 @@ async def on_startup():
     print("Skipping automatic table creation. Use Alembic for migrations.")
     # await create_db_and_tables() # Commented out: Alembic will handle this
     # print("Database tables created (if they didn't exist).")
+    load_discovery_documents() # Parse Google API discovery documents once per worker
+    token_renewal_scheduler.start() # Renew tokens of active users before they expire
+    if GMAIL_SYNC_SCHEDULE_ENABLED:
+        gmail_sync_scheduler.start() # Keep local Gmail metadata in step with history.list
+    push_sync_queue.start() # Workers for push-triggered syncs (POST /gmail/push)
+    if GMAIL_PUSH_TOPIC:
+        watch_renewal_scheduler.start() # users.watch lapses after 7 days
+    if GMAIL_BACKFILL_ENABLED:
+        gmail_backfiller.start() # Also resumes backfills a restart interrupted
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await token_renewal_scheduler.stop()
+    await gmail_sync_scheduler.stop()
+    await watch_renewal_scheduler.stop()
+    await push_sync_queue.stop()
+    await gmail_prefetcher.stop()
+    await embedding_index.stop()
+    await gmail_backfiller.stop()
+    await close_http_client()
 
 # --- Todo Endpoints ---
 @app.post("/todos", response_model=TodoResponse, status_code=status.HTTP_201_CREATED)
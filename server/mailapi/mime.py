@@ -0,0 +1,171 @@
+import base64
+import html as html_lib
+import re
+from email.message import Message
+from typing import Dict, List, Optional
+
+# Turns Gmail format='full' message resources into what the client actually renders: one
+# text/plain and one text/html body (decoded once, here) plus attachment descriptors.
+# Attachment data is never inlined; clients fetch it by attachmentId when needed.
+
+MESSAGE_VIEWS = ("raw", "processed", "body", "headers")
+
+SEARCH_BODY_MAX_CHARS = 20000 # Body text kept for full-text search; the start of a mail is what people search for
+
+_INVISIBLE_HTML = re.compile(r'<(script|style|head)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_HTML_TAG = re.compile(r'<[^>]+>')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def decode_base64url(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _part_header(part: dict, name: str) -> Optional[str]:
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name.lower()), None)
+
+
+def _content_type_params(part: dict) -> Message:
+    # email.message.Message does the RFC 2045 parameter parsing (charset="...", name=..., etc.)
+    message = Message()
+    message['Content-Type'] = _part_header(part, 'Content-Type') or part.get('mimeType', 'text/plain')
+    return message
+
+
+def _decode_text(part: dict) -> str:
+    data = part.get('body', {}).get('data')
+    if not data:
+        return ''
+    charset = _content_type_params(part).get_content_charset() or 'utf-8'
+    raw = decode_base64url(data)
+    try:
+        return raw.decode(charset, errors='replace')
+    except LookupError: # Unknown charset name in the wild
+        return raw.decode('utf-8', errors='replace')
+
+
+def _is_attachment(part: dict) -> bool:
+    if part.get('filename') or part.get('body', {}).get('attachmentId'):
+        return True
+    disposition = (_part_header(part, 'Content-Disposition') or '').lower()
+    return disposition.startswith('attachment')
+
+
+def _attachment_descriptor(part: dict) -> dict:
+    disposition = (_part_header(part, 'Content-Disposition') or '').lower()
+    content_id = _part_header(part, 'Content-ID')
+    return {
+        'partId': part.get('partId'),
+        'filename': part.get('filename') or _content_type_params(part).get_param('name') or '',
+        'mimeType': part.get('mimeType'),
+        'size': part.get('body', {}).get('size', 0),
+        'attachmentId': part.get('body', {}).get('attachmentId'),
+        'contentId': content_id.strip('<>') if content_id else None, # For cid: references in the html body
+        'inline': disposition.startswith('inline'),
+    }
+
+
+def extract_parts(payload: dict) -> dict:
+    """Returns {'text', 'html', 'attachments'} for a message payload.
+
+    Walks the MIME tree depth first; the first text/plain and text/html parts that are not
+    attachments win, which is what multipart/alternative and multipart/related expect.
+    Parts of a forwarded message/rfc822 are treated like the rest.
+    """
+    text: Optional[str] = None
+    html: Optional[str] = None
+    attachments: List[dict] = []
+
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        mime_type = (part.get('mimeType') or '').lower()
+        if part.get('parts'):
+            stack.extend(reversed(part['parts'])) # Keep document order
+            continue
+        if _is_attachment(part):
+            attachments.append(_attachment_descriptor(part))
+        elif mime_type == 'text/plain' and text is None:
+            text = _decode_text(part)
+        elif mime_type == 'text/html' and html is None:
+            html = _decode_text(part)
+    return {'text': text, 'html': html, 'attachments': attachments}
+
+
+def html_to_text(html: str) -> str:
+    text = _HTML_TAG.sub(' ', _INVISIBLE_HTML.sub(' ', html))
+    return html_lib.unescape(text)
+
+
+def body_text(parts: dict, max_chars: int = SEARCH_BODY_MAX_CHARS) -> str:
+    """Searchable plain text from extract_parts() output: text/plain if present, else the html's text."""
+    text = parts.get('text')
+    if not text and parts.get('html'):
+        text = html_to_text(parts['html'])
+    return _WHITESPACE.sub(' ', text or '').strip()[:max_chars]
+
+
+def process_message(message: dict) -> dict:
+    """Processed shape of a format='full' message: Gmail's top-level fields, headers, bodies and attachment descriptors."""
+    payload = message.get('payload', {})
+    parts = extract_parts(payload)
+    return {
+        'id': message.get('id'),
+        'threadId': message.get('threadId'),
+        'labelIds': message.get('labelIds', []),
+        'snippet': message.get('snippet', ''),
+        'historyId': message.get('historyId'),
+        'internalDate': message.get('internalDate'),
+        'sizeEstimate': message.get('sizeEstimate'),
+        'headers': payload.get('headers', []),
+        'body': {'text': parts['text'], 'html': parts['html']},
+        'attachments': parts['attachments'],
+    }
+
+
+# Fields of a processed message that change after delivery (everything else is immutable)
+MUTABLE_FIELDS = ('labelIds', 'historyId', 'snippet')
+
+
+def shape_message(processed: dict, view: str) -> dict:
+    """Cuts a processed message down to the requested view ('processed', 'body' or 'headers')."""
+    if view == 'body':
+        return {
+            'id': processed['id'], 'threadId': processed['threadId'],
+            'body': processed['body'], 'attachments': processed['attachments'],
+        }
+    if view == 'headers':
+        return {key: value for key, value in processed.items() if key not in ('body', 'attachments')}
+    return processed
+
+
+def with_mutable_fields(processed: dict, current: dict) -> dict:
+    """Cached processed message refreshed with the label/history state of a format='minimal' resource."""
+    merged = dict(processed)
+    for field in MUTABLE_FIELDS:
+        if field in current:
+            merged[field] = current[field]
+    return merged
+
+
+def headers_only(message: dict) -> dict:
+    """Headers view straight from a format='metadata' resource."""
+    return {
+        'id': message.get('id'),
+        'threadId': message.get('threadId'),
+        'labelIds': message.get('labelIds', []),
+        'snippet': message.get('snippet', ''),
+        'historyId': message.get('historyId'),
+        'internalDate': message.get('internalDate'),
+        'sizeEstimate': message.get('sizeEstimate'),
+        'headers': message.get('payload', {}).get('headers', []),
+    }
+
+
+def cached_processed_messages(cache, user_email: str, message_ids: List[str]) -> Dict[str, dict]:
+    hits = {}
+    for message_id in message_ids:
+        processed = cache.get((user_email, message_id))
+        if processed is not None:
+            hits[message_id] = processed
+    return hits
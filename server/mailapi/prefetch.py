@@ -0,0 +1,112 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Hashable, Optional, Set
+
+from .cache import TTLCache
+from .gmail_sync import MailboxDelta, gmail_sync_engine
+from .rate_limit import TokenBucket, quota_limiter
+
+# Speculative prefetch of what a user is likely to ask for next (the next page of a list,
+# the threads at the top of it). Results sit in a short-lived per-user cache and are
+# handed out once. Prefetching is strictly optional work: it runs in the background, is
+# capped by a per-user budget, and backs off entirely while the user's Google quota is
+# needed for real requests. Whatever changes a mailbox (our own mutating routes, or a sync
+# delta for changes made anywhere else) drops the user's prefetched results.
+
+GMAIL_PREFETCH_ENABLED = os.getenv("GMAIL_PREFETCH_ENABLED", "true").lower() == "true"
+GMAIL_PREFETCH_TOP_THREADS = int(os.getenv("GMAIL_PREFETCH_TOP_THREADS", "3")) # Thread details warmed per page served
+GMAIL_PREFETCH_TTL_SECONDS = float(os.getenv("GMAIL_PREFETCH_TTL_SECONDS", "60"))
+GMAIL_PREFETCH_BUDGET_UNITS_PER_MINUTE = float(os.getenv("GMAIL_PREFETCH_BUDGET_UNITS_PER_MINUTE", "1200"))
+GMAIL_PREFETCH_QUOTA_RESERVE = float(os.getenv("GMAIL_PREFETCH_QUOTA_RESERVE", "0.5")) # Fraction of quota buckets left for foreground requests
+GMAIL_PREFETCH_MAX_ENTRIES = int(os.getenv("GMAIL_PREFETCH_MAX_ENTRIES", "2048"))
+
+
+class Prefetcher:
+    def __init__(self, api: str, enabled: bool, ttl_seconds: float, max_entries: int,
+                 budget_units_per_minute: float, quota_reserve: float):
+        self.api = api
+        self.enabled = enabled
+        self.budget_units_per_minute = budget_units_per_minute
+        self.quota_reserve = quota_reserve
+        self._entries = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        # A full budget refills within a minute, so idle buckets can be dropped after that
+        self._budgets = TTLCache(max_entries=max_entries, ttl_seconds=60)
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"scheduled": 0, "stored": 0, "hits": 0, "over_budget": 0, "failed": 0}
+
+    def pop(self, user_email: str, key: Hashable) -> Optional[Any]:
+        """Takes a prefetched result. Each one is served once; after that the caller goes upstream again."""
+        value = self._entries.pop((user_email, key))
+        if value is not None:
+            self.stats["hits"] += 1
+        return value
+
+    def peek(self, user_email: str, key: Hashable) -> Optional[Any]:
+        """A prefetched result without taking it, e.g. to answer a conditional request with a 304."""
+        return self._entries.get((user_email, key))
+
+    def has(self, user_email: str, key: Hashable) -> bool:
+        return self.peek(user_email, key) is not None
+
+    def store(self, user_email: str, key: Hashable, value: Any):
+        self._entries.set((user_email, key), value)
+        self.stats["stored"] += 1
+
+    def discard(self, user_email: str, key: Hashable):
+        """Drops a prefetched result the user's own changes have made stale."""
+        self._entries.pop((user_email, key))
+
+    def forget_user(self, user_email: str):
+        """Drops everything prefetched for a user, e.g. after they changed their mailbox through us."""
+        for key, _ in self._entries.items():
+            if key[0] == user_email:
+                self._entries.pop(key)
+
+    async def on_sync(self, db, gmail_service, delta: MailboxDelta):
+        self.forget_user(delta.user_email)
+
+    def try_spend(self, user_email: str, units: int) -> bool:
+        """Takes `units` from the user's prefetch budget, if both it and the Google quota allow."""
+        bucket = self._budgets.get(user_email)
+        if bucket is None:
+            bucket = TokenBucket(self.budget_units_per_minute / 60, self.budget_units_per_minute)
+            self._budgets.set(user_email, bucket)
+        if not bucket.can_take(units) or not quota_limiter.has_headroom(self.api, units, user_email, self.quota_reserve):
+            self.stats["over_budget"] += 1
+            return False
+        bucket.reserve(units)
+        return True
+
+    def spawn(self, job: Awaitable, description: str):
+        """Runs a prefetch job in the background. Failures are logged and otherwise ignored."""
+        if not self.enabled:
+            job.close() # Never awaited: close it so Python doesn't warn
+            return
+        self.stats["scheduled"] += 1
+
+        async def run():
+            try:
+                await job
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"Prefetch failed ({description}): {e}")
+
+        task = asyncio.create_task(run()) # Copies the context, so quota_user carries over
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+gmail_prefetcher = Prefetcher(
+    'gmail',
+    enabled=GMAIL_PREFETCH_ENABLED,
+    ttl_seconds=GMAIL_PREFETCH_TTL_SECONDS,
+    max_entries=GMAIL_PREFETCH_MAX_ENTRIES,
+    budget_units_per_minute=GMAIL_PREFETCH_BUDGET_UNITS_PER_MINUTE,
+    quota_reserve=GMAIL_PREFETCH_QUOTA_RESERVE,
+)
+gmail_sync_engine.add_listener(gmail_prefetcher.on_sync)
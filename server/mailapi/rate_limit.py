@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from .cache import TTLCache
+
+# Client-side token buckets for Google API quota, so one heavy user slows down locally instead
+# of tripping 429s for everyone. Every request is charged its quota cost (from its discovery
+# methodId) against a bucket for the calling user and one for the whole project.
+#
+# The user is taken from `quota_user`, which the request dependency and background jobs set.
+
+# Gmail quota units per method (https://developers.google.com/gmail/api/reference/quota).
+# Calendar and Drive count queries, so everything there costs 1.
+GMAIL_QUOTA_COSTS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.watch': 100,
+    'gmail.users.stop': 50,
+    'gmail.users.history.list': 2,
+    'gmail.users.labels.get': 1,
+    'gmail.users.labels.list': 1,
+    'gmail.users.labels.create': 5,
+    'gmail.users.labels.update': 5,
+    'gmail.users.labels.patch': 5,
+    'gmail.users.labels.delete': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.trash': 5,
+    'gmail.users.messages.untrash': 5,
+    'gmail.users.messages.delete': 10,
+    'gmail.users.messages.batchModify': 50,
+    'gmail.users.messages.batchDelete': 50,
+    'gmail.users.messages.send': 100,
+    'gmail.users.messages.insert': 25,
+    'gmail.users.messages.import': 25,
+    'gmail.users.messages.attachments.get': 5,
+    'gmail.users.threads.get': 10,
+    'gmail.users.threads.list': 10,
+    'gmail.users.threads.modify': 10,
+    'gmail.users.threads.trash': 10,
+    'gmail.users.threads.untrash': 10,
+    'gmail.users.threads.delete': 20,
+    'gmail.users.drafts.get': 5,
+    'gmail.users.drafts.list': 5,
+    'gmail.users.drafts.create': 10,
+    'gmail.users.drafts.update': 15,
+    'gmail.users.drafts.delete': 10,
+    'gmail.users.drafts.send': 100,
+}
+DEFAULT_GMAIL_QUOTA_COST = 5
+
+# (units per second per user, units per second for the project), per API
+QUOTA_RATES: Dict[str, Tuple[float, float]] = {
+    'gmail': (
+        float(os.getenv("GMAIL_QUOTA_USER_UNITS_PER_SECOND", "250")),
+        float(os.getenv("GMAIL_QUOTA_PROJECT_UNITS_PER_SECOND", "20000")), # 1,200,000 per minute
+    ),
+    'calendar': (
+        float(os.getenv("CALENDAR_QUOTA_USER_QUERIES_PER_SECOND", "10")), # 600 per minute
+        float(os.getenv("CALENDAR_QUOTA_PROJECT_QUERIES_PER_SECOND", "166")), # 10,000 per minute
+    ),
+    'drive': (
+        float(os.getenv("DRIVE_QUOTA_USER_QUERIES_PER_SECOND", "200")), # 12,000 per minute
+        float(os.getenv("DRIVE_QUOTA_PROJECT_QUERIES_PER_SECOND", "200")),
+    ),
+}
+QUOTA_BURST_SECONDS = float(os.getenv("QUOTA_BURST_SECONDS", "1")) # Bucket capacity = rate * this
+QUOTA_USER_BUCKETS_MAX = int(os.getenv("QUOTA_USER_BUCKETS_MAX", "10000"))
+
+# Email of the user whose quota the current task spends (None: only the project bucket applies)
+quota_user: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("quota_user", default=None)
+
+
+def quota_cost(method_id: Optional[str]) -> Tuple[Optional[str], int]:
+    """Returns (api, cost) for a discovery methodId like 'gmail.users.messages.get'."""
+    if not method_id:
+        return None, 0
+    api = method_id.split('.', 1)[0]
+    if api == 'gmail':
+        return api, GMAIL_QUOTA_COSTS.get(method_id, DEFAULT_GMAIL_QUOTA_COST)
+    return api, 1
+
+
+class TokenBucket:
+    """Token bucket where acquire() reserves tokens up front and may go into debt.
+
+    Waiters sleep off exactly their share of the debt, so they are served in arrival order
+    without polling, and requests costing more than the capacity still go through.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    @property
+    def level(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def seconds_until_full(self) -> float:
+        return max(0.0, self.capacity - self.level) / self.rate
+
+    def can_take(self, cost: float) -> bool:
+        return self.level >= cost
+
+    def reserve(self, cost: float) -> float:
+        """Takes `cost` tokens and returns how long the caller has to wait before using them."""
+        self._refill()
+        self._tokens -= cost
+        return max(0.0, -self._tokens / self.rate)
+
+
+class QuotaLimiter:
+    def __init__(self, rates: Dict[str, Tuple[float, float]], burst_seconds: float, max_user_buckets: int):
+        self.rates = rates
+        self.burst_seconds = burst_seconds
+        self._project_buckets = {
+            api: TokenBucket(project_rate, project_rate * burst_seconds) for api, (_, project_rate) in rates.items()
+        }
+        # A user's bucket is kept until it has refilled and then gone unused for idle_seconds;
+        # dropping it any sooner would forget its debt and hand a throttled user a fresh burst
+        self.idle_seconds = max(60.0, burst_seconds * 10)
+        self._user_buckets = TTLCache(max_entries=max_user_buckets, ttl_seconds=self.idle_seconds)
+        self.stats = {api: {"units": 0, "waits": 0, "wait_seconds": 0.0, "rejected": 0} for api in rates}
+
+    def _buckets(self, api: str, user_email: Optional[str]) -> Iterable[TokenBucket]:
+        buckets = [self._project_buckets[api]]
+        if user_email:
+            bucket = self._user_buckets.get((api, user_email))
+            if bucket is None:
+                user_rate = self.rates[api][0]
+                bucket = TokenBucket(user_rate, user_rate * self.burst_seconds)
+                self._user_buckets.set((api, user_email), bucket)
+            buckets.append(bucket)
+        return buckets
+
+    def _keep_user_bucket(self, api: str, user_email: Optional[str]):
+        """Pushes back the eviction of the user's bucket after spending from it."""
+        if user_email:
+            bucket = self._user_buckets.get((api, user_email))
+            if bucket is not None:
+                self._user_buckets.set((api, user_email), bucket, ttl_seconds=bucket.seconds_until_full() + self.idle_seconds)
+
+    async def acquire(self, api: Optional[str], cost: int, user_email: Optional[str] = None):
+        """Waits until `cost` units are available for the user and the project, then spends them."""
+        if api not in self.rates or cost <= 0:
+            return
+        user_email = user_email or quota_user.get()
+        wait = max(bucket.reserve(cost) for bucket in self._buckets(api, user_email))
+        self._keep_user_bucket(api, user_email)
+        stats = self.stats[api]
+        stats["units"] += cost
+        if wait > 0:
+            stats["waits"] += 1
+            stats["wait_seconds"] += wait
+            await asyncio.sleep(wait)
+
+    def try_acquire(self, api: Optional[str], cost: int, user_email: Optional[str] = None) -> bool:
+        """Spends `cost` units only if available right now; never waits (for optional work like prefetch)."""
+        if api not in self.rates or cost <= 0:
+            return True
+        user_email = user_email or quota_user.get()
+        buckets = list(self._buckets(api, user_email))
+        if not all(bucket.can_take(cost) for bucket in buckets):
+            self.stats[api]["rejected"] += 1
+            return False
+        for bucket in buckets:
+            bucket.reserve(cost)
+        self._keep_user_bucket(api, user_email)
+        self.stats[api]["units"] += cost
+        return True
+
+    def has_headroom(self, api: Optional[str], cost: int, user_email: Optional[str] = None, keep_fraction: float = 0.0) -> bool:
+        """True if `cost` units could be spent now while leaving `keep_fraction` of each bucket unspent.
+
+        Spends nothing: for deciding whether optional work should run before it goes through acquire().
+        """
+        if api not in self.rates or cost <= 0:
+            return True
+        user_email = user_email or quota_user.get()
+        return all(bucket.level - cost >= bucket.capacity * keep_fraction for bucket in self._buckets(api, user_email))
+
+    async def acquire_for(self, method_ids: Iterable[Optional[str]], user_email: Optional[str] = None):
+        """Acquires the summed cost of several requests at once (e.g. the parts of a batch)."""
+        costs: Dict[str, int] = {}
+        for method_id in method_ids:
+            api, cost = quota_cost(method_id)
+            if api:
+                costs[api] = costs.get(api, 0) + cost
+        for api, cost in costs.items():
+            await self.acquire(api, cost, user_email)
+
+    def snapshot(self) -> dict:
+        """Bucket levels for capacity planning. Per-user buckets are aggregated, not listed."""
+        user_levels: Dict[str, list] = {api: [] for api in self.rates}
+        for (api, _), bucket in self._user_buckets.items():
+            user_levels[api].append(bucket.level / bucket.capacity)
+        snapshot = {}
+        for api, (user_rate, project_rate) in self.rates.items():
+            project_bucket = self._project_buckets[api]
+            levels = user_levels[api]
+            snapshot[api] = {
+                "user_rate_per_second": user_rate,
+                "project_rate_per_second": project_rate,
+                "project_level": round(project_bucket.level, 2),
+                "project_capacity": project_bucket.capacity,
+                "active_users": len(levels),
+                "users_throttled": sum(1 for level in levels if level <= 0),
+                "min_user_fill": round(min(levels), 3) if levels else None,
+                "avg_user_fill": round(sum(levels) / len(levels), 3) if levels else None,
+                **{key: round(value, 3) if isinstance(value, float) else value for key, value in self.stats[api].items()},
+            }
+        return snapshot
+
+
+quota_limiter = QuotaLimiter(QUOTA_RATES, burst_seconds=QUOTA_BURST_SECONDS, max_user_buckets=QUOTA_USER_BUCKETS_MAX)
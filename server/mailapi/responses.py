@@ -0,0 +1,24 @@
+from typing import Any, Optional
+
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+# Fast path for large JSON responses. Returning a Response from an endpoint skips FastAPI's
+# jsonable_encoder pass and any response_model re-validation; orjson (or pydantic's own
+# serializer for models we just built) then writes the bytes directly.
+
+
+def fast_json(content: Any, response: Optional[Response] = None, status_code: int = 200) -> Response:
+    """JSON response for data that is already in its final shape.
+
+    `response` is the endpoint's injected Response; headers set on it (e.g. ETag) are kept,
+    since FastAPI only merges them into responses it builds itself.
+    """
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop('content-length', None)
+    if isinstance(content, BaseModel):
+        # Validated when it was constructed; serializing is all that's left
+        return Response(content=content.model_dump_json(), status_code=status_code, headers=headers, media_type='application/json')
+    return ORJSONResponse(content, status_code=status_code, headers=headers)
@@ -1,12 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 import google.oauth2.credentials
-import googleapiclient.discovery
 # google.auth.transport.requests is handled by dependency
 from datetime import datetime, timedelta
 from pydantic import BaseModel, EmailStr, field_validator, ValidationInfo
 from typing import Optional, List as PyList
 
 # Adjust import path
+from ..etag import etag_matches, make_etag, not_modified, set_etag
+from ..google_services import build_service
+from ..google_http import execute_async
 from ..main import get_refreshed_google_credentials # Added dependency
 
 router = APIRouter(
@@ -19,11 +21,11 @@ CALENDAR_API_VERSION = 'v3'
 
 @router.get("/") # Corresponds to old /calendar GET (lists calendar list)
 async def list_calendars(credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)):
-    calendar_service = googleapiclient.discovery.build(
+    calendar_service = build_service(
         CALENDAR_API_SERVICE_NAME, CALENDAR_API_VERSION, credentials=credentials
     )
     try:
-        calendar_list = calendar_service.calendarList().list().execute()
+        calendar_list = await execute_async(calendar_service.calendarList().list())
         return calendar_list
     except Exception as e:
         print(f"Google Calendar API error (list_calendars): {e}")
@@ -33,8 +35,12 @@ async def list_calendars(credentials: google.oauth2.credentials.Credentials = De
 
 # We will add endpoint for week's events and creating events later
 @router.get("/events_week")
-async def list_week_events(credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)):
-    calendar_service = googleapiclient.discovery.build(CALENDAR_API_SERVICE_NAME, CALENDAR_API_VERSION, credentials=credentials)
+async def list_week_events(
+    request: Request,
+    response: Response,
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)
+):
+    calendar_service = build_service(CALENDAR_API_SERVICE_NAME, CALENDAR_API_VERSION, credentials=credentials)
     
     try:
         # Get current time and time for one week from now
@@ -42,16 +48,21 @@ async def list_week_events(credentials: google.oauth2.credentials.Credentials =
         time_min = now.isoformat() + 'Z'  # 'Z' indicates UTC time
         time_max = (now + timedelta(days=7)).isoformat() + 'Z'
 
-        events_result = calendar_service.events().list(
+        events_result = await execute_async(calendar_service.events().list(
             calendarId='primary', 
             timeMin=time_min,
             timeMax=time_max,
             maxResults=25, # Max 25 events for the week view, adjust as needed
             singleEvents=True,
             orderBy='startTime'
-        ).execute()
+        ))
         
         events = events_result.get('items', [])
+        # Every field we return bumps the event's `updated`; the ids cover events entering or leaving the window
+        etag = make_etag('events_week', [(event['id'], event.get('updated')) for event in events])
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
         
         formatted_events = []
         for event in events:
@@ -116,7 +127,7 @@ async def create_calendar_event(
     event_data: CreateEventSchema,
     credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)
 ):
-    calendar_service = googleapiclient.discovery.build(CALENDAR_API_SERVICE_NAME, CALENDAR_API_VERSION, credentials=credentials)
+    calendar_service = build_service(CALENDAR_API_SERVICE_NAME, CALENDAR_API_VERSION, credentials=credentials)
     
     # Ensure start and end times are valid together
     if (event_data.start.dateTime and not event_data.end.dateTime) or (event_data.start.date and not event_data.end.date):
@@ -125,7 +136,7 @@ async def create_calendar_event(
     event_body = event_data.dict(exclude_none=True)
 
     try:
-        created_event = calendar_service.events().insert(calendarId='primary', body=event_body).execute()
+        created_event = await execute_async(calendar_service.events().insert(calendarId='primary', body=event_body))
         return {
             "message": "Event created successfully!",
             "id": created_event.get('id'),
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 import google.oauth2.credentials
-import googleapiclient.discovery
 # google.auth.transport.requests is now handled by the dependency
 from datetime import datetime
 
 # Adjust import path based on your project structure
+from ..etag import content_etag, etag_matches, make_etag, not_modified, set_etag
+from ..google_services import build_service
+from ..google_http import execute_async
 from ..main import get_refreshed_google_credentials # Added get_refreshed_google_credentials
 
 router = APIRouter(
@@ -16,7 +18,11 @@ DRIVE_API_SERVICE_NAME = 'drive'
 DRIVE_API_VERSION = 'v2'
 
 @router.get("/")
-async def list_drive_files(credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)):
+async def list_drive_files(
+    request: Request,
+    response: Response,
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)
+):
     # No need to get user_email or tokens here, credentials dependency handles it
     # Remove duplicated refresh logic:
     # user_email = current_user.email
@@ -25,11 +31,16 @@ async def list_drive_files(credentials: google.oauth2.credentials.Credentials =
     # credentials = google.oauth2.credentials.Credentials(**user_google_tokens)
     # ... (if credentials.expired ...) ...
 
-    drive_service = googleapiclient.discovery.build(
+    drive_service = build_service(
         DRIVE_API_SERVICE_NAME, DRIVE_API_VERSION, credentials=credentials
     )
     try:
-        files = drive_service.files().list().execute()
+        files = await execute_async(drive_service.files().list())
+        # Drive v2 lists come with their own etag
+        etag = make_etag('drive_files', files['etag']) if files.get('etag') else content_etag(files)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
         return files
     except Exception as e:
         user_email = "unknown" # We might not have user context easily here, log appropriately
@@ -45,7 +56,7 @@ async def list_drive_files(credentials: google.oauth2.credentials.Credentials =
 async def create_google_doc(credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)):
     # Remove duplicated refresh logic
 
-    drive_service = googleapiclient.discovery.build(DRIVE_API_SERVICE_NAME, DRIVE_API_VERSION, credentials=credentials)
+    drive_service = build_service(DRIVE_API_SERVICE_NAME, DRIVE_API_VERSION, credentials=credentials)
     
     doc_title = f"New Doc created by App - {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}"
     file_metadata = {
@@ -54,7 +65,7 @@ async def create_google_doc(credentials: google.oauth2.credentials.Credentials =
     }
 
     try:
-        created_file = drive_service.files().insert(body=file_metadata).execute()
+        created_file = await execute_async(drive_service.files().insert(body=file_metadata))
         return {
             "message": "Google Doc created successfully!", 
             "id": created_file.get('id'),
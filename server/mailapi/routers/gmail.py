@@ -1,16 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from fastapi.concurrency import run_in_threadpool # Import run_in_threadpool
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
 import google.oauth2.credentials
-import googleapiclient.discovery
+import googleapiclient.errors
 # google.auth.transport.requests handled by dependency
 from pydantic import BaseModel, EmailStr
+import asyncio
 import base64
+import hmac
+import orjson
 from email.mime.text import MIMEText
-from typing import List, Optional # For List in query parameters
+from typing import Dict, List, Optional, Tuple # For List in query parameters
 from email.utils import formataddr, parseaddr # For parsing and formatting email addresses
 import re # For word splitting
+from urllib.parse import quote
 from datetime import datetime # For date formatting in quote
 
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database_config.database import AsyncSessionLocal, get_db
+from .. import mail_store
+from ..attachment_store import attachment_store, parse_range
+from ..cache import message_body_cache, thread_enrichment_cache
+from ..contacts import ContactsResponse, contact_index
+from ..embedding_index import embedding_index
+from ..etag import content_etag, etag_matches, make_etag, not_modified, set_etag
+from ..gmail_push import GMAIL_PUSH_VERIFICATION_TOKEN, decode_push_envelope, push_sync_queue, renew_watch
+from ..gmail_sync import SyncResult, gmail_sync_engine
+from ..gmail_batch import gmail_batch_executor
+from ..gmail_backfill import BackfillProgress, backfill_progress, get_backfill_state, gmail_backfiller
+from ..gmail_bulk import GMAIL_BULK_MAX_IDS, BulkAction, BulkMutationResult, mutate_messages, mutate_threads
+from ..google_services import build_service
+from ..google_http import execute_async, stream_async
+from ..label_catalog import label_catalog
+from ..prefetch import GMAIL_PREFETCH_TOP_THREADS, gmail_prefetcher
+from ..rate_limit import quota_cost, quota_user
+from ..thread_ranking import thread_ranker
+from ..thread_summaries import SUMMARY_MAX_THREADS, ThreadSummariesResult, ThreadSummary, thread_summarizer
+from ..token_refresh import token_refresher
+from ..unified_inbox import AccountPage, AccountPosition, decode_unified_cursor, encode_unified_cursor, linked_accounts, merge_account_pages
+from ..mime import MESSAGE_VIEWS, body_text, cached_processed_messages, headers_only, process_message, shape_message, with_mutable_fields
+from ..responses import fast_json
 from ..main import User, get_current_user, credentials_to_dict, get_refreshed_google_credentials # Added dependency
 
 router = APIRouter(
@@ -20,64 +49,95 @@ router = APIRouter(
 
 GMAIL_API_SERVICE_NAME = 'gmail'
 GMAIL_API_VERSION = 'v1'
+THREAD_ENRICHMENT_HEADERS = ['Subject', 'From', 'Date'] # All list_threads shows of the latest message
+THREAD_MESSAGE_FETCH_LIMIT = 2 # Above this many uncached messages, refetch the whole thread instead
+
+# For the 409s of endpoints that only work off the local store
+STORE_NOT_READY_HINT = "POST /gmail/sync first. Bigger mailboxes are ready once GET /gmail/backfill reports done."
+
+def _serves_from_store(page_token: Optional[str]) -> bool:
+    # Local cursors and Gmail pageTokens are not interchangeable; keep paging on whichever side started
+    return page_token is None or mail_store.decode_cursor(page_token) is not None
+
+async def _fetch_message_summaries(gmail_service, messages_summary: List[dict]) -> List[dict]:
+    """Subject/From/Date summaries for messages.list results, in list order."""
+    detailed_messages = []
+    # Fetched in concurrent chunks; throttled sub-requests are retried rather than dropped
+    message_details_map = await gmail_batch_executor.execute([
+        (
+            msg_summary['id'],
+            gmail_service.users().messages().get(userId='me', id=msg_summary['id'], format='metadata', metadataHeaders=['Subject', 'From', 'Date'])
+        )
+        for msg_summary in messages_summary
+    ])
+
+    # Reconstruct detailed_messages in order
+    for msg_summary in messages_summary:
+        response, exception = message_details_map[msg_summary['id']]
+        if exception is not None:
+            if getattr(exception, 'resp', None) is not None and exception.resp.status == 404:
+                continue # Deleted between list and get
+            print(f"Error fetching message {msg_summary['id']}: {exception}")
+            # Keep the row so the client sees it exists (and can retry) instead of it silently vanishing
+            detailed_messages.append({
+                'id': msg_summary['id'], 'threadId': msg_summary.get('threadId'), 'snippet': '',
+                'subject': 'N/A', 'from': 'N/A', 'date': 'N/A', 'error': str(exception)
+            })
+            continue
+        headers = response.get('payload', {}).get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'N/A')
+        from_sender = next((h['value'] for h in headers if h['name'] == 'From'), 'N/A')
+        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'N/A')
+        detailed_messages.append({
+            'id': response['id'], 'threadId': response['threadId'], 'snippet': response['snippet'],
+            'subject': subject, 'from': from_sender, 'date': date
+        })
+    return detailed_messages
 
 @router.get("/messages")
 async def list_messages(
     credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
     label_ids: Optional[List[str]] = Query(["INBOX"]), # Default to INBOX, allow multiple
-    max_results: int = Query(25, ge=1, le=100) # Default 25, with validation
+    max_results: int = Query(25, ge=1, le=100), # Default 25, with validation
+    page_token: Optional[str] = Query(None)
 ):
-    gmail_service = googleapiclient.discovery.build(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    # Once the mailbox is synced, answer from the local metadata store with a single indexed query
+    if _serves_from_store(page_token) and await mail_store.is_mailbox_synced(db, current_user.email):
+        store_label_ids = label_ids or ['INBOX']
+        stored_messages, next_cursor = await mail_store.list_messages(db, current_user.email, store_label_ids, max_results, page_token)
+        return {
+            "messages": [
+                {
+                    'id': message.id, 'threadId': message.thread_id, 'snippet': message.snippet,
+                    'subject': message.subject or 'N/A', 'from': message.from_addr or 'N/A', 'date': message.date_header or 'N/A'
+                }
+                for message in stored_messages
+            ],
+            "resultSizeEstimate": await mail_store.estimate_result_size(db, current_user.email, store_label_ids),
+            "labelIdsApplied": label_ids,
+            "nextPageToken": next_cursor,
+        }
+
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
     try:
         # Use label_ids from query parameter. If empty or None, Gmail API defaults to all messages (excluding TRASH and SPAM usually)
         # For our purpose, we ensured it defaults to ["INBOX"] via Query() if not provided.
-        list_query = gmail_service.users().messages().list(userId='me', maxResults=max_results)
+        list_query = gmail_service.users().messages().list(userId='me', maxResults=max_results, pageToken=page_token)
         if label_ids:
-            list_query = gmail_service.users().messages().list(userId='me', labelIds=label_ids, maxResults=max_results)
+            list_query = gmail_service.users().messages().list(userId='me', labelIds=label_ids, maxResults=max_results, pageToken=page_token)
         else: # If label_ids is explicitly empty or None after Query default, list all (or stick to INBOX)
-            list_query = gmail_service.users().messages().list(userId='me', labelIds=['INBOX'], maxResults=max_results) # Or remove labelIds to get all mail
+            list_query = gmail_service.users().messages().list(userId='me', labelIds=['INBOX'], maxResults=max_results, pageToken=page_token) # Or remove labelIds to get all mail
             
-        results = list_query.execute()
+        results = await execute_async(list_query)
         messages_summary = results.get('messages', [])
         detailed_messages = []
 
         if messages_summary:
-            batch = gmail_service.new_batch_http_request(callback=lambda id, response, exception: None) # Dummy callback initially
-            message_details_map = {} # To store results keyed by message id
-
-            def _create_callback(msg_id):
-                def callback(request_id, response, exception):
-                    if exception:
-                        # Handle exception for this specific request, e.g., log it
-                        print(f"Error fetching message {msg_id}: {exception}")
-                        message_details_map[msg_id] = {"error": str(exception)}
-                    else:
-                        headers = response.get('payload', {}).get('headers', [])
-                        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'N/A')
-                        from_sender = next((h['value'] for h in headers if h['name'] == 'From'), 'N/A')
-                        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'N/A')
-                        message_details_map[msg_id] = {
-                            'id': response['id'], 'threadId': response['threadId'], 'snippet': response['snippet'],
-                            'subject': subject, 'from': from_sender, 'date': date
-                        }
-                return callback
-
-            for msg_summary in messages_summary: # Iterate through all summaries fetched
-                msg_id = msg_summary['id']
-                batch.add(
-                    gmail_service.users().messages().get(userId='me', id=msg_id, format='metadata', metadataHeaders=['Subject', 'From', 'Date']),
-                    callback=_create_callback(msg_id)
-                )
-            
-            await run_in_threadpool(batch.execute)
-
-            # Reconstruct detailed_messages in order
-            for msg_summary in messages_summary:
-                detail = message_details_map.get(msg_summary['id'])
-                if detail and not detail.get("error"):
-                    detailed_messages.append(detail)
+            detailed_messages = await _fetch_message_summaries(gmail_service, messages_summary)
         
-        return {"messages": detailed_messages, "resultSizeEstimate": results.get('resultSizeEstimate'), "labelIdsApplied": label_ids}
+        return {"messages": detailed_messages, "resultSizeEstimate": results.get('resultSizeEstimate'), "labelIdsApplied": label_ids, "nextPageToken": results.get('nextPageToken')}
     except Exception as e:
         print(f"Google Gmail API error (messages): {e}")
         if "insufficient permissions" in str(e).lower() or "access an unauthorized Scribe service" in str(e).lower():
@@ -86,18 +146,139 @@ async def list_messages(
              raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Google token invalid or revoked.")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error accessing Gmail: {str(e)}")
 
+@router.get("/search")
+async def search_messages(
+    q: str = Query(..., min_length=1),
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    label_ids: Optional[List[str]] = Query(None),
+    max_results: int = Query(25, ge=1, le=100),
+    page_token: Optional[str] = Query(None),
+    prefix: bool = Query(True) # Typeahead: every term matches as a prefix. False: web-search syntax ("phrase", OR, -term)
+):
+    """Ranked full-text search over the local store (subject, addresses, snippet, body text).
+
+    Mailboxes that are not synced yet fall back to Gmail's own search (q=) so the endpoint always works.
+    """
+    offset = mail_store.decode_offset_cursor(page_token)
+    if offset is not None and await mail_store.is_mailbox_synced(db, current_user.email):
+        results, has_more = await mail_store.search_messages(
+            db, current_user.email, q, label_ids=label_ids, limit=max_results, offset=offset, prefix=prefix
+        )
+        return {
+            "messages": [
+                {
+                    'id': message.id, 'threadId': message.thread_id, 'snippet': message.snippet,
+                    'subject': message.subject or 'N/A', 'from': message.from_addr or 'N/A', 'date': message.date_header or 'N/A',
+                    'labelIds': message.label_ids, 'rank': rank,
+                }
+                for message, rank in results
+            ],
+            "nextPageToken": mail_store.encode_offset_cursor(offset + len(results)) if has_more else None,
+            "source": "local",
+        }
+
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    try:
+        results = await execute_async(gmail_service.users().messages().list(
+            userId='me', q=q, labelIds=label_ids, maxResults=max_results, pageToken=page_token
+        ))
+        messages_summary = results.get('messages', [])
+        return {
+            "messages": await _fetch_message_summaries(gmail_service, messages_summary) if messages_summary else [],
+            "nextPageToken": results.get('nextPageToken'),
+            "source": "gmail",
+        }
+    except Exception as e:
+        print(f"Google Gmail API error (search): {e}")
+        if "invalid_grant" in str(e).lower() or "token has been expired or revoked" in str(e).lower():
+             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Google token invalid or revoked.")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error searching Gmail: {str(e)}")
+
+SEMANTIC_SEARCH_KINDS = ("threads", "messages")
+SEMANTIC_LABEL_OVERFETCH = 5 # Candidates per result when filtering by label after ranking
+
+def _semantic_message(message, score: float) -> dict:
+    return {
+        'id': message.id, 'threadId': message.thread_id, 'snippet': message.snippet,
+        'subject': message.subject or 'N/A', 'from': message.from_addr or 'N/A', 'date': message.date_header or 'N/A',
+        'labelIds': message.label_ids, 'score': score,
+    }
+
+def _semantic_thread(thread, score: float) -> dict:
+    return {
+        'id': thread.id, 'snippet': thread.snippet, 'subject': thread.latest_message_subject or 'N/A',
+        'from': thread.latest_message_from or 'N/A', 'date': thread.latest_message_date or 'N/A',
+        'labelIds': thread.label_ids, 'messageCount': thread.message_count, 'score': score,
+    }
+
+async def _semantic_results(db: AsyncSession, user_email: str, kind: str, ranked: List[Tuple[str, float]],
+                            label_ids: Optional[List[str]], limit: int) -> List[dict]:
+    """Store rows for ranked ids, in rank order; ids the store no longer has (or without label_ids) are dropped."""
+    get_rows, shape = (mail_store.get_threads, _semantic_thread) if kind == "threads" else (mail_store.get_messages, _semantic_message)
+    rows = await get_rows(db, user_email, [item_id for item_id, _ in ranked])
+    results = []
+    for item_id, score in ranked:
+        row = rows.get(item_id)
+        if row is not None and all(label_id in (row.label_ids or []) for label_id in label_ids or []):
+            results.append(shape(row, round(score, 4)))
+    return results[:limit]
+
+@router.get("/search/semantic")
+async def semantic_search(
+    q: str = Query(..., min_length=1),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    kind: str = Query("threads", description="'threads' or 'messages'"),
+    label_ids: Optional[List[str]] = Query(None),
+    max_results: int = Query(20, ge=1, le=100)
+):
+    """Natural-language search over the local embedding index of synced mail (built on first use)."""
+    if kind not in SEMANTIC_SEARCH_KINDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"kind must be one of {', '.join(SEMANTIC_SEARCH_KINDS)}.")
+    if not await mail_store.is_mailbox_synced(db, current_user.email):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Semantic search needs a synced mailbox; " + STORE_NOT_READY_HINT)
+    await embedding_index.ensure(db, current_user.email)
+    candidates = max_results * SEMANTIC_LABEL_OVERFETCH if label_ids else max_results
+    ranked = await embedding_index.search(current_user.email, q, kind[:-1], candidates)
+    return {kind: await _semantic_results(db, current_user.email, kind, ranked, label_ids, max_results), "source": "local"}
+
 @router.get("/messages/{message_id}")
 async def get_message_detail(
     message_id: str,
     credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
-    # format_type: str = Query("full", enum=["full", "minimal", "raw", "metadata"]) # Optional: Allow specifying format
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    view: str = Query("raw", enum=list(MESSAGE_VIEWS)) # raw = Gmail's format='full' resource, unchanged
 ):
-    gmail_service = googleapiclient.discovery.build(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
     try:
+        if view == "headers":
+            message = await execute_async(gmail_service.users().messages().get(userId='me', id=message_id, format='metadata'))
+            return fast_json(headers_only(message))
+        if view in ("processed", "body"):
+            processed = message_body_cache.get((current_user.email, message_id))
+            if processed is not None:
+                if view == "body":
+                    return fast_json(shape_message(processed, view)) # Bodies never change: no Gmail call at all
+                # Only labels/historyId can have changed; format='minimal' carries no payload
+                current = await execute_async(gmail_service.users().messages().get(userId='me', id=message_id, format='minimal'))
+                return fast_json(with_mutable_fields(processed, current))
         # Using format='full' to get most details including body parts
-        # Consider what parts of the message are needed for display to optimize
-        message = gmail_service.users().messages().get(userId='me', id=message_id, format='full').execute()
-        return message
+        message = await execute_async(gmail_service.users().messages().get(userId='me', id=message_id, format='full'))
+        if view == "raw":
+            return fast_json(message)
+        processed = process_message(message)
+        message_body_cache.set((current_user.email, message_id), processed)
+        # We have the body anyway: make the message searchable by it if the store lacks it
+        try:
+            await mail_store.set_body_texts(db, current_user.email, {message_id: body_text(processed['body'])})
+            await db.commit()
+        except Exception as e: # Indexing is a side effect; the reader still gets the message
+            await db.rollback()
+            print(f"Could not store body text for message {message_id}: {e}")
+        return fast_json(shape_message(processed, view))
     except googleapiclient.errors.HttpError as e:
         if e.resp.status == 404:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Message with ID {message_id} not found.")
@@ -111,13 +292,84 @@ async def get_message_detail(
         print(f"General error getting message {message_id}: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {str(e)}")
 
+def _cached_attachment_descriptor(user_email: str, message_id: str, attachment_id: str) -> dict:
+    # Filename and type come from the message's processed view, if the client opened it recently
+    processed = message_body_cache.get((user_email, message_id))
+    if processed is None:
+        return {}
+    return next((a for a in processed['attachments'] if a.get('attachmentId') == attachment_id), {})
+
+@router.get("/messages/{message_id}/attachments/{attachment_id}")
+async def get_attachment(
+    message_id: str,
+    attachment_id: str,
+    request: Request,
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    filename: Optional[str] = Query(None),
+    mime_type: Optional[str] = Query(None),
+    download: bool = Query(False) # Content-Disposition: attachment instead of inline
+):
+    """Streams a decoded attachment from the disk cache (fetched from Gmail once). Supports Range."""
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    attachment_query = gmail_service.users().messages().attachments().get(userId='me', messageId=message_id, id=attachment_id)
+    try:
+        blob = await attachment_store.get_or_fetch(
+            current_user.email, message_id, attachment_id, open_stream=lambda: stream_async(attachment_query)
+        )
+    except googleapiclient.errors.HttpError as e:
+        if e.resp.status in (400, 404):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Attachment {attachment_id} of message {message_id} not found.")
+        print(f"Google Gmail API error (get attachment {attachment_id} of {message_id}): {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error accessing Gmail attachment: {str(e)}")
+    except Exception as e:
+        print(f"General error getting attachment {attachment_id} of {message_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {str(e)}")
+
+    descriptor = _cached_attachment_descriptor(current_user.email, message_id, attachment_id)
+    filename = filename or descriptor.get('filename') or attachment_id
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{blob.sha256}"',
+        'Cache-Control': 'private, max-age=86400', # Attachment bytes never change
+        'Content-Disposition': f"{'attachment' if download else 'inline'}; filename*=UTF-8''{quote(filename)}",
+    }
+    if etag_matches(request, headers['ETag']):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        byte_range = parse_range(request.headers.get('range'), blob.size)
+    except ValueError:
+        return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers={'Content-Range': f'bytes */{blob.size}'})
+    media_type = mime_type or descriptor.get('mimeType') or 'application/octet-stream'
+    if byte_range is None:
+        headers['Content-Length'] = str(blob.size)
+        return StreamingResponse(attachment_store.iter_file(blob), media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{blob.size}'
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(
+        attachment_store.iter_file(blob, start, end), status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type, headers=headers
+    )
+
 @router.get("/labels")
-async def list_gmail_labels(credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)):
-    # Remove duplicated refresh logic
-    gmail_service = googleapiclient.discovery.build(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+async def list_gmail_labels(
+    request: Request,
+    response: Response,
+    with_counts: bool = Query(False, description="Include messagesTotal/messagesUnread/threadsTotal/threadsUnread per label"),
+    current_user: User = Depends(get_current_user),
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)
+):
+    # Served from the per-user label catalog; Gmail is only asked when it's cold or counts are stale
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
     try:
-        results = gmail_service.users().labels().list(userId='me').execute()
-        labels = results.get('labels', [])
+        labels = await label_catalog.labels(gmail_service, current_user.email, with_counts)
+        # Labels carry no version of their own, so hash them; still saves the client the download
+        etag = content_etag(labels)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
         return {"labels": labels}
     except Exception as e:
         print(f"Google Gmail API error (labels): {e}")
@@ -136,10 +388,11 @@ class DraftEmailSchema(BaseModel):
 @router.post("/drafts", status_code=status.HTTP_201_CREATED)
 async def create_gmail_draft(
     email_data: DraftEmailSchema,
-    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials) # Use dependency
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials), # Use dependency
+    current_user: User = Depends(get_current_user)
 ):
     # Remove duplicated refresh logic
-    gmail_service = googleapiclient.discovery.build(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
     try:
         message = MIMEText(email_data.body)
         message['to'] = email_data.to
@@ -147,7 +400,8 @@ async def create_gmail_draft(
         raw_message_bytes = message.as_bytes()
         raw_message_b64 = base64.urlsafe_b64encode(raw_message_bytes).decode('utf-8')
         body = {'message': {'raw': raw_message_b64}}
-        draft = gmail_service.users().drafts().create(userId='me', body=body).execute()
+        draft = await execute_async(gmail_service.users().drafts().create(userId='me', body=body))
+        gmail_prefetcher.forget_user(current_user.email)
         return {
             "message": "Draft created successfully!", "id": draft.get('id'),
             "messageId": draft.get('message', {}).get('id')
@@ -162,10 +416,11 @@ async def create_gmail_draft(
 
 @router.post("/drafts/create_blank", status_code=status.HTTP_201_CREATED)
 async def create_blank_gmail_draft(
-    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user)
 ):
     """Creates a new, blank draft message."""
-    gmail_service = googleapiclient.discovery.build(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
     try:
         # Create a minimal, valid raw RFC 822 message string.
         # An empty subject and body is usually sufficient for a "blank" draft.
@@ -180,7 +435,8 @@ async def create_blank_gmail_draft(
             }
         }
         
-        draft = gmail_service.users().drafts().create(userId='me', body=message_body_for_api).execute()
+        draft = await execute_async(gmail_service.users().drafts().create(userId='me', body=message_body_for_api))
+        gmail_prefetcher.forget_user(current_user.email)
         return {
             "message": "Blank draft created successfully!", 
             "id": draft.get('id'),
@@ -201,15 +457,16 @@ class DraftReplySchema(BaseModel):
 @router.post("/drafts/reply", status_code=status.HTTP_201_CREATED)
 async def create_draft_reply(
     reply_data: DraftReplySchema,
-    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user)
 ):
-    gmail_service = googleapiclient.discovery.build(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
     original_message_id = reply_data.original_message_id
 
     try:
         # 1. Fetch the original message - use format='full' or 'metadata' + snippet
         # format='metadata' includes the snippet which is often sufficient
-        original_message = gmail_service.users().messages().get(userId='me', id=original_message_id, format='metadata').execute()
+        original_message = await execute_async(gmail_service.users().messages().get(userId='me', id=original_message_id, format='metadata'))
         original_headers = original_message.get('payload', {}).get('headers', [])
         original_thread_id = original_message.get('threadId')
         original_snippet = original_message.get('snippet', '')
@@ -280,7 +537,8 @@ async def create_draft_reply(
             }
         }
 
-        created_draft = gmail_service.users().drafts().create(userId='me', body=draft_body_for_api).execute()
+        created_draft = await execute_async(gmail_service.users().drafts().create(userId='me', body=draft_body_for_api))
+        gmail_prefetcher.forget_user(current_user.email) # The prefetched thread doesn't list this draft
 
         return {
             "message": "Reply draft created successfully!",
@@ -308,7 +566,8 @@ class EnrichedThread(BaseModel):
     latest_message_subject: Optional[str] = None
     latest_message_from: Optional[str] = None
     latest_message_date: Optional[str] = None # Store as string for simplicity, frontend can parse
-    # latest_message_timestamp: Optional[int] = None # Or store timestamp
+    latest_message_timestamp: Optional[int] = None # internalDate (ms) of the latest message; what lists sort by
+    owes_reply: Optional[bool] = None # Someone is waiting on an answer; only known for threads served from the store
     # message_count: Optional[int] = None # threads.get needed for reliable count
     # has_draft: Optional[bool] = None # Requires separate check
 
@@ -318,87 +577,227 @@ class EnrichedThreadsListResponse(BaseModel):
     resultSizeEstimate: Optional[int] = None
     labelIdsApplied: Optional[List[str]] = None
 
+def _enriched_thread_from_store(thread) -> EnrichedThread:
+    return EnrichedThread(
+        id=thread.id,
+        snippet=thread.snippet or '',
+        historyId=str(thread.history_id or ''),
+        latest_message_subject=thread.latest_message_subject or '',
+        latest_message_from=thread.latest_message_from or '',
+        latest_message_date=thread.latest_message_date,
+        latest_message_timestamp=thread.latest_internal_date,
+        owes_reply=thread.owes_reply,
+    )
+
+def _thread_enrichment_request(gmail_service, thread_id: str):
+    # threads.get has no "latest message only" mode, so at least limit the headers it returns
+    return gmail_service.users().threads().get(
+        userId='me', id=thread_id, format='metadata', metadataHeaders=THREAD_ENRICHMENT_HEADERS
+    )
+
+def _latest_message_fields(thread_response: dict) -> dict:
+    """EnrichedThread fields from the *last* message of a threads.get response."""
+    last_message = thread_response.get('messages', [])[-1] if thread_response.get('messages') else None
+    if not last_message or not last_message.get('payload'):
+        return {} # No messages or payload found
+    headers = last_message.get('payload', {}).get('headers', [])
+    subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), '')
+    from_sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
+    date_str = next((h['value'] for h in headers if h['name'].lower() == 'date'), last_message.get('internalDate')) # Use Date header or internalDate
+    internal_date = last_message.get('internalDate')
+    return {
+        'latest_message_subject': subject,
+        'latest_message_from': from_sender,
+        'latest_message_date': date_str,
+        'latest_message_timestamp': int(internal_date) if internal_date else None,
+    }
+
+def _thread_page_key(label_ids: Optional[List[str]], max_results: int, page_token: Optional[str]) -> tuple:
+    return ('threads_page', tuple(label_ids or ()), max_results, page_token)
+
+async def _fetch_thread_page(gmail_service, user_email: str, label_ids: Optional[List[str]], max_results: int, page_token: Optional[str]) -> dict:
+    """threads.list, or the page prefetched for us when the previous one was served."""
+    prefetched = gmail_prefetcher.pop(user_email, _thread_page_key(label_ids, max_results, page_token))
+    if prefetched is not None:
+        return prefetched
+    return await execute_async(gmail_service.users().threads().list(
+        userId='me',
+        maxResults=max_results,
+        pageToken=page_token,
+        labelIds=label_ids 
+    ))
+
+def _uncached_enrichment(user_email: str, threads: List[dict]) -> List[dict]:
+    return [thread for thread in threads if thread_enrichment_cache.get((user_email, thread['id'], thread.get('historyId'))) is None]
+
+async def _enrich_threads(gmail_service, user_email: str, threads: List[dict]) -> dict:
+    """Latest-message fields per thread id ({'error': True} where fetching failed)."""
+    # Enrichment only depends on the thread's historyId, so reuse it until the thread changes
+    latest_message_data_map = {}
+    threads_to_fetch = []
+    for thread in threads:
+        cached = thread_enrichment_cache.get((user_email, thread['id'], thread.get('historyId')))
+        if cached is not None:
+            latest_message_data_map[thread['id']] = cached
+        else:
+            threads_to_fetch.append(thread)
+
+    if threads_to_fetch:
+        responses = await gmail_batch_executor.execute([
+            (thread['id'], _thread_enrichment_request(gmail_service, thread['id'])) for thread in threads_to_fetch
+        ])
+        for thread in threads_to_fetch:
+            thread_id = thread['id']
+            thread_response, exception = responses[thread_id]
+            if exception:
+                print(f"Error fetching thread details for {thread_id} during list enrichment: {exception}")
+                # Store error or empty data? Decide on error handling for enrichment.
+                latest_message_data_map[thread_id] = {'error': True}
+                continue
+            latest_message_data_map[thread_id] = _latest_message_fields(thread_response)
+            thread_enrichment_cache.set((user_email, thread_id, thread.get('historyId')), latest_message_data_map[thread_id])
+    return latest_message_data_map
+
+def _build_enriched_threads(basic_threads: List[dict], latest_message_data_map: dict) -> Tuple[List[EnrichedThread], bool]:
+    """EnrichedThreads from a threads.list page plus its enrichment; and whether none of it failed."""
+    enriched_threads = []
+    complete = True
+    for thread in basic_threads:
+        enriched_data = latest_message_data_map.get(thread['id'], {})
+        if enriched_data.get('error'):
+            complete = False
+        enriched_threads.append(EnrichedThread(
+            id=thread['id'],
+            snippet=thread.get('snippet', ''),
+            historyId=thread.get('historyId', ''),
+            **enriched_data # Add subject, from, date if found
+        ))
+    return enriched_threads, complete
+
+def _drafts_query(gmail_service, thread_id: str):
+    return gmail_service.users().drafts().list(
+        userId='me',
+        # Use q parameter to filter drafts by threadId. 
+        # Note: This relies on the draft having the correct threadId set, 
+        # which our create_draft_reply function does.
+        q=f'in:draft thread:{thread_id}'
+    )
+
+THREAD_PREFETCH_COST = quota_cost('gmail.users.threads.get')[1] + quota_cost('gmail.users.drafts.list')[1]
+THREAD_PAGE_COST = quota_cost('gmail.users.threads.list')[1]
+THREAD_ENRICHMENT_COST = quota_cost('gmail.users.threads.get')[1]
+
+async def _prefetch_after_thread_page(gmail_service, user_email: str, thread_ids: List[str], label_ids: Optional[List[str]],
+                                      max_results: int, next_page_token: Optional[str]):
+    """Warms what the user is likely to open next: the top threads of this page, then the next page."""
+    top_ids = [
+        thread_id for thread_id in thread_ids[:GMAIL_PREFETCH_TOP_THREADS]
+        if not gmail_prefetcher.has(user_email, ('thread', thread_id))
+    ]
+    if top_ids and gmail_prefetcher.try_spend(user_email, THREAD_PREFETCH_COST * len(top_ids)):
+        # What get_thread_detail needs, for every view: the full thread and its drafts
+        responses = await gmail_batch_executor.execute(
+            [(f"thread:{thread_id}", gmail_service.users().threads().get(userId='me', id=thread_id, format='full')) for thread_id in top_ids]
+            + [(f"drafts:{thread_id}", _drafts_query(gmail_service, thread_id)) for thread_id in top_ids]
+        )
+        for thread_id in top_ids:
+            thread, thread_error = responses[f"thread:{thread_id}"]
+            drafts, drafts_error = responses[f"drafts:{thread_id}"]
+            if thread_error is None and drafts_error is None:
+                gmail_prefetcher.store(user_email, ('thread', thread_id), {'thread': thread, 'drafts': drafts.get('drafts', [])})
+
+    page_key = _thread_page_key(label_ids, max_results, next_page_token)
+    if not next_page_token or gmail_prefetcher.has(user_email, page_key) or not gmail_prefetcher.try_spend(user_email, THREAD_PAGE_COST):
+        return
+    results = await execute_async(gmail_service.users().threads().list(
+        userId='me', maxResults=max_results, pageToken=next_page_token, labelIds=label_ids
+    ))
+    gmail_prefetcher.store(user_email, page_key, results)
+    uncached = _uncached_enrichment(user_email, results.get('threads', []))
+    if uncached and gmail_prefetcher.try_spend(user_email, THREAD_ENRICHMENT_COST * len(uncached)):
+        await _enrich_threads(gmail_service, user_email, uncached)
+
+THREAD_LIST_ORDERS = ("date", "importance")
+
 @router.get("/threads", response_model=EnrichedThreadsListResponse)
 async def list_threads(
+    request: Request,
+    response: Response,
     credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
     label_ids: Optional[List[str]] = Query(None), 
     max_results: int = Query(25, ge=1, le=100),
-    page_token: Optional[str] = Query(None)
+    page_token: Optional[str] = Query(None),
+    order: str = Query("date", description="'date' or 'importance'")
 ):
     """Lists threads with enriched data for the latest message."""
-    gmail_service = googleapiclient.discovery.build(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    if order not in THREAD_LIST_ORDERS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"order must be one of {', '.join(THREAD_LIST_ORDERS)}.")
+    ranked = order == "importance"
+    if ranked:
+        # Only the store has the ranking
+        if not await mail_store.is_mailbox_synced(db, current_user.email):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Ordering by importance needs a synced mailbox; " + STORE_NOT_READY_HINT)
+        label_ids = label_ids or ["INBOX"] # Unfiltered listing isn't modelled locally (see below)
+        await thread_ranker.ensure(db, current_user.email)
+    # Served from the local metadata store once the mailbox is synced. Unfiltered listing stays
+    # upstream since Gmail excludes SPAM/TRASH there, which the store does not model.
+    if label_ids and (ranked or (_serves_from_store(page_token) and await mail_store.is_mailbox_synced(db, current_user.email))):
+        # Every change to the store moves its version: no need to look at the rows
+        state = await mail_store.get_sync_state(db, current_user.email)
+        etag = make_etag('threads', current_user.email, label_ids, max_results, page_token, order, mail_store.store_version(state))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+        stored_threads, next_cursor = await mail_store.list_threads(db, current_user.email, label_ids, max_results, page_token, order)
+        gmail_prefetcher.spawn(_prefetch_after_thread_page(
+            build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials), current_user.email,
+            [thread.id for thread in stored_threads], label_ids, max_results, next_page_token=None # Next page is local anyway
+        ), f"top threads for {current_user.email}")
+        return fast_json(EnrichedThreadsListResponse(
+            threads=[_enriched_thread_from_store(thread) for thread in stored_threads],
+            nextPageToken=next_cursor,
+            resultSizeEstimate=await mail_store.estimate_result_size(db, current_user.email, label_ids, threads=True),
+            labelIdsApplied=label_ids
+        ), response)
+
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
     try:
-        thread_list_query = gmail_service.users().threads().list(
-            userId='me',
-            maxResults=max_results,
-            pageToken=page_token,
-            labelIds=label_ids 
-        )
-        results = await run_in_threadpool(thread_list_query.execute)
+        results = await _fetch_thread_page(gmail_service, current_user.email, label_ids, max_results, page_token)
         
         basic_threads = results.get('threads', [])
         next_page_token = results.get('nextPageToken')
         result_size_estimate = results.get('resultSizeEstimate')
 
+        # The page is fully determined by its threads' historyIds, so a client that has it
+        # already doesn't need the enrichment fetches below either
+        etag = make_etag(
+            'threads', current_user.email, label_ids, max_results, page_token,
+            [(thread['id'], thread.get('historyId')) for thread in basic_threads], next_page_token, result_size_estimate
+        )
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
         enriched_threads = []
         if basic_threads:
-            # Prepare batch request to get metadata for the latest message of each thread
-            batch = gmail_service.new_batch_http_request()
-            latest_message_data_map = {}
-
-            def _create_thread_get_callback(thread_id):
-                def callback(request_id, response, exception):
-                    if exception:
-                        print(f"Error fetching thread details for {thread_id} during list enrichment: {exception}")
-                        # Store error or empty data? Decide on error handling for enrichment.
-                        latest_message_data_map[thread_id] = {'error': True}
-                    else:
-                        # Get the *last* message from the thread's message list
-                        last_message = response.get('messages', [])[-1] if response.get('messages') else None
-                        if last_message and last_message.get('payload'):
-                            headers = last_message.get('payload', {}).get('headers', [])
-                            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), '')
-                            from_sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
-                            date_str = next((h['value'] for h in headers if h['name'].lower() == 'date'), last_message.get('internalDate')) # Use Date header or internalDate
-                            latest_message_data_map[thread_id] = {
-                                'latest_message_subject': subject,
-                                'latest_message_from': from_sender,
-                                'latest_message_date': date_str,
-                            }
-                        else:
-                             latest_message_data_map[thread_id] = {} # No messages or payload found
-                return callback
-
-            for thread in basic_threads:
-                thread_id = thread['id']
-                # Request only metadata for the latest message - but threads.get requires fetching all messages metadata.
-                # There isn't a direct way to get ONLY the latest message easily with threads.get.
-                # Alternative: Use messages.list(threadId=thread_id, maxResults=1) - potentially faster?
-                # Let's stick to threads.get(format='metadata') for now, it gives all message headers.
-                batch.add(
-                    gmail_service.users().threads().get(userId='me', id=thread_id, format='metadata'),
-                    callback=_create_thread_get_callback(thread_id)
-                )
-            
-            await run_in_threadpool(batch.execute) # Execute batch fetch for thread metadata
-
+            latest_message_data_map = await _enrich_threads(gmail_service, current_user.email, basic_threads)
             # Combine basic thread info with enriched data
-            for thread in basic_threads:
-                thread_id = thread['id']
-                enriched_data = latest_message_data_map.get(thread_id, {})
-                enriched_threads.append(EnrichedThread(
-                    id=thread_id,
-                    snippet=thread.get('snippet', ''),
-                    historyId=thread.get('historyId', ''),
-                    **enriched_data # Add subject, from, date if found
-                ))
-        
-        return EnrichedThreadsListResponse(
+            enriched_threads, complete = _build_enriched_threads(basic_threads, latest_message_data_map)
+            if not complete:
+                etag = None # Don't let the client hold on to a page with holes in it
+
+        set_etag(response, etag)
+        gmail_prefetcher.spawn(_prefetch_after_thread_page(
+            gmail_service, current_user.email, [thread['id'] for thread in basic_threads], label_ids, max_results, next_page_token
+        ), f"after threads page for {current_user.email}")
+        # Built from validated EnrichedThreads just above; response_model would only validate it all again
+        return fast_json(EnrichedThreadsListResponse(
             threads=enriched_threads,
             nextPageToken=next_page_token,
             resultSizeEstimate=result_size_estimate,
             labelIdsApplied=label_ids
-        )
+        ), response)
 
     except Exception as e:
         print(f"Google Gmail API error (list threads enriched): {e}")
@@ -409,56 +808,326 @@ async def list_threads(
              raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Google token invalid or revoked.")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error listing Gmail threads: {str(e)}")
 
-@router.get("/threads/{thread_id}")
-async def get_thread_detail(
-    thread_id: str,
-    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials)
-    # Optional: Add query params for message format etc. if needed later
+STREAM_FORMATS = ("ndjson", "sse")
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+def _stream_event(stream_format: str, event: str, data: dict) -> bytes:
+    payload = orjson.dumps({'type': event, **data})
+    if stream_format == "sse":
+        return b'event: ' + event.encode('ascii') + b'\ndata: ' + payload + b'\n\n'
+    return payload + b'\n'
+
+@router.get("/threads/stream")
+async def stream_threads(
+    request: Request,
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    label_ids: Optional[List[str]] = Query(None),
+    max_results: int = Query(25, ge=1, le=100),
+    page_token: Optional[str] = Query(None),
+    stream_format: Optional[str] = Query(None, alias="format", enum=list(STREAM_FORMATS)) # Default: sse if the client accepts it
 ):
-    """Gets the full details of a thread, including its messages and associated drafts."""
-    gmail_service = googleapiclient.discovery.build(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
-    try:
-        # 1. Get messages in the thread
+    """Streaming variant of /threads: rows first, enrichment as it arrives.
+
+    Events, as NDJSON lines or SSE events of the same name:
+      page   - {threads, nextPageToken, resultSizeEstimate, labelIdsApplied}; threads carry
+               whatever enrichment was cached already
+      thread - {id, latest_message_subject, latest_message_from, latest_message_date, latest_message_timestamp},
+               or {id, error: true}, once per thread that wasn't cached, in completion order
+      done   - {}
+    """
+    if stream_format is None:
+        stream_format = "sse" if "text/event-stream" in request.headers.get('accept', '') else "ndjson"
+    user_email = current_user.email
+
+    pending_threads = []
+    if label_ids and _serves_from_store(page_token) and await mail_store.is_mailbox_synced(db, user_email):
+        stored_threads, next_cursor = await mail_store.list_threads(db, user_email, label_ids, max_results, page_token)
+        page = {
+            'threads': [_enriched_thread_from_store(thread).model_dump() for thread in stored_threads],
+            'nextPageToken': next_cursor,
+            'resultSizeEstimate': await mail_store.estimate_result_size(db, user_email, label_ids, threads=True),
+            'labelIdsApplied': label_ids,
+        }
+    else:
+        gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+        try:
+            # Errors listing the page still become a normal error response; only enrichment streams
+            results = await _fetch_thread_page(gmail_service, user_email, label_ids, max_results, page_token)
+        except Exception as e:
+            print(f"Google Gmail API error (stream threads): {e}")
+            if "insufficient permissions" in str(e).lower():
+                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions for Gmail.")
+            if "invalid_grant" in str(e).lower() or "token has been expired or revoked" in str(e).lower():
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Google token invalid or revoked.")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error listing Gmail threads: {str(e)}")
+        rows = []
+        for thread in results.get('threads', []):
+            cached = thread_enrichment_cache.get((user_email, thread['id'], thread.get('historyId')))
+            if cached is None:
+                pending_threads.append(thread)
+            rows.append(EnrichedThread(
+                id=thread['id'], snippet=thread.get('snippet', ''), historyId=thread.get('historyId', ''), **(cached or {})
+            ).model_dump())
+        page = {
+            'threads': rows,
+            'nextPageToken': results.get('nextPageToken'),
+            'resultSizeEstimate': results.get('resultSizeEstimate'),
+            'labelIdsApplied': label_ids,
+        }
+
+    async def events():
+        yield _stream_event(stream_format, "page", page)
+        if pending_threads:
+            history_ids = {thread['id']: thread.get('historyId') for thread in pending_threads}
+            # Each batch chunk's results go out as soon as that chunk completes
+            async for thread_id, thread_response, exception in gmail_batch_executor.iter_results([
+                (thread['id'], _thread_enrichment_request(gmail_service, thread['id'])) for thread in pending_threads
+            ]):
+                if exception:
+                    print(f"Error fetching thread details for {thread_id} during streamed enrichment: {exception}")
+                    yield _stream_event(stream_format, "thread", {'id': thread_id, 'error': True})
+                    continue
+                fields = _latest_message_fields(thread_response)
+                thread_enrichment_cache.set((user_email, thread_id, history_ids[thread_id]), fields)
+                yield _stream_event(stream_format, "thread", {'id': thread_id, **fields})
+        yield _stream_event(stream_format, "done", {})
+
+    return StreamingResponse(
+        events(), media_type=STREAM_MEDIA_TYPES[stream_format],
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'} # No proxy buffering either
+    )
+
+class UnifiedThread(EnrichedThread):
+    account: str # Google account the thread belongs to
+
+class UnifiedThreadsListResponse(BaseModel):
+    threads: List[UnifiedThread]
+    nextPageToken: Optional[str] = None
+    accounts: List[str]
+    failedAccounts: Dict[str, str] = {} # account -> error; these are retried on the next page
+    labelIdsApplied: Optional[List[str]] = None
+
+async def _unified_account_page(account: str, position: AccountPosition, label_ids: List[str], max_results: int) -> AccountPage:
+    """One account's threads for a unified page. Runs in its own task, with the account's own credentials and quota."""
+    quota_user.set(account)
+    credentials = await token_refresher.get_credentials(account)
+    source, token, skip = position
+    if source is None: # First page for this account: same choice of source as /threads
+        async with AsyncSessionLocal() as db:
+            source = 'store' if await mail_store.is_mailbox_synced(db, account) else 'gmail'
+    if source == 'store':
+        async with AsyncSessionLocal() as db:
+            stored_threads, next_cursor = await mail_store.list_threads(db, account, label_ids, max_results, token)
+        return AccountPage(account, (source, token, 0), [_enriched_thread_from_store(thread) for thread in stored_threads], next_cursor)
+
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    results = await _fetch_thread_page(gmail_service, account, label_ids, max_results, token)
+    basic_threads = results.get('threads', [])[skip:]
+    threads, _ = _build_enriched_threads(basic_threads, await _enrich_threads(gmail_service, account, basic_threads))
+    # A thread whose enrichment failed keeps its place in Gmail's order
+    previous_timestamp = None
+    for thread in threads:
+        if thread.latest_message_timestamp is None:
+            thread.latest_message_timestamp = previous_timestamp
+        previous_timestamp = thread.latest_message_timestamp
+    return AccountPage(account, (source, token, skip), threads, results.get('nextPageToken'))
+
+@router.get("/threads/unified", response_model=UnifiedThreadsListResponse)
+async def list_unified_threads(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    label_ids: List[str] = Query(["INBOX"]),
+    max_results: int = Query(25, ge=1, le=100),
+    page_token: Optional[str] = Query(None)
+):
+    """Threads from every Google account linked to the user's profile, merged newest first.
+
+    Accounts are queried concurrently; one that fails is reported in failedAccounts and
+    the rest are still served. Each thread says which account it belongs to.
+    """
+    accounts = await linked_accounts(db, current_user.email)
+    if page_token:
+        positions = decode_unified_cursor(page_token)
+        if positions is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid page_token for the unified inbox.")
+        positions = {account: position for account, position in positions.items() if account in accounts}
+    else:
+        positions = {account: (None, None, 0) for account in accounts}
+
+    active_accounts = list(positions)
+    outcomes = await asyncio.gather(
+        *(_unified_account_page(account, positions[account], label_ids, max_results) for account in active_accounts),
+        return_exceptions=True
+    )
+    pages, failed = [], {}
+    for account, outcome in zip(active_accounts, outcomes):
+        if isinstance(outcome, BaseException):
+            failed[account] = str(getattr(outcome, 'detail', outcome))
+            print(f"Unified inbox: could not list threads for {account}: {failed[account]}")
+        else:
+            pages.append(outcome)
+    if active_accounts and not pages:
+        e = outcomes[0]
+        if isinstance(e, HTTPException):
+            raise e
+        if "insufficient permissions" in str(e).lower():
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions for Gmail.")
+        if "invalid_grant" in str(e).lower() or "token has been expired or revoked" in str(e).lower():
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Google token invalid or revoked.")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error listing Gmail threads: {str(e)}")
+
+    merged, consumed = merge_account_pages(pages, max_results)
+    next_positions = {}
+    for page in pages:
+        position = page.position_after(consumed[page.account])
+        if position is not None:
+            next_positions[page.account] = position
+    if next_positions:
+        next_positions.update({account: positions[account] for account in failed}) # Try them again next time
+    return fast_json(UnifiedThreadsListResponse(
+        threads=[UnifiedThread(account=account, **thread.model_dump()) for account, thread in merged],
+        nextPageToken=encode_unified_cursor(next_positions) if next_positions else None,
+        accounts=accounts,
+        failedAccounts=failed,
+        labelIdsApplied=label_ids
+    ))
+
+async def _processed_thread(gmail_service, user_email: str, thread_id: str, minimal_thread: Optional[dict] = None) -> dict:
+    """threads.get with every message in processed form, reusing cached bodies where we have them.
+
+    `minimal_thread` is a format='minimal' threads.get response the caller already has.
+    """
+    thread_data = minimal_thread or await execute_async(gmail_service.users().threads().get(userId='me', id=thread_id, format='minimal'))
+    minimal_messages = thread_data.get('messages', [])
+    cached = cached_processed_messages(message_body_cache, user_email, [message['id'] for message in minimal_messages])
+    missing_ids = [message['id'] for message in minimal_messages if message['id'] not in cached]
+
+    fetched = {}
+    if len(missing_ids) > THREAD_MESSAGE_FETCH_LIMIT:
+        # Mostly unseen thread: one threads.get is cheaper in quota than a messages.get per message
+        full_thread = await execute_async(gmail_service.users().threads().get(userId='me', id=thread_id, format='full'))
+        fetched = {message['id']: message for message in full_thread.get('messages', [])}
+    elif missing_ids:
+        responses = await gmail_batch_executor.execute([
+            (message_id, gmail_service.users().messages().get(userId='me', id=message_id, format='full'))
+            for message_id in missing_ids
+        ])
+        for message_id, (response, exception) in responses.items():
+            if exception is not None:
+                raise exception
+            fetched[message_id] = response
+
+    messages = []
+    for message in minimal_messages:
+        if message['id'] in cached:
+            messages.append(with_mutable_fields(cached[message['id']], message))
+        elif message['id'] in fetched:
+            processed = process_message(fetched[message['id']])
+            message_body_cache.set((user_email, message['id']), processed)
+            messages.append(processed)
+    thread_data['messages'] = messages
+    return thread_data
+
+async def _thread_messages(gmail_service, user_email: str, thread_id: str, view: str, minimal_thread: Optional[dict] = None) -> dict:
+    if view in ("processed", "body"):
+        thread_data = await _processed_thread(gmail_service, user_email, thread_id, minimal_thread)
+        thread_data['messages'] = [shape_message(message, view) for message in thread_data['messages']]
+    elif view == "headers":
+        thread_data = await execute_async(gmail_service.users().threads().get(userId='me', id=thread_id, format='metadata'))
+        thread_data['messages'] = [headers_only(message) for message in thread_data.get('messages', [])]
+    else:
         thread_get_query = gmail_service.users().threads().get(
             userId='me', 
             id=thread_id, 
             format='full' # Request full message details including payload (for body)
         )
-        thread_data = await run_in_threadpool(thread_get_query.execute)
-        messages = thread_data.get('messages', [])
+        thread_data = await execute_async(thread_get_query)
+    return thread_data
 
-        # 2. Find drafts associated with this thread
-        drafts = []
-        try:
-            drafts_list_query = gmail_service.users().drafts().list(
-                userId='me',
-                # Use q parameter to filter drafts by threadId. 
-                # Note: This relies on the draft having the correct threadId set, 
-                # which our create_draft_reply function does.
-                q=f'in:draft thread:{thread_id}'
+def _thread_messages_from_full(user_email: str, full_thread: dict, view: str) -> dict:
+    """What _thread_messages returns, from a format='full' thread we already have."""
+    thread_data = dict(full_thread)
+    messages = full_thread.get('messages', [])
+    if view in ("processed", "body"):
+        processed_messages = []
+        for message in messages:
+            processed = process_message(message)
+            message_body_cache.set((user_email, message['id']), processed)
+            processed_messages.append(shape_message(processed, view))
+        thread_data['messages'] = processed_messages
+    elif view == "headers":
+        thread_data['messages'] = [headers_only(message) for message in messages]
+    return thread_data
+
+async def _thread_drafts(gmail_service, thread_id: str) -> Tuple[List[dict], bool]:
+    """Draft summaries for a thread, and whether fetching them worked."""
+    try:
+        draft_results = await execute_async(_drafts_query(gmail_service, thread_id))
+        # Draft summaries include the draft ID and a nested (minimal) message stub.
+        # The frontend can fetch full draft message details separately if needed using the message ID.
+        return draft_results.get('drafts', []), True # Contains { id: draftId, message: { id: messageId, threadId: ... } }
+    except Exception as draft_error:
+        # Log the error but don't fail the whole request if drafts can't be fetched
+        print(f"Warning: Could not fetch drafts for thread {thread_id}: {draft_error}")
+        return [], False
+
+@router.get("/threads/{thread_id}")
+async def get_thread_detail(
+    thread_id: str,
+    request: Request,
+    response: Response,
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    view: str = Query("raw", enum=list(MESSAGE_VIEWS)) # Applied to every message in the thread
+):
+    """Gets the full details of a thread, including its messages and associated drafts."""
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    try:
+        # 0. Conditional GET. While push keeps the store current, its version is a validator
+        # we have locally. Otherwise use the thread's own historyId, which changes
+        # with any new message, label change or draft edit in the thread.
+        local_etag = None
+        minimal_thread = None
+        local_version = await mail_store.push_current_version(db, current_user.email)
+        if local_version is not None:
+            local_etag = make_etag('thread', current_user.email, thread_id, view, 'mailbox', local_version)
+            if etag_matches(request, local_etag):
+                return not_modified(local_etag)
+        elif request.headers.get('if-none-match'):
+            # The client has a copy: format='minimal' (no payloads) is enough to tell if it's current,
+            # and a prefetched thread needs no call at all (and stays prefetched on a 304)
+            prefetched = gmail_prefetcher.peek(current_user.email, ('thread', thread_id))
+            if prefetched is not None:
+                current_history_id = prefetched['thread'].get('historyId')
+            else:
+                minimal_thread = await execute_async(gmail_service.users().threads().get(userId='me', id=thread_id, format='minimal'))
+                current_history_id = minimal_thread.get('historyId')
+            etag = make_etag('thread', current_user.email, thread_id, view, current_history_id)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+
+        prefetched = gmail_prefetcher.pop(current_user.email, ('thread', thread_id)) # A body is going out: take it
+        if prefetched is not None:
+            thread_data = _thread_messages_from_full(current_user.email, prefetched['thread'], view)
+            drafts, drafts_complete = prefetched['drafts'], True
+        else:
+            # 1. Get messages in the thread and 2. find drafts associated with it, concurrently
+            (thread_data, (drafts, drafts_complete)) = await asyncio.gather(
+                _thread_messages(gmail_service, current_user.email, thread_id, view, minimal_thread),
+                _thread_drafts(gmail_service, thread_id),
             )
-            draft_results = await run_in_threadpool(drafts_list_query.execute)
-            draft_summaries = draft_results.get('drafts', [])
-            
-            # If drafts are found, fetch their full details (especially the message part)
-            if draft_summaries:
-                 # Use batching for efficiency if multiple drafts per thread were possible (less common)
-                 # For simplicity now, fetch one by one if needed, or just return summary + ID
-                 # Fetching full draft details can be complex as it might involve another message get.
-                 # Let's return the draft summaries which include the draft ID and a nested (minimal) message stub.
-                 # The frontend can potentially fetch full draft message details separately if needed using the message ID.
-                 drafts = draft_summaries # Contains { id: draftId, message: { id: messageId, threadId: ... } }
-
-        except Exception as draft_error:
-             # Log the error but don't fail the whole request if drafts can't be fetched
-             print(f"Warning: Could not fetch drafts for thread {thread_id}: {draft_error}")
 
         # 3. Combine and return
         # The main thread_data already contains the list of messages.
         # We add the fetched drafts list to it.
         thread_data['drafts'] = drafts 
 
-        return thread_data
+        if drafts_complete: # Otherwise make the client ask again next time
+            set_etag(response, local_etag or make_etag('thread', current_user.email, thread_id, view, thread_data.get('historyId')))
+        return fast_json(thread_data, response)
 
     except googleapiclient.errors.HttpError as e:
         if e.resp.status == 404:
@@ -468,4 +1137,230 @@ async def get_thread_detail(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error accessing Gmail thread: {str(e)}")
     except Exception as e:
         print(f"General error getting thread {thread_id}: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {str(e)}") 
+
+@router.get("/contacts", response_model=ContactsResponse)
+async def list_contacts(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    max_results: int = Query(20, ge=1, le=200),
+    two_way: bool = Query(False, description="Only people the user has both written to and heard from"),
+    co_contacts: int = Query(0, ge=0, le=10, description="Also list this many people each contact shares messages with")
+):
+    """People the user talks to, by recency-weighted message count, from the precomputed contact index."""
+    if not await mail_store.is_mailbox_synced(db, current_user.email):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Contacts need a synced mailbox; " + STORE_NOT_READY_HINT)
+    await contact_index.ensure(db, current_user.email)
+    contacts = await contact_index.top_contacts(db, current_user.email, max_results, two_way=two_way, co_contacts=co_contacts)
+    return ContactsResponse(contacts=contacts)
+
+class ThreadSummariesRequest(BaseModel):
+    thread_ids: Optional[List[str]] = None # Default: the newest threads in label_ids
+    label_ids: List[str] = ["INBOX"]
+    max_threads: int = 20
+
+def _check_summaries_configured():
+    if not thread_summarizer.configured:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Thread summaries are not configured (needs the openai package and OPENAI_API_KEY).")
+
+async def _newest_thread_ids(gmail_service, db: AsyncSession, user_email: str, label_ids: List[str], max_threads: int) -> List[str]:
+    if await mail_store.is_mailbox_synced(db, user_email):
+        threads, _ = await mail_store.list_threads(db, user_email, label_ids, max_threads)
+        return [thread.id for thread in threads]
+    results = await execute_async(gmail_service.users().threads().list(userId='me', labelIds=label_ids, maxResults=max_threads))
+    return [thread['id'] for thread in results.get('threads', [])]
+
+async def _summarize(gmail_service, db: AsyncSession, user_email: str, thread_ids: List[str]) -> ThreadSummariesResult:
+    try:
+        return await thread_summarizer.summarize(db, gmail_service, user_email, thread_ids)
+    except googleapiclient.errors.HttpError as e:
+        print(f"Google Gmail API error (summarize threads for {user_email}): {e}")
+        if "insufficient permissions" in str(e).lower():
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions for Gmail.")
+        if "invalid_grant" in str(e).lower() or "token has been expired or revoked" in str(e).lower():
+             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Google token invalid or revoked.")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error accessing Gmail threads: {str(e)}")
+    except Exception as e:
+        print(f"General error summarizing threads for {user_email}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {str(e)}")
+
+@router.post("/summaries", response_model=ThreadSummariesResult)
+async def summarize_threads(
+    body: ThreadSummariesRequest,
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Summaries of the given threads (or the newest ones in label_ids), for the digest.
+
+    Only content that changed since the last summary goes to the model; threads whose summary
+    couldn't be produced are listed in `failed`.
+    """
+    _check_summaries_configured()
+    thread_ids = list(dict.fromkeys(body.thread_ids or []))
+    if len(thread_ids) > SUMMARY_MAX_THREADS or not 1 <= body.max_threads <= SUMMARY_MAX_THREADS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {SUMMARY_MAX_THREADS} threads per request.")
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    if not thread_ids:
+        thread_ids = await _newest_thread_ids(gmail_service, db, current_user.email, body.label_ids, body.max_threads)
+    return await _summarize(gmail_service, db, current_user.email, thread_ids)
+
+@router.get("/threads/{thread_id}/summary", response_model=ThreadSummary)
+async def get_thread_summary(
+    thread_id: str,
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    _check_summaries_configured()
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    result = await _summarize(gmail_service, db, current_user.email, [thread_id])
+    if result.summaries:
+        return result.summaries[0]
+    reason = result.failed.get(thread_id, "No summary.")
+    if reason == "Thread not found.":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=reason)
+    raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=reason)
+
+@router.get("/threads/{thread_id}/related")
+async def get_related_threads(
+    thread_id: str,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    max_results: int = Query(10, ge=1, le=50)
+):
+    """Threads most similar to this one, from the local embedding index of synced mail."""
+    if not await mail_store.is_mailbox_synced(db, current_user.email):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Related threads need a synced mailbox; " + STORE_NOT_READY_HINT)
+    await embedding_index.ensure(db, current_user.email)
+    ranked = await embedding_index.related_threads(current_user.email, thread_id, max_results)
+    if ranked is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Thread with ID {thread_id} not found in the local store.")
+    return {"threads": await _semantic_results(db, current_user.email, "threads", ranked, None, max_results), "source": "local"}
+
+class BulkMutationRequest(BaseModel):
+    ids: List[str]
+    action: BulkAction
+    add_label_ids: List[str] = [] # For action 'modify'
+    remove_label_ids: List[str] = []
+
+async def _bulk_mutation(mutate, kind: str, body: BulkMutationRequest, credentials, current_user: User, db: AsyncSession):
+    if not body.ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No ids given.")
+    if len(body.ids) > GMAIL_BULK_MAX_IDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {GMAIL_BULK_MAX_IDS} ids per request.")
+    gmail_service = build_service(GMAIL_API_SERVICE_NAME, GMAIL_API_VERSION, credentials=credentials)
+    try:
+        return fast_json(await mutate(
+            gmail_service, db, current_user.email, body.ids, body.action, body.add_label_ids, body.remove_label_ids
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        print(f"Error in bulk {body.action} of {kind} for {current_user.email}: {e}")
+        if "invalid_grant" in str(e).lower() or "token has been expired or revoked" in str(e).lower():
+             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Google token invalid or revoked.")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Bulk {body.action} failed: {str(e)}")
+
+@router.post("/messages/bulk", response_model=BulkMutationResult)
+async def bulk_mutate_messages(
+    body: BulkMutationRequest,
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Archives, labels, marks, trashes or deletes many messages at once; reports success per id.
+
+    'delete' is permanent and needs the full https://mail.google.com/ scope.
+    """
+    return await _bulk_mutation(mutate_messages, "messages", body, credentials, current_user, db)
+
+@router.post("/threads/bulk", response_model=BulkMutationResult)
+async def bulk_mutate_threads(
+    body: BulkMutationRequest,
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Same as /messages/bulk for whole threads (every message in each thread)."""
+    return await _bulk_mutation(mutate_threads, "threads", body, credentials, current_user, db)
+
+@router.post("/sync", response_model=SyncResult)
+async def sync_mailbox(
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user)
+):
+    """Brings the local metadata store up to date (incremental via history.list, or a bounded full resync).
+
+    A full resync that can't hold the whole mailbox queues a backfill; reads stay on Gmail until it's done.
+    """
+    try:
+        return await gmail_sync_engine.sync(current_user.email, credentials)
+    except Exception as e:
+        print(f"Gmail sync error for {current_user.email}: {e}")
+        if "invalid_grant" in str(e).lower() or "token has been expired or revoked" in str(e).lower():
+             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Google token invalid or revoked.")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error syncing Gmail: {str(e)}")
+
+
+# --- Push notifications (Pub/Sub push subscription -> incremental sync) ---
+
+def _check_push_token(token: Optional[str]):
+    if not GMAIL_PUSH_VERIFICATION_TOKEN:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Gmail push notifications are not configured.")
+    if not token or not hmac.compare_digest(token, GMAIL_PUSH_VERIFICATION_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid push verification token.")
+
+@router.post("/backfill", response_model=BackfillProgress, status_code=status.HTTP_202_ACCEPTED)
+async def start_backfill(
+    restart: bool = Query(False, description="Start over instead of resuming from the checkpoint"),
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials), # Fail now, not in the job
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Queues a background backfill of the whole mailbox into the local store; poll GET /gmail/backfill for progress."""
+    state = await gmail_backfiller.request(db, current_user.email, restart=restart)
+    return backfill_progress(state)
+
+@router.get("/backfill", response_model=BackfillProgress)
+async def get_backfill_progress(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    state = await get_backfill_state(db, current_user.email)
+    if state is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No backfill for this mailbox. Start one with POST /gmail/backfill.")
+    return backfill_progress(state)
+
+@router.post("/push", status_code=status.HTTP_204_NO_CONTENT)
+async def receive_push_notification(request: Request, token: Optional[str] = Query(None)):
+    """Pub/Sub push endpoint. Acks immediately; the sync runs in the background, coalesced per mailbox."""
+    _check_push_token(token)
+    try:
+        user_email, history_id = decode_push_envelope(await request.json())
+    except ValueError as e:
+        # Ack anyway: Pub/Sub would otherwise keep redelivering a message we can never parse
+        print(f"Dropping Gmail push notification: {e}")
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    push_sync_queue.notify(user_email, history_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@router.get("/push/stats")
+async def push_stats(token: Optional[str] = Query(None)):
+    _check_push_token(token)
+    return {**push_sync_queue.stats, "pending": push_sync_queue.pending()}
+
+@router.post("/watch")
+async def watch_mailbox(
+    credentials: google.oauth2.credentials.Credentials = Depends(get_refreshed_google_credentials),
+    current_user: User = Depends(get_current_user)
+):
+    """Starts (or renews) Gmail push notifications for the current user's mailbox."""
+    try:
+        response = await renew_watch(current_user.email, credentials)
+        return {"historyId": response.get('historyId'), "expiration": response.get('expiration')}
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except googleapiclient.errors.HttpError as e:
+        print(f"Google Gmail API error (watch): {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error starting Gmail watch: {str(e)}")
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app is imported as server.mailapi (see the Dockerfile), with server/ on the path for `shared`
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for path in (SERVER_DIR, os.path.dirname(SERVER_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
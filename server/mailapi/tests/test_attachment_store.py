@@ -0,0 +1,32 @@
+import pytest
+
+from server.mailapi.attachment_store import parse_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('', None),
+    ('bytes=0-9', (0, 9)),
+    ('bytes=90-', (90, 99)),
+    ('bytes=50-500', (50, 99)), # End past the file: clamped
+    ('bytes=-10', (90, 99)), # Suffix: the last 10 bytes
+    ('bytes=-500', (0, 99)),
+    ('bytes=0-1,5-6', None), # Multiple ranges: send everything
+    ('items=0-9', None),
+    ('bytes=a-b', None), # Malformed: ignored
+    ('bytes=-', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize('header, size', [
+    ('bytes=100-', 100),
+    ('bytes=100-200', 100),
+    ('bytes=5-4', 100),
+    ('bytes=-0', 100),
+    ('bytes=-10', 0),
+])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
@@ -0,0 +1,80 @@
+import math
+
+import pytest
+
+from server.mailapi.contacts import _COUNTERS, CONTACT_EDGE_MAX_PARTICIPANTS, _Aggregate, _logaddexp
+
+USER = 'me@x.com'
+HOUR = 3600000
+T0 = 1700000000000
+
+
+def row(message_id, at, frm, to, labels=('INBOX',), cc=None):
+    return {'id': message_id, 'thread_id': 't1', 'internal_date': at, 'label_ids': list(labels),
+            'from_addr': frm, 'to_addr': to, 'cc_addr': cc}
+
+
+# Alice writes, I answer an hour later, she answers two hours after that
+THREAD = [
+    row('m1', T0, 'Alice <alice@x.com>', USER),
+    row('m2', T0 + HOUR, USER, 'alice@x.com', labels=('SENT',)),
+    row('m3', T0 + 3 * HOUR, 'Alice <alice@x.com>', USER, cc='bob@x.com'),
+]
+
+
+def aggregate(rows, new_ids=None):
+    result = _Aggregate(USER)
+    result.add_thread(rows, new_ids)
+    return result
+
+
+def totals(*aggregates):
+    """What the tables hold after merging the aggregates in turn (as _merge does)."""
+    merged = {}
+    for part in aggregates:
+        for address, contact in part.contacts.items():
+            stored = merged.setdefault(address, {counter: 0 for counter in _COUNTERS} | {'log_score': -math.inf, 'last_sent_at': None, 'last_received_at': None})
+            for counter in _COUNTERS:
+                stored[counter] += getattr(contact, counter)
+            stored['log_score'] = _logaddexp(stored['log_score'], contact.log_score)
+            for field in ('last_sent_at', 'last_received_at'):
+                values = [value for value in (stored[field], getattr(contact, field)) if value is not None]
+                stored[field] = max(values) if values else None
+    return {address: {**stored, 'log_score': pytest.approx(stored['log_score'])} for address, stored in merged.items()}
+
+
+def test_add_thread_counts_messages_and_replies():
+    contacts = aggregate(THREAD).contacts
+    alice = contacts['alice@x.com']
+    assert alice.name == 'Alice'
+    assert (alice.sent_count, alice.received_count, alice.thread_count) == (1, 2, 1)
+    assert (alice.last_sent_at, alice.last_received_at) == (T0 + HOUR, T0 + 3 * HOUR)
+    assert (alice.my_reply_count, alice.my_reply_ms) == (1, HOUR)
+    assert (alice.their_reply_count, alice.their_reply_ms) == (1, 2 * HOUR)
+    assert set(contacts) == {'alice@x.com', 'bob@x.com'} # Never the user
+    assert (contacts['bob@x.com'].received_count, contacts['bob@x.com'].thread_count) == (0, 1)
+
+
+@pytest.mark.parametrize('new_ids', [{'m3'}, {'m1'}, {'m1', 'm3'}, {'m2', 'm3'}])
+def test_add_thread_new_messages_add_up_to_a_rebuild(new_ids):
+    counted_before = [message for message in THREAD if message['id'] not in new_ids]
+    assert totals(aggregate(counted_before), aggregate(THREAD, new_ids)) == totals(aggregate(THREAD))
+
+
+def test_add_thread_skips_undated_spam_and_drafts():
+    rows = THREAD + [
+        row('s1', T0 + 4 * HOUR, 'spammer@x.com', USER, labels=('SPAM',)),
+        row('d1', T0 + 4 * HOUR, USER, 'alice@x.com', labels=('DRAFT',)),
+        row('u1', None, 'carol@x.com', USER),
+    ]
+    assert totals(aggregate(rows)) == totals(aggregate(THREAD))
+
+
+def test_add_thread_edges_skip_big_lists():
+    small = aggregate([row('m1', T0, USER, 'carol@x.com, dave@x.com', labels=('SENT',), cc='erin@x.com')])
+    assert small.edges == {('carol@x.com', 'dave@x.com'): [1, T0], ('carol@x.com', 'erin@x.com'): [1, T0],
+                           ('dave@x.com', 'erin@x.com'): [1, T0]}
+    everyone = ', '.join(f'p{n}@x.com' for n in range(CONTACT_EDGE_MAX_PARTICIPANTS + 1))
+    big = aggregate([row('m1', T0, USER, everyone, labels=('SENT',))])
+    assert big.edges == {}
+    assert big.contacts['p0@x.com'].sent_count == 1
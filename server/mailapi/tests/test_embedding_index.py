@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from server.mailapi import embedding_index as embedding_module
+from server.mailapi.embedding_index import EmbeddingIndex, HashingEmbedder
+
+USER = 'me@x.com'
+
+
+def message(message_id, thread_id, text):
+    return {'id': message_id, 'thread_id': thread_id, 'subject': text, 'from_addr': 'a@x.com', 'snippet': text, 'body_text': None}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return EmbeddingIndex(str(tmp_path), HashingEmbedder(64))
+
+
+def update(index, messages, deleted_ids=()):
+    asyncio.run(index.update(USER, messages, deleted_ids))
+    return index._load(USER)
+
+
+def test_deleted_rows_are_reused(index):
+    loaded = update(index, [message('m1', 't1', 'budget review'), message('m2', 't1', 'budget numbers'),
+                            message('m3', 't2', 'team offsite')])
+    assert len(loaded.items) == 5 # Three messages, two threads
+    freed = {loaded.rows[('message', 'm3')], loaded.rows[('thread', 't2')]}
+    vectors_size = os.path.getsize(os.path.join(loaded.directory, 'vectors.f32'))
+
+    loaded = update(index, [], ['m3'])
+    assert ('message', 'm3') not in loaded.rows and ('thread', 't2') not in loaded.rows
+    assert [loaded.items[row] for row in freed] == [[None, None, None, None]] * 2
+
+    loaded = update(index, [message('m4', 't3', 'holiday plans')])
+    assert len(loaded.items) == 5
+    assert {loaded.rows[('message', 'm4')], loaded.rows[('thread', 't3')]} == freed
+    assert os.path.getsize(os.path.join(loaded.directory, 'vectors.f32')) == vectors_size
+
+
+def test_thread_vector_follows_its_messages(index):
+    loaded = update(index, [message('m1', 't1', 'budget review'), message('m2', 't1', 'offsite plans')])
+    mean = loaded.vector('message', 'm1') + loaded.vector('message', 'm2')
+    np.testing.assert_allclose(loaded.vector('thread', 't1'), mean / np.linalg.norm(mean), atol=1e-6)
+
+    loaded = update(index, [message('m2', 't1', 'holiday party')])
+    mean = loaded.vector('message', 'm1') + loaded.vector('message', 'm2')
+    np.testing.assert_allclose(loaded.vector('thread', 't1'), mean / np.linalg.norm(mean), atol=1e-6)
+
+    loaded = update(index, [], ['m2'])
+    np.testing.assert_allclose(loaded.vector('thread', 't1'), loaded.vector('message', 'm1'), atol=1e-6)
+
+    loaded = update(index, [], ['m1'])
+    assert loaded.vector('thread', 't1') is None
+
+
+@pytest.mark.parametrize('block_rows', [65536, 2])
+def test_top_k_filters_kind_and_excluded_ids(index, monkeypatch, block_rows):
+    monkeypatch.setattr(embedding_module, 'SEARCH_BLOCK_ROWS', block_rows)
+    update(index, [message('m1', 't1', 'quarterly budget report'), message('m2', 't2', 'budget report draft'),
+                   message('m3', 't3', 'budget'), message('m4', 't4', 'team offsite in march')])
+
+    messages = asyncio.run(index.search(USER, 'quarterly budget report', 'message', 10))
+    assert [message_id for message_id, _ in messages][:3] == ['m1', 'm2', 'm3']
+    assert {message_id for message_id, _ in messages} == {'m1', 'm2', 'm3', 'm4'}
+    threads = asyncio.run(index.search(USER, 'quarterly budget report', 'thread', 2))
+    assert [thread_id for thread_id, _ in threads] == ['t1', 't2']
+
+    related = asyncio.run(index.related_threads(USER, 't1', 2))
+    assert [thread_id for thread_id, _ in related] == ['t2', 't3'] # Still k results once t1 is left out
+    loaded = index._load(USER)
+    assert [item_id for item_id, _ in loaded.top_k(loaded.vector('message', 'm1'), 'message', 2, {'m1', 'm2'})] == ['m3', 'm4']
+    assert asyncio.run(index.related_threads(USER, 'nope', 2)) is None
+
+
+def test_unchanged_text_is_not_reembedded(index):
+    messages = [message('m1', 't1', 'budget review'), message('m2', 't1', 'offsite plans')]
+    update(index, messages)
+    assert index.stats['embedded'] == 2
+    meta_mtime = index._load(USER).meta_mtime
+
+    update(index, messages)
+    assert (index.stats['embedded'], index.stats['unchanged']) == (2, 2)
+    assert index._load(USER).meta_mtime == meta_mtime # Nothing to write either
+
+    update(index, [messages[0], message('m2', 't1', 'offsite moved to april')])
+    assert (index.stats['embedded'], index.stats['unchanged']) == (3, 3)
@@ -0,0 +1,32 @@
+import base64
+import json
+
+import pytest
+
+from server.mailapi.gmail_push import decode_push_envelope
+
+
+def envelope(data):
+    return {'message': {'data': base64.b64encode(data.encode()).decode(), 'messageId': '1'}, 'subscription': 'projects/p/subscriptions/s'}
+
+
+@pytest.mark.parametrize('history_id', [12345, '12345'])
+def test_decode_push_envelope(history_id):
+    data = json.dumps({'emailAddress': 'me@x.com', 'historyId': history_id})
+    assert decode_push_envelope(envelope(data)) == ('me@x.com', 12345)
+
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'message': {}},
+    {'message': {'data': None}},
+    {'message': 'nope'},
+    envelope('not json'),
+    envelope(json.dumps({'historyId': 1})),
+    envelope(json.dumps({'emailAddress': 'me@x.com'})),
+    envelope(json.dumps({'emailAddress': 'me@x.com', 'historyId': 'abc'})),
+    envelope(json.dumps(['me@x.com', 1])),
+])
+def test_decode_push_envelope_malformed(body):
+    with pytest.raises(ValueError):
+        decode_push_envelope(body)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from server.mailapi.thread_ranking import _COLUMN, _FEATURES, IMPORTANCE_AFFINITY_CAP, _ThreadFeatures, feature_matrix
+
+USER = 'me@x.com'
+HOUR = 3600000
+T0 = 1700000000000
+
+
+def row(message_id, at, frm, to, labels=('INBOX',)):
+    return {'id': message_id, 'internal_date': at, 'label_ids': list(labels), 'from_addr': frm, 'to_addr': to, 'cc_addr': None}
+
+
+def features(*rows, sent_counts=None):
+    matrix, owes_reply = feature_matrix([_ThreadFeatures(USER, 't1', list(rows))], sent_counts or {})
+    assert matrix.shape == (1, len(_FEATURES))
+    return {feature: matrix[0, column] for feature, column in _COLUMN.items()}, bool(owes_reply[0])
+
+
+def test_reply_owed_in_a_conversation():
+    row_features, owes_reply = features(
+        row('m1', T0, USER, 'alice@x.com', labels=('SENT',)),
+        row('m2', T0 + HOUR, 'Alice <alice@x.com>', USER, labels=('INBOX', 'UNREAD', 'STARRED')),
+        sent_counts={'alice@x.com': 4},
+    )
+    assert owes_reply and row_features['owes_reply'] == 1
+    assert row_features['affinity'] == pytest.approx(np.log1p(4))
+    assert row_features['length'] == pytest.approx(np.log1p(2))
+    assert (row_features['unread'], row_features['starred'], row_features['inbox'], row_features['important']) == (1, 1, 1, 0)
+    assert (row_features['automated'], row_features['category'], row_features['draft']) == (0, 0, 0)
+
+
+def test_first_contact_owes_nothing_until_i_have_written():
+    _, owes_reply = features(row('m1', T0, 'stranger@x.com', USER))
+    assert not owes_reply
+    _, owes_reply = features(row('m1', T0, 'stranger@x.com', USER), sent_counts={'stranger@x.com': 1})
+    assert owes_reply
+
+
+@pytest.mark.parametrize('rows', [
+    [row('m1', T0, 'alice@x.com', USER), row('m2', T0 + HOUR, USER, 'alice@x.com', labels=('SENT',))], # I had the last word
+    [row('m1', T0, USER, 'alice@x.com', labels=('SENT',)), row('m2', T0 + HOUR, 'alice@x.com', USER, labels=('SPAM',))],
+    [row('m1', T0, USER, 'alice@x.com', labels=('SENT',)), row('m2', T0 + HOUR, 'alice@x.com', USER, labels=('CATEGORY_UPDATES',))],
+    [row('m1', T0, USER, 'noreply@x.com', labels=('SENT',)), row('m2', T0 + HOUR, 'noreply@x.com', USER)],
+])
+def test_no_reply_owed(rows):
+    _, owes_reply = features(*rows, sent_counts={'alice@x.com': 3, 'noreply@x.com': 3})
+    assert not owes_reply
+
+
+def test_automated_and_category_senders():
+    row_features, _ = features(row('m1', T0, 'Shop <no-reply+deals@shop.com>', USER, labels=('INBOX', 'CATEGORY_PROMOTIONS')))
+    assert (row_features['automated'], row_features['category']) == (1, 1)
+    row_features, _ = features(row('m1', T0, 'replies@shop.com', USER))
+    assert (row_features['automated'], row_features['category']) == (0, 0)
+
+
+def test_latest_message_ignores_drafts_and_caps_affinity():
+    row_features, owes_reply = features(
+        row('m1', T0, USER, 'alice@x.com', labels=('SENT',)),
+        row('m2', T0 + HOUR, 'alice@x.com', USER),
+        row('m3', T0 + 2 * HOUR, USER, 'alice@x.com', labels=('DRAFT',)), # Not sent yet: Alice still has the last word
+        sent_counts={'alice@x.com': 1000},
+    )
+    assert owes_reply and row_features['draft'] == 1
+    assert row_features['affinity'] == pytest.approx(np.log1p(IMPORTANCE_AFFINITY_CAP))
+
+
+def test_one_row_per_thread():
+    threads = [_ThreadFeatures(USER, f't{n}', [row(f'm{n}', T0 + n, f'p{n}@x.com', USER)]) for n in range(3)]
+    matrix, owes_reply = feature_matrix(threads, {'p1@x.com': 2})
+    assert matrix.shape == (3, len(_FEATURES)) and owes_reply.tolist() == [False, True, False]
+    assert feature_matrix([], {})[0].shape == (0, len(_FEATURES))
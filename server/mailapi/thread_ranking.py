@@ -0,0 +1,194 @@
+import os
+import re
+from email.utils import getaddresses
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database_models.models import GmailContact, GmailMessage, GmailThread
+
+from . import mail_store
+from .contacts import SCORE_EPOCH_MS, contact_index
+from .gmail_sync import MailboxDelta, gmail_sync_engine
+
+# "What needs me": an importance score per thread for the dashboard's order=importance listing.
+# Features come from stored metadata only (labels, headers, the contact index). A chunk of
+# threads is scored as one matrix product, and only threads whose rows changed get rescored:
+# mail_store.refresh_threads() clears the score of every thread it recomputes, whoever the
+# writer (sync, backfill, bulk actions and their undo), and the scores are filled back in
+# after each sync and before each importance read. A page is then an index scan.
+#
+# Age costs a thread a fixed amount per day since its latest message. What's stored is the
+# score at SCORE_EPOCH_MS plus the age penalty the thread hasn't paid yet; every thread pays
+# the same per day from here on, so ordering by the stored value is ordering by today's score.
+#
+# Sender affinity comes from the contact index, so scoring starts once that is built (on the
+# first ranked read). It is read when a thread is scored: it moves with the thread's own
+# changes rather than every time the contact index does.
+
+IMPORTANCE_AGE_PER_DAY = float(os.getenv("IMPORTANCE_AGE_PER_DAY", "0.2")) # Score a thread loses per day without new mail
+IMPORTANCE_AFFINITY_CAP = 30 # Sent messages past this don't make someone more important
+IMPORTANCE_SCORE_CHUNK = 1000
+
+FEATURE_WEIGHTS = {
+    'affinity': 1.0, # log1p(messages I've sent the people on the latest message)
+    'owes_reply': 3.0,
+    'draft': 1.5, # A half-written reply is waiting on me
+    'starred': 2.0,
+    'important': 1.0,
+    'unread': 0.5,
+    'inbox': 0.5,
+    'length': 0.5, # log1p(message count): back-and-forth
+    'category': -1.5, # Promotions, social, updates, forums
+    'automated': -1.5, # noreply@ and friends
+}
+_FEATURES = list(FEATURE_WEIGHTS)
+_WEIGHTS = np.array([FEATURE_WEIGHTS[feature] for feature in _FEATURES])
+_COLUMN = {feature: index for index, feature in enumerate(_FEATURES)}
+
+DAY_MS = 86400000
+CATEGORY_LABELS = ('CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL', 'CATEGORY_UPDATES', 'CATEGORY_FORUMS')
+_AUTOMATED_SENDER = re.compile(
+    r'^(no-?reply|do-?not-?reply|notifications?|notify|alerts?|mailer-daemon|postmaster|bounces?|newsletters?|news|updates|marketing)([+._-][^@]*)?@'
+)
+
+_MESSAGE_COLUMNS = (GmailMessage.id, GmailMessage.thread_id, GmailMessage.internal_date, GmailMessage.label_ids,
+                    GmailMessage.from_addr, GmailMessage.to_addr, GmailMessage.cc_addr)
+
+
+def _addresses(*headers: Optional[str]) -> List[str]:
+    return [address.strip().lower() for _, address in getaddresses([header for header in headers if header]) if '@' in address]
+
+
+class _ThreadFeatures:
+    """Raw features of one thread; turned into a matrix row once its contacts are looked up."""
+    __slots__ = ('id', 'latest_at', 'labels', 'message_count', 'draft', 'sender', 'counterparts', 'latest_sent', 'ever_sent')
+
+    def __init__(self, user_email: str, thread_id: str, rows: List[dict]):
+        rows = sorted(rows, key=lambda row: (row['internal_date'] or 0, row['id']))
+        self.id = thread_id
+        self.labels: Set[str] = {label for row in rows for label in (row['label_ids'] or [])}
+        self.message_count = len(rows)
+        self.draft = 'DRAFT' in self.labels
+        mail = [row for row in rows if 'DRAFT' not in (row['label_ids'] or [])] or rows
+        latest = mail[-1]
+        self.latest_at = latest['internal_date']
+
+        def sent(row: dict) -> bool:
+            return 'SENT' in (row['label_ids'] or []) or user_email in _addresses(row['from_addr'])
+
+        senders = [address for address in _addresses(latest['from_addr']) if address != user_email]
+        self.sender = senders[0] if senders else None
+        self.latest_sent = sent(latest)
+        self.ever_sent = any(sent(row) for row in mail)
+        self.counterparts = set(senders + _addresses(latest['to_addr'], latest['cc_addr'])) - {user_email}
+
+
+async def _thread_features(db: AsyncSession, user_email: str, thread_ids: List[str]) -> List[_ThreadFeatures]:
+    result = await db.execute(
+        select(*_MESSAGE_COLUMNS).where(GmailMessage.user_email == user_email, GmailMessage.thread_id.in_(thread_ids))
+    )
+    rows_by_thread: Dict[str, List[dict]] = {}
+    for row in result.all():
+        rows_by_thread.setdefault(row.thread_id, []).append(dict(row._mapping))
+    user_email = user_email.lower()
+    return [_ThreadFeatures(user_email, thread_id, rows) for thread_id, rows in rows_by_thread.items()]
+
+
+async def _sent_counts(db: AsyncSession, user_email: str, addresses: Set[str]) -> Dict[str, int]:
+    if not addresses:
+        return {}
+    result = await db.execute(
+        select(GmailContact.address, GmailContact.sent_count)
+        .where(GmailContact.user_email == user_email, GmailContact.address.in_(list(addresses)), GmailContact.sent_count > 0)
+    )
+    return {address: sent_count for address, sent_count in result.all()}
+
+
+def feature_matrix(threads: List[_ThreadFeatures], sent_counts: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """(features, owes_reply) for the threads, one row each, columns in FEATURE_WEIGHTS order."""
+    matrix = np.zeros((len(threads), len(_FEATURES)))
+    for row, thread in enumerate(threads):
+        labels = thread.labels
+        matrix[row, _COLUMN['affinity']] = max((sent_counts.get(address, 0) for address in thread.counterparts), default=0)
+        matrix[row, _COLUMN['automated']] = not thread.latest_sent and bool(thread.sender and _AUTOMATED_SENDER.match(thread.sender))
+        matrix[row, _COLUMN['category']] = any(label in labels for label in CATEGORY_LABELS)
+        matrix[row, _COLUMN['draft']] = thread.draft
+        matrix[row, _COLUMN['starred']] = 'STARRED' in labels
+        matrix[row, _COLUMN['important']] = 'IMPORTANT' in labels
+        matrix[row, _COLUMN['unread']] = 'UNREAD' in labels
+        matrix[row, _COLUMN['inbox']] = 'INBOX' in labels
+        matrix[row, _COLUMN['length']] = thread.message_count
+        # Someone else had the last word, and it's a conversation: I've written in it, or to them before
+        matrix[row, _COLUMN['owes_reply']] = (
+            thread.sender is not None and not thread.latest_sent
+            and (thread.ever_sent or sent_counts.get(thread.sender, 0) > 0)
+            and not any(label in labels for label in ('SPAM', 'TRASH'))
+        )
+    owes_reply = matrix[:, _COLUMN['owes_reply']] * (1 - matrix[:, _COLUMN['automated']]) * (1 - matrix[:, _COLUMN['category']])
+    matrix[:, _COLUMN['owes_reply']] = owes_reply
+    matrix[:, _COLUMN['affinity']] = np.log1p(np.minimum(matrix[:, _COLUMN['affinity']], IMPORTANCE_AFFINITY_CAP))
+    matrix[:, _COLUMN['length']] = np.log1p(matrix[:, _COLUMN['length']])
+    return matrix, owes_reply > 0
+
+
+def stored_importance(matrix: np.ndarray, latest_at: np.ndarray) -> np.ndarray:
+    """What gets stored: the weighted features plus the age penalty the threads haven't paid yet."""
+    return matrix @ _WEIGHTS + IMPORTANCE_AGE_PER_DAY * (latest_at - SCORE_EPOCH_MS) / DAY_MS
+
+
+class ThreadRanker:
+    def __init__(self):
+        self.stats = {"threads_scored": 0}
+
+    async def score_threads(self, db: AsyncSession, user_email: str, thread_ids: List[str]) -> int:
+        """Rescores the given stored threads (one chunk's worth). Does not commit."""
+        threads = await _thread_features(db, user_email, thread_ids)
+        if not threads:
+            return 0
+        counterparts = {address for thread in threads for address in thread.counterparts}
+        matrix, owes_reply = feature_matrix(threads, await _sent_counts(db, user_email, counterparts))
+        latest_at = np.array([thread.latest_at or SCORE_EPOCH_MS for thread in threads], dtype=np.float64)
+        importance = stored_importance(matrix, latest_at)
+        await db.execute(update(GmailThread), [
+            {'user_email': user_email, 'id': thread.id, 'importance': float(score), 'owes_reply': bool(owes)}
+            for thread, score, owes in zip(threads, importance, owes_reply)
+        ])
+        self.stats["threads_scored"] += len(threads)
+        return len(threads)
+
+    async def score_pending(self, db: AsyncSession, user_email: str) -> int:
+        """Scores every thread whose row changed since it was last scored. Does not commit."""
+        scored = 0
+        while True:
+            result = await db.execute(
+                select(GmailThread.id)
+                .where(GmailThread.user_email == user_email, GmailThread.importance.is_(None))
+                .limit(IMPORTANCE_SCORE_CHUNK)
+            )
+            thread_ids = list(result.scalars().all())
+            if not thread_ids:
+                return scored
+            count = await self.score_threads(db, user_email, thread_ids)
+            if count == 0:
+                return scored # Rows without messages; refresh_threads drops those
+            scored += count
+
+    async def ensure(self, db: AsyncSession, user_email: str):
+        """Fills in scores a sync hasn't yet (first use, bulk actions since) before a ranked read."""
+        await contact_index.ensure(db, user_email)
+        if await self.score_pending(db, user_email):
+            await db.commit()
+
+    async def on_sync(self, db: AsyncSession, gmail_service, delta: MailboxDelta):
+        state = await mail_store.get_sync_state(db, delta.user_email)
+        if state is None or state.contacts_indexed_at is None:
+            return # Scored on the first ranked read, once there are contacts to weigh senders by
+        async with db.begin_nested(): # A failed write mustn't abort the sync's own transaction
+            await self.score_pending(db, delta.user_email)
+
+
+thread_ranker = ThreadRanker()
+gmail_sync_engine.add_listener(thread_ranker.on_sync) # After contact_index's, so affinity sees this sync's mail
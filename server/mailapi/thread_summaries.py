@@ -0,0 +1,323 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database_models.models import GmailMessage, GmailMessageSummary, GmailThreadSummary
+
+from . import mail_store, mime
+from .gmail_batch import gmail_batch_executor
+from .gmail_sync import fetch_message_metadata
+
+try:
+    from openai import AsyncOpenAI
+except ImportError: # Optional: without it there are no summaries
+    AsyncOpenAI = None
+
+# LLM summaries of Gmail threads, for the digest. Model calls are the slow and expensive part,
+# so the pipeline avoids them wherever it can:
+# - message text is normalized (quoted history, tracking links and whitespace dropped) and
+#   hashed; a summary is cached per content hash, so no text is ever summarized twice
+# - a thread keeps its rolled-up summary plus the message hashes it covers; an unchanged
+#   thread costs no call at all, and a thread with new replies only sends the new messages
+#   (and the summary so far) to the model
+# - short messages from many threads are packed into one call, and calls in flight are capped
+#   process-wide.
+
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4")) # Model calls in flight, per process
+SUMMARY_BATCH_MAX_ITEMS = int(os.getenv("SUMMARY_BATCH_MAX_ITEMS", "20"))
+SUMMARY_BATCH_MAX_CHARS = int(os.getenv("SUMMARY_BATCH_MAX_CHARS", "16000")) # Input packed into one call
+SUMMARY_MESSAGE_MAX_CHARS = int(os.getenv("SUMMARY_MESSAGE_MAX_CHARS", "4000")) # The start of a mail is what matters
+SUMMARY_MAX_THREADS = int(os.getenv("SUMMARY_MAX_THREADS", "50")) # Per request
+SUMMARY_PROMPT_VERSION = "1" # Part of every content hash; bump it when the prompts change
+
+MESSAGE_INSTRUCTIONS = (
+    "You summarize emails for a busy reader. For each email in the input JSON array, write one or two "
+    "plain sentences: who wants what, and any dates, amounts or decisions. Skip greetings and signatures. "
+    'Reply with a JSON object {"summaries": [{"id": ..., "summary": ...}]} with one entry per email, using its id.'
+)
+ROLLUP_INSTRUCTIONS = (
+    "You keep running summaries of email threads. Each item in the input JSON array is a thread with its "
+    "summary so far (empty for a new thread) and summaries of its new messages, oldest first. Write the "
+    "updated thread summary in at most three plain sentences: where things stand, open questions, and who "
+    'owes a reply. Reply with a JSON object {"summaries": [{"id": ..., "summary": ...}]} with one entry per thread, using its id.'
+)
+
+_WHITESPACE = re.compile(r'\s+')
+_INVISIBLE = re.compile('[\u00ad\u034f\u200b-\u200f\u2060\ufeff]') # Soft hyphens and zero-width padding from newsletters
+_QUOTED_HISTORY = re.compile(r'\bOn\b.{0,200}?\bwrote:|-{2,} ?[Oo]riginal [Mm]essage ?-{2,}|\bFrom: .{0,200}?\bSent: ')
+_URL = re.compile(r'https?://([^/\s?#]+)\S*')
+
+
+def normalize_text(text: str, max_chars: int = SUMMARY_MESSAGE_MAX_CHARS) -> str:
+    """Body text as the model sees it: no quoted history, links shortened to their host, whitespace collapsed."""
+    text = _WHITESPACE.sub(' ', _INVISIBLE.sub('', text)).strip()
+    quoted = _QUOTED_HISTORY.search(text)
+    if quoted and quoted.start() > 0: # Everything below "On ... wrote:" is already in the thread
+        text = text[:quoted.start()]
+    return _URL.sub(r'<\1>', text).strip()[:max_chars]
+
+
+def message_text(message: dict) -> str:
+    body = normalize_text(message.get('body_text') or message.get('snippet') or '')
+    return f"From: {message.get('from_addr') or ''}\nDate: {message.get('date_header') or ''}\nSubject: {message.get('subject') or ''}\n\n{body}"
+
+
+def content_hash(*parts: str) -> str:
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _message_row(message: GmailMessage) -> dict:
+    return {
+        'id': message.id, 'thread_id': message.thread_id, 'label_ids': message.label_ids or [],
+        'from_addr': message.from_addr, 'date_header': message.date_header, 'subject': message.subject,
+        'snippet': message.snippet, 'body_text': message.body_text,
+    }
+
+
+async def load_thread_messages(db: AsyncSession, gmail_service, user_email: str, thread_ids: List[str]) -> Dict[str, List[dict]]:
+    """Messages of each thread, oldest first, with body text. Threads that don't exist are left out.
+
+    Served from the store when the mailbox is synced; bodies the store lacks are fetched once and
+    kept (search uses them too). Threads the store doesn't have come from threads.get.
+    """
+    messages_by_thread: Dict[str, List[dict]] = {}
+    if await mail_store.is_mailbox_synced(db, user_email):
+        result = await db.execute(
+            select(GmailMessage)
+            .where(GmailMessage.user_email == user_email, GmailMessage.thread_id.in_(thread_ids))
+            .order_by(GmailMessage.internal_date.asc().nulls_first(), GmailMessage.id)
+        )
+        for message in result.scalars().all():
+            messages_by_thread.setdefault(message.thread_id, []).append(_message_row(message))
+        without_body = [message for messages in messages_by_thread.values() for message in messages if message['body_text'] is None]
+        if without_body:
+            fetched = await fetch_message_metadata(gmail_service, [message['id'] for message in without_body], with_body_text=True)
+            body_texts = {message['id']: message['body_text'] for message in fetched}
+            for message in without_body:
+                message['body_text'] = body_texts.get(message['id'])
+            await mail_store.set_body_texts(db, user_email, body_texts)
+
+    missing_ids = [thread_id for thread_id in thread_ids if thread_id not in messages_by_thread]
+    if missing_ids:
+        responses = await gmail_batch_executor.execute([
+            (thread_id, gmail_service.users().threads().get(userId='me', id=thread_id, format='full'))
+            for thread_id in missing_ids
+        ])
+        for thread_id, (response, exception) in responses.items():
+            if exception is not None:
+                if isinstance(exception, HttpError) and exception.resp.status == 404:
+                    continue
+                raise exception
+            messages = []
+            for message in response.get('messages', []): # Oldest first
+                record = mail_store.message_record(user_email, message)
+                record['body_text'] = mime.body_text(mime.extract_parts(message.get('payload', {})))
+                messages.append(record)
+            messages_by_thread[thread_id] = messages
+    return messages_by_thread
+
+
+def _pack(items: List[dict]) -> List[List[dict]]:
+    """Splits items into consecutive batches of at most SUMMARY_BATCH_MAX_ITEMS items / SUMMARY_BATCH_MAX_CHARS chars."""
+    batches: List[List[dict]] = []
+    size = 0
+    for item in items:
+        item_size = len(json.dumps(item, ensure_ascii=False))
+        if not batches or len(batches[-1]) >= SUMMARY_BATCH_MAX_ITEMS or size + item_size > SUMMARY_BATCH_MAX_CHARS:
+            batches.append([])
+            size = 0
+        batches[-1].append(item)
+        size += item_size
+    return batches
+
+
+class ThreadSummary(BaseModel):
+    thread_id: str
+    summary: str
+    message_count: int # Messages covered; drafts aren't summarized
+    cached: bool # Nothing changed since the last summary, so no model call was made
+
+
+class ThreadSummariesResult(BaseModel):
+    summaries: List[ThreadSummary]
+    failed: Dict[str, str] = {} # thread_id -> why it has no summary
+
+
+class ThreadSummarizer:
+    def __init__(self, model: str, concurrency: int):
+        self.model = model
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = None
+        self.stats = {"model_calls": 0, "failed_calls": 0, "messages_summarized": 0, "message_hits": 0,
+                      "threads_rolled_up": 0, "thread_hits": 0, "input_tokens": 0, "output_tokens": 0}
+
+    @property
+    def configured(self) -> bool:
+        return AsyncOpenAI is not None and bool(os.getenv("OPENAI_API_KEY"))
+
+    def _openai(self):
+        if self._client is None:
+            self._client = AsyncOpenAI() # Reads OPENAI_API_KEY
+        return self._client
+
+    async def _complete(self, instructions: str, items: List[dict]) -> Dict[str, str]:
+        """One model call over a batch of {'id', ...} items; returns the summary per id (ids it dropped are left out)."""
+        async with self._semaphore:
+            response = await self._openai().responses.create(
+                model=self.model,
+                instructions=instructions,
+                input=json.dumps(items, ensure_ascii=False),
+                text={"format": {"type": "json_object"}},
+            )
+        self.stats["model_calls"] += 1
+        if response.usage is not None:
+            self.stats["input_tokens"] += response.usage.input_tokens
+            self.stats["output_tokens"] += response.usage.output_tokens
+        entries = json.loads(response.output_text).get('summaries', [])
+        return {
+            str(entry['id']): entry['summary'].strip() for entry in entries
+            if isinstance(entry, dict) and 'id' in entry and isinstance(entry.get('summary'), str) and entry['summary'].strip()
+        }
+
+    async def _complete_batched(self, instructions: str, items: List[dict]) -> Dict[str, str]:
+        """Packs items into batches and runs them concurrently (capped); a failed batch just leaves its ids out."""
+        results: Dict[str, str] = {}
+        batches = _pack(items)
+        for batch, outcome in zip(batches, await asyncio.gather(
+            *(self._complete(instructions, batch) for batch in batches), return_exceptions=True
+        )):
+            if isinstance(outcome, Exception):
+                self.stats["failed_calls"] += 1
+                print(f"Summary model call failed for a batch of {len(batch)}: {outcome}")
+                continue
+            results.update(outcome)
+        return results
+
+    async def _message_summaries(self, db: AsyncSession, user_email: str, texts: Dict[str, str]) -> Dict[str, str]:
+        """Summary per content hash for `texts` ({content_hash: text}): cached ones, then one batched pass over the rest."""
+        if not texts:
+            return {}
+        result = await db.execute(
+            select(GmailMessageSummary.content_hash, GmailMessageSummary.summary).where(
+                GmailMessageSummary.user_email == user_email, GmailMessageSummary.content_hash.in_(list(texts))
+            )
+        )
+        summaries = dict(result.all())
+        self.stats["message_hits"] += len(summaries)
+
+        missing = [content_hash for content_hash in texts if content_hash not in summaries]
+        if missing:
+            # Short positional ids keep the prompt small; hashes would cost tokens for nothing
+            produced = await self._complete_batched(
+                MESSAGE_INSTRUCTIONS, [{'id': str(index), 'email': texts[content_hash]} for index, content_hash in enumerate(missing)]
+            )
+            new_summaries = {content_hash: produced[str(index)] for index, content_hash in enumerate(missing) if str(index) in produced}
+            if new_summaries:
+                await db.execute(pg_insert(GmailMessageSummary).values([
+                    {'user_email': user_email, 'content_hash': content_hash, 'summary': summary, 'model': self.model}
+                    for content_hash, summary in new_summaries.items()
+                ]).on_conflict_do_nothing())
+                await db.commit() # Paid for; keep them even if the roll-up fails
+            self.stats["messages_summarized"] += len(new_summaries)
+            summaries.update(new_summaries)
+        return summaries
+
+    async def summarize(self, db: AsyncSession, gmail_service, user_email: str, thread_ids: List[str]) -> ThreadSummariesResult:
+        """Summaries of the given threads, making model calls only for content not summarized before."""
+        messages_by_thread = await load_thread_messages(db, gmail_service, user_email, thread_ids)
+        failed: Dict[str, str] = {thread_id: "Thread not found." for thread_id in thread_ids if thread_id not in messages_by_thread}
+
+        # (message, content hash, normalized text) per thread, oldest first
+        contents: Dict[str, List[Tuple[dict, str, str]]] = {}
+        for thread_id, messages in messages_by_thread.items():
+            entries = []
+            for message in messages:
+                if 'DRAFT' in message['label_ids']:
+                    continue # Still being written; it would change the thread's hash on every keystroke-save
+                text = message_text(message)
+                entries.append((message, content_hash(SUMMARY_PROMPT_VERSION, self.model, text), text))
+            if entries:
+                contents[thread_id] = entries
+            else:
+                failed[thread_id] = "Thread has no messages to summarize."
+
+        result = await db.execute(
+            select(GmailThreadSummary).where(GmailThreadSummary.user_email == user_email, GmailThreadSummary.thread_id.in_(list(contents)))
+        )
+        stored = {row.thread_id: row for row in result.scalars().all()}
+
+        summaries: Dict[str, ThreadSummary] = {}
+        pending: Dict[str, Tuple[Optional[str], List[Tuple[dict, str, str]]]] = {} # thread_id -> (summary so far, new messages)
+        for thread_id, entries in contents.items():
+            hashes = [[message['id'], message_hash] for message, message_hash, _ in entries]
+            row = stored.get(thread_id)
+            if row is not None and row.content_hash == content_hash(*(message_hash for _, message_hash in hashes)):
+                summaries[thread_id] = ThreadSummary(thread_id=thread_id, summary=row.summary, message_count=len(entries), cached=True)
+                self.stats["thread_hits"] += 1
+            elif row is not None and len(row.message_hashes) < len(hashes) and row.message_hashes == hashes[:len(row.message_hashes)]:
+                pending[thread_id] = (row.summary, entries[len(row.message_hashes):]) # Only replies since then
+            else:
+                pending[thread_id] = (None, entries) # New, or messages were deleted or changed: roll up from scratch
+
+        message_summaries = await self._message_summaries(db, user_email, {
+            message_hash: text for _, entries in pending.values() for _, message_hash, text in entries
+        })
+
+        rolled: Dict[str, str] = {}
+        rollups = []
+        for thread_id, (previous, entries) in pending.items():
+            if any(message_hash not in message_summaries for _, message_hash, _ in entries):
+                failed[thread_id] = "Summarizing failed; try again later."
+            elif previous is None and len(entries) == 1:
+                rolled[thread_id] = message_summaries[entries[0][1]] # A one-message thread is summarized by its message
+            else:
+                rollups.append((thread_id, {
+                    'id': str(len(rollups)),
+                    'summary_so_far': previous or '',
+                    'new_messages': [
+                        {'from': message.get('from_addr') or '', 'summary': message_summaries[message_hash]}
+                        for message, message_hash, _ in entries
+                    ],
+                }))
+        if rollups:
+            produced = await self._complete_batched(ROLLUP_INSTRUCTIONS, [item for _, item in rollups])
+            for thread_id, item in rollups:
+                if item['id'] in produced:
+                    rolled[thread_id] = produced[item['id']]
+                    self.stats["threads_rolled_up"] += 1
+                else:
+                    failed[thread_id] = "Summarizing failed; try again later."
+
+        if rolled:
+            rows = []
+            for thread_id, summary in rolled.items():
+                hashes = [[message['id'], message_hash] for message, message_hash, _ in contents[thread_id]]
+                rows.append({
+                    'user_email': user_email, 'thread_id': thread_id, 'summary': summary, 'model': self.model,
+                    'content_hash': content_hash(*(message_hash for _, message_hash in hashes)), 'message_hashes': hashes,
+                })
+                summaries[thread_id] = ThreadSummary(thread_id=thread_id, summary=summary, message_count=len(hashes), cached=False)
+            statement = pg_insert(GmailThreadSummary).values(rows)
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=[GmailThreadSummary.user_email, GmailThreadSummary.thread_id],
+                set_={column: statement.excluded[column] for column in ('summary', 'model', 'content_hash', 'message_hashes', 'updated_at')},
+            ))
+        await db.commit()
+
+        return ThreadSummariesResult(
+            summaries=[summaries[thread_id] for thread_id in dict.fromkeys(thread_ids) if thread_id in summaries],
+            failed=failed,
+        )
+
+
+thread_summarizer = ThreadSummarizer(model=SUMMARY_MODEL, concurrency=SUMMARY_CONCURRENCY)
@@ -0,0 +1,218 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+import google.auth.exceptions
+import google.auth.transport.requests
+import google.oauth2.credentials
+from sqlalchemy.future import select
+
+from shared.database_config.database import AsyncSessionLocal
+from shared.database_models.models import UserGoogleToken
+
+from .cache import credentials_cache
+
+# How often the background scheduler looks for tokens to renew, and how far ahead of expiry it renews them
+TOKEN_RENEWAL_INTERVAL_SECONDS = float(os.getenv("TOKEN_RENEWAL_INTERVAL_SECONDS", "60"))
+TOKEN_RENEW_AHEAD_SECONDS = float(os.getenv("TOKEN_RENEW_AHEAD_SECONDS", "600"))  # 10 minutes
+
+
+def credentials_to_dict(credentials):
+    return {
+        'token': credentials.token,
+        'refresh_token': credentials.refresh_token,
+        'token_uri': credentials.token_uri,
+        'client_id': credentials.client_id,
+        'client_secret': credentials.client_secret,
+        'scopes': credentials.scopes,
+        'expiry': credentials.expiry, # Naive UTC datetime, None if unknown
+    }
+
+
+def credentials_from_token_entry(db_token_entry: UserGoogleToken) -> google.oauth2.credentials.Credentials:
+    # Construct credentials specifically for Google, excluding user_email
+    return google.oauth2.credentials.Credentials(
+        token=db_token_entry.token,
+        refresh_token=db_token_entry.refresh_token,
+        token_uri=db_token_entry.token_uri,
+        client_id=db_token_entry.client_id,
+        client_secret=db_token_entry.client_secret,
+        scopes=db_token_entry.scopes,
+        expiry=db_token_entry.expiry,
+    )
+
+
+def _needs_refresh(credentials: google.oauth2.credentials.Credentials, margin_seconds: float) -> bool:
+    if credentials.expiry is None:
+        # Rows written before expiry was stored: refresh once so we learn the expiry
+        return bool(credentials.refresh_token)
+    return credentials.expiry - timedelta(seconds=margin_seconds) <= datetime.utcnow()
+
+
+class TokenRefresher:
+    """Coalesces Google token refreshes so each user has at most one in flight.
+
+    The blocking `credentials.refresh()` call runs on the threadpool, and the token
+    row is locked (SELECT ... FOR UPDATE) while refreshing so that other workers
+    pick up the new token instead of refreshing it again.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, Tuple[asyncio.Task, bool]] = {} # user -> (refresh task, forced)
+
+    async def refresh(self, user_email: str, force: bool = False) -> google.oauth2.credentials.Credentials:
+        """Refreshes the user's token, joining any refresh that is already running.
+
+        A forced refresh (Google just rejected the token) only joins another forced one: a plain
+        refresh may hand back the very token that was rejected, so it waits for that to finish
+        and then starts its own.
+        """
+        while True:
+            inflight = self._inflight.get(user_email)
+            if inflight is None or inflight[0].done():
+                task = asyncio.create_task(self._refresh(user_email, force))
+                self._inflight[user_email] = (task, force)
+                task.add_done_callback(lambda done: self._forget(user_email, done))
+                break
+            task, forced = inflight
+            if forced or not force:
+                break
+            await asyncio.wait([task]) # Its result (or error) isn't ours to use
+        # shield: a cancelled request must not cancel the refresh other requests are waiting on
+        return await asyncio.shield(task)
+
+    def _forget(self, user_email: str, task: asyncio.Task):
+        if self._inflight.get(user_email, (None, False))[0] is task:
+            del self._inflight[user_email]
+
+    async def _refresh(self, user_email: str, force: bool) -> google.oauth2.credentials.Credentials:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(UserGoogleToken).where(UserGoogleToken.user_email == user_email).with_for_update()
+            )
+            db_token_entry = result.scalar_one_or_none()
+            if not db_token_entry:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User Google tokens not found in DB. Please re-authenticate.")
+            if not db_token_entry.refresh_token:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication session expired, and no refresh token available. Please re-authenticate.")
+
+            credentials = credentials_from_token_entry(db_token_entry)
+            if not force and not _needs_refresh(credentials, TOKEN_RENEW_AHEAD_SECONDS):
+                # Another worker refreshed it while we were waiting for the row lock
+                await db.commit()
+                credentials_cache.set(user_email, credentials)
+                return credentials
+
+            print(f"Refreshing Google token for {user_email}...")
+            request_object = google.auth.transport.requests.Request()
+            await run_in_threadpool(credentials.refresh, request_object)
+
+            for key, value in credentials_to_dict(credentials).items():
+                setattr(db_token_entry, key, value)
+            await db.commit()
+            credentials_cache.set(user_email, credentials)
+            print(f"Successfully refreshed Google token for {user_email} in DB (expires {credentials.expiry})")
+            return credentials
+
+    async def get_credentials(self, user_email: str) -> google.oauth2.credentials.Credentials:
+        """Returns valid credentials for the user: cache first, then DB, refreshing if needed."""
+        # Fast path: skip the DB round trip while the cached token is not close to expiring
+        cached_credentials = credentials_cache.get(user_email)
+        if cached_credentials is not None:
+            return cached_credentials
+
+        async with AsyncSessionLocal() as db:
+            db_token_entry = await db.get(UserGoogleToken, user_email)
+        if not db_token_entry:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User Google tokens not found in DB. Please re-authenticate."
+            )
+        credentials = credentials_from_token_entry(db_token_entry)
+
+        if _needs_refresh(credentials, credentials_cache.refresh_margin_seconds):
+            if not credentials.refresh_token:
+                print(f"Google token expired for {user_email}, but no refresh token found.")
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Authentication session expired, and no refresh token available. Please re-authenticate."
+                )
+            try:
+                credentials = await self.refresh(user_email)
+            except HTTPException:
+                raise
+            except google.auth.exceptions.RefreshError as e:
+                print(f"Failed to refresh Google token for {user_email}: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail=f"Failed to refresh Google token ({e}). Please re-authenticate."
+                )
+            except Exception as e:
+                print(f"Unexpected error refreshing Google token for {user_email}: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"An unexpected error occurred during token refresh: {e}"
+                )
+
+        if not credentials.valid:
+            print(f"Google token is invalid for {user_email} even after refresh check.")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid Google credentials. Please re-authenticate."
+            )
+        credentials_cache.set(user_email, credentials)
+        return credentials
+
+
+class TokenRenewalScheduler:
+    """Background task that renews tokens of recently active users before they expire.
+
+    "Recently active" means present in this worker's credentials cache, so tokens of
+    users who stopped using the app are left alone.
+    """
+
+    def __init__(self, refresher: TokenRefresher, interval_seconds: float, renew_ahead_seconds: float):
+        self.refresher = refresher
+        self.interval_seconds = interval_seconds
+        self.renew_ahead_seconds = renew_ahead_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await self.renew_expiring()
+
+    async def renew_expiring(self):
+        for user_email, entry in credentials_cache.entries().items():
+            if not entry.credentials.refresh_token or not entry.expires_within(self.renew_ahead_seconds):
+                continue
+            try:
+                await self.refresher.refresh(user_email)
+            except Exception as e:
+                # Drop it from the cache so the next request goes through the normal path
+                print(f"Background renewal failed for {user_email}: {e}")
+                credentials_cache.invalidate(user_email)
+
+
+token_refresher = TokenRefresher()
+token_renewal_scheduler = TokenRenewalScheduler(
+    token_refresher,
+    interval_seconds=TOKEN_RENEWAL_INTERVAL_SECONDS,
+    renew_ahead_seconds=TOKEN_RENEW_AHEAD_SECONDS,
+)
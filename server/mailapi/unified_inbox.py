@@ -0,0 +1,101 @@
+import base64
+import heapq
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database_models.models import Profile, UserGoogleToken
+
+from . import mail_store
+
+# Unified inbox: one thread list across every Google account linked to a profile. Each
+# account's page is fetched concurrently with its own credentials, then the (date-sorted)
+# pages are k-way merged. The page cursor records where each account stands, so the next
+# page picks up every account exactly where the merge left it.
+
+UNIFIED_INBOX_MAX_ACCOUNTS = int(os.getenv("UNIFIED_INBOX_MAX_ACCOUNTS", "10"))
+
+# Where an account stands: (source, token, skip). source is 'store' (token is a store cursor)
+# or 'gmail' (token is a threads.list pageToken, skip how many of that page were already served).
+AccountPosition = Tuple[str, Optional[str], int]
+
+
+async def linked_accounts(db: AsyncSession, user_email: str) -> List[str]:
+    """Google accounts linked to the user's profile, the user's own first."""
+    result = await db.execute(
+        select(UserGoogleToken.user_email)
+        .join(Profile, UserGoogleToken.profile_id == Profile.id)
+        .where(Profile.user_email == user_email)
+        .order_by(UserGoogleToken.created_at)
+    )
+    linked = [email for email in result.scalars().all() if email != user_email]
+    return ([user_email] + linked)[:UNIFIED_INBOX_MAX_ACCOUNTS]
+
+
+def encode_unified_cursor(positions: Dict[str, AccountPosition]) -> str:
+    raw = json.dumps({'a': {email: list(position) for email, position in positions.items()}}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_unified_cursor(cursor: str) -> Optional[Dict[str, AccountPosition]]:
+    """Positions per account, or None if this is not a unified cursor. Accounts left out are exhausted."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return {email: (source, token, int(skip)) for email, (source, token, skip) in data['a'].items()}
+    except Exception:
+        return None
+
+
+class AccountPage:
+    """One account's slice of a unified page: threads (newest first) and how to continue after them."""
+
+    def __init__(self, account: str, position: AccountPosition, threads: List, next_token: Optional[str]):
+        self.account = account
+        self.source, self.token, self.skip = position
+        self.threads = threads # Already past `skip`; each has latest_message_timestamp
+        self.next_token = next_token # Token of the page after this one, if any
+
+    @property
+    def has_more(self) -> bool:
+        return self.next_token is not None
+
+    def position_after(self, consumed: int) -> Optional[AccountPosition]:
+        """Where this account continues once `consumed` of its threads were served; None when it's done."""
+        if consumed < len(self.threads):
+            if self.source == 'store':
+                if consumed == 0:
+                    return (self.source, self.token, 0)
+                last = self.threads[consumed - 1]
+                return (self.source, mail_store.encode_cursor(last.latest_message_timestamp, last.id), 0)
+            return (self.source, self.token, self.skip + consumed)
+        if self.next_token is None:
+            return None
+        return (self.source, self.next_token, 0)
+
+
+def merge_account_pages(pages: List[AccountPage], limit: int) -> Tuple[List[Tuple[str, object]], Dict[str, int]]:
+    """k-way merge of per-account pages by latest message date, newest first.
+
+    Stops at `limit` threads, or as soon as an account that has more threads than it loaded
+    runs out of loaded ones (its next page may well be newer than what the others have left).
+    Returns [(account, thread)] and how many threads each account contributed.
+    """
+    def stream(page_index: int, page: AccountPage):
+        for position, thread in enumerate(page.threads):
+            yield thread.latest_message_timestamp or 0, page_index, position, page.account, thread
+
+    streams = [stream(page_index, page) for page_index, page in enumerate(pages)]
+    remaining = {page.account: len(page.threads) for page in pages}
+    has_more = {page.account: page.has_more for page in pages}
+    consumed = {page.account: 0 for page in pages}
+    merged = []
+    for _, _, _, account, thread in heapq.merge(*streams, key=lambda item: (-item[0], item[1], item[2])):
+        merged.append((account, thread))
+        consumed[account] += 1
+        remaining[account] -= 1
+        if len(merged) >= limit or (remaining[account] == 0 and has_more[account]):
+            break
+    return merged, consumed
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Text, JSON, Integer, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, String, Text, JSON, Integer, BigInteger, Float, DateTime, ForeignKey, Boolean, Index, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func # For server_default=func.now()
 
@@ -33,6 +34,7 @@ class UserGoogleToken(Base):
     client_id = Column(String, nullable=False)
     client_secret = Column(String, nullable=False)
     scopes = Column(JSON, nullable=False)
+    expiry = Column(DateTime, nullable=True) # Access token expiry (naive UTC, as google-auth uses)
 
     profile_id = Column(Integer, ForeignKey('profiles.id'), nullable=True, index=True) 
     profile = relationship("Profile", back_populates="google_tokens")
@@ -48,7 +50,8 @@ class UserGoogleToken(Base):
             "token_uri": self.token_uri,
             "client_id": self.client_id,
             "client_secret": self.client_secret,
-            "scopes": self.scopes
+            "scopes": self.scopes,
+            "expiry": self.expiry
         }
 
     @classmethod
@@ -60,7 +63,8 @@ class UserGoogleToken(Base):
             token_uri=data.get("token_uri"),
             client_id=data.get("client_id"),
             client_secret=data.get("client_secret"),
-            scopes=data.get("scopes", [])
+            scopes=data.get("scopes", []),
+            expiry=data.get("expiry")
         )
 
 class Todo(Base):
@@ -78,4 +82,209 @@ class Todo(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     def __repr__(self):
-        return f"<Todo(id={self.id}, title='{self.title}', completed={self.completed})>" 
\ No newline at end of file
+        return f"<Todo(id={self.id}, title='{self.title}', completed={self.completed})>" 
+
+# --- Local Gmail metadata store ---
+# Mirrors the metadata of a user's mailbox so list endpoints can be served without
+# calling Gmail. Ids are Gmail's own (unique per mailbox), so every key includes user_email.
+
+# Full-text search document for a stored message: subject ranks highest, then addresses,
+# snippet and body. 'simple' (no stemming) so prefix typeahead matches what was typed;
+# addresses are split on @ . < > so "alice exam" finds Alice <alice.smith@example.com>
+# (the parser would otherwise read <...> as a markup tag and drop it).
+GMAIL_MESSAGE_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(subject, '')), 'A') || "
+    "setweight(to_tsvector('simple', translate(coalesce(from_addr, '') || ' ' || coalesce(to_addr, '') || ' ' || coalesce(cc_addr, ''), '@.<>', '    ')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(snippet, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(body_text, '')), 'D')"
+)
+
+class GmailMessage(Base):
+    __tablename__ = "gmail_messages"
+
+    user_email = Column(String, primary_key=True)
+    id = Column(String, primary_key=True) # Gmail message id
+    thread_id = Column(String, nullable=False)
+    label_ids = Column(JSON, nullable=False, default=list)
+    history_id = Column(BigInteger, nullable=True)
+    internal_date = Column(BigInteger, nullable=True) # Milliseconds since epoch, as Gmail reports it
+    snippet = Column(Text, nullable=True)
+
+    # Parsed headers
+    subject = Column(Text, nullable=True)
+    from_addr = Column(Text, nullable=True)
+    to_addr = Column(Text, nullable=True)
+    cc_addr = Column(Text, nullable=True)
+    date_header = Column(String, nullable=True)
+
+    body_text = Column(Text, nullable=True) # Plain text of the body (truncated), for search only
+    search_vector = Column(TSVECTOR, Computed(GMAIL_MESSAGE_SEARCH_VECTOR, persisted=True))
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_gmail_messages_user_thread", "user_email", "thread_id"),
+        Index("ix_gmail_messages_user_internal_date", "user_email", "internal_date"),
+        Index("ix_gmail_messages_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
+    def __repr__(self):
+        return f"<GmailMessage(user_email='{self.user_email}', id='{self.id}', thread_id='{self.thread_id}')>"
+
+
+class GmailMessageLabel(Base):
+    """One row per (message, label); the index behind label-filtered listing."""
+    __tablename__ = "gmail_message_labels"
+
+    user_email = Column(String, primary_key=True)
+    message_id = Column(String, primary_key=True)
+    label_id = Column(String, primary_key=True)
+    thread_id = Column(String, nullable=False)
+    internal_date = Column(BigInteger, nullable=True) # Denormalized from the message for index-only ordering
+
+    __table_args__ = (
+        # In the exact order list pages read (newest first, NULL dates last), so a page is a range scan
+        Index("ix_gmail_message_labels_user_label_date", "user_email", "label_id", internal_date.desc().nulls_last(), message_id.desc()),
+        Index("ix_gmail_message_labels_user_thread_label", "user_email", "thread_id", "label_id"),
+    )
+
+
+class GmailThread(Base):
+    """Per-thread aggregate, recomputed from gmail_messages whenever its messages change."""
+    __tablename__ = "gmail_threads"
+
+    user_email = Column(String, primary_key=True)
+    id = Column(String, primary_key=True) # Gmail thread id
+    history_id = Column(BigInteger, nullable=True) # Highest historyId among its messages
+    snippet = Column(Text, nullable=True)
+    message_count = Column(Integer, nullable=False, default=0)
+    label_ids = Column(JSON, nullable=False, default=list) # Union of its messages' labels
+
+    # Latest message in the thread
+    latest_message_id = Column(String, nullable=True)
+    latest_message_subject = Column(Text, nullable=True)
+    latest_message_from = Column(Text, nullable=True)
+    latest_message_date = Column(String, nullable=True)
+    latest_internal_date = Column(BigInteger, nullable=True)
+
+    # Ranking for order=importance (see thread_ranking.py); cleared whenever the row is recomputed
+    importance = Column(Float, nullable=True)
+    owes_reply = Column(Boolean, nullable=True) # The last word is someone else's and they expect an answer
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_gmail_threads_user_latest_internal_date", "user_email", latest_internal_date.desc().nulls_last(), id.desc()),
+        # Ranked reads only run once every thread is scored, so unscored rows stay out of the index
+        Index("ix_gmail_threads_user_importance", "user_email", importance.desc().nulls_last(), id.desc(),
+              postgresql_where=importance.is_not(None)),
+    )
+
+
+class GmailBackfillState(Base):
+    """Progress of a full-mailbox backfill into the metadata store, checkpointed after every page."""
+    __tablename__ = "gmail_backfill_state"
+
+    user_email = Column(String, primary_key=True)
+    status = Column(String, nullable=False, default="pending") # pending, running, done or failed
+    generation = Column(Integer, nullable=False, default=0, server_default='0') # Bumped on restart; an older run stops at its next checkpoint
+    page_token = Column(String, nullable=True) # messages.list pageToken of the next page to walk (None: from the top)
+    history_id = Column(BigInteger, nullable=True) # Mailbox historyId when the walk started; everything listed is at least this old
+    messages_total = Column(Integer, nullable=True) # getProfile's messagesTotal, for progress
+    messages_listed = Column(Integer, nullable=False, default=0, server_default='0')
+    messages_stored = Column(Integer, nullable=False, default=0, server_default='0') # Newly inserted; the rest were in the store already
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class GmailMessageSummary(Base):
+    """LLM summary of one message's normalized text, keyed by content so identical text is summarized once."""
+    __tablename__ = "gmail_message_summaries"
+
+    user_email = Column(String, primary_key=True)
+    content_hash = Column(String, primary_key=True) # sha256 of the normalized text, model and prompt version
+    summary = Column(Text, nullable=False)
+    model = Column(String, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class GmailThreadSummary(Base):
+    """Rolled-up summary of a thread, and which message contents it covers (to extend it with new ones only)."""
+    __tablename__ = "gmail_thread_summaries"
+
+    user_email = Column(String, primary_key=True)
+    thread_id = Column(String, primary_key=True)
+    content_hash = Column(String, nullable=False) # sha256 over the covered messages' content hashes, in order
+    message_hashes = Column(JSON, nullable=False, default=list) # [[message_id, content_hash], ...] oldest first
+    summary = Column(Text, nullable=False)
+    model = Column(String, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class GmailContact(Base):
+    """Someone the user corresponds with, aggregated incrementally from synced messages."""
+    __tablename__ = "gmail_contacts"
+
+    user_email = Column(String, primary_key=True)
+    address = Column(String, primary_key=True) # Lowercased email address
+    name = Column(String, nullable=True) # Display name from the latest header that had one
+    sent_count = Column(Integer, nullable=False, default=0) # Messages the user sent them (To or Cc)
+    received_count = Column(Integer, nullable=False, default=0) # Messages they sent the user
+    thread_count = Column(Integer, nullable=False, default=0) # Threads they take part in
+    last_sent_at = Column(BigInteger, nullable=True) # internalDate (ms) of the latest message to them
+    last_received_at = Column(BigInteger, nullable=True) # ... and from them
+    my_reply_count = Column(Integer, nullable=False, default=0) # User's replies to their messages, and the summed delay
+    my_reply_ms = Column(BigInteger, nullable=False, default=0)
+    their_reply_count = Column(Integer, nullable=False, default=0) # Their replies to the user's messages
+    their_reply_ms = Column(BigInteger, nullable=False, default=0)
+    # log of the sum of exp(message time / decay) over interactions: ordering by it is ordering by
+    # the recency-weighted score at any moment, and a new message is folded in with a log-add-exp
+    log_score = Column(Float, nullable=False)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_gmail_contacts_user_log_score", "user_email", "log_score"),
+    )
+
+
+class GmailContactEdge(Base):
+    """Two contacts appearing on the same message (address_a < address_b)."""
+    __tablename__ = "gmail_contact_edges"
+
+    user_email = Column(String, primary_key=True)
+    address_a = Column(String, primary_key=True)
+    address_b = Column(String, primary_key=True)
+    message_count = Column(Integer, nullable=False, default=0)
+    last_at = Column(BigInteger, nullable=True)
+
+    __table_args__ = (
+        Index("ix_gmail_contact_edges_user_address_b", "user_email", "address_b"),
+    )
+
+
+class GmailSyncState(Base):
+    """Per-mailbox sync bookkeeping. The store is only served once synced_at is set.
+
+    history_id alone means the sync keeps the stored messages current, not that all of the
+    mailbox is stored: synced_at waits for a full sync that listed everything, or the backfill.
+    """
+    __tablename__ = "gmail_sync_state"
+
+    user_email = Column(String, primary_key=True)
+    history_id = Column(BigInteger, nullable=True) # Mailbox historyId the stored data is current as of
+    synced_at = Column(DateTime(timezone=True), nullable=True) # When the store first held the whole mailbox
+    watch_expiration = Column(DateTime(timezone=True), nullable=True) # When the users.watch push subscription lapses
+    local_revision = Column(BigInteger, nullable=False, default=0, server_default='0') # Bumped by optimistic local writes, which don't move history_id
+    contacts_indexed_at = Column(DateTime(timezone=True), nullable=True) # Set once gmail_contacts was built from the store; kept current from then on
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())